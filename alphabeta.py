@@ -0,0 +1,163 @@
+import itertools
+from compactboard import CompactBoard
+from timebudget import SearchTimeout, check_deadline
+import scoring
+
+# the value of a position where our whole team is dead
+LOSS = -100000
+
+
+# Paranoid alpha-beta search over the joint moves of a team
+# our team picks a joint move, then the enemy team answers knowing it, which makes the search pessimistic,
+# and then the moves of all snakes are resolved at once on a CompactBoard
+# the search deepens one turn at a time until the deadline and returns the moves of the deepest finished turn
+class AlphaBetaEngine():
+    def __init__(self, max_depth=10, death_penalty=1000, kill_reward=100, territory_mode="manhattan"):
+        self.max_depth = max_depth
+        self.death_penalty = death_penalty
+        self.kill_reward = kill_reward
+        self.territory_mode = territory_mode
+        # the index of the best joint move found for a position, searched first the next time
+        self.best_moves = {}
+        self.nodes = 0
+
+    # returns a dict from client id to move for the living snakes of team_ids, and information about the search
+    def search(self, board, team_ids, deadline=None):
+        root = CompactBoard.from_board(board)
+        self.team = [root.get_index(client_id) for client_id in team_ids if root.is_alive(root.get_index(client_id))]
+        self.enemies = [index for index in range(len(root.client_ids)) if index not in self.team and root.is_alive(index)]
+        self.root_territory = root.get_territory_size(self.team, self.territory_mode)
+        self.best_moves = {}
+        self.nodes = 0
+
+        if len(self.team) == 0:
+            return {}, {"depth": 0, "nodes": 0, "value": LOSS}
+
+        best_value, best_joint_move = self.search_root(root, 1, None)
+        searched_depth = 1
+        for depth in range(2, self.max_depth + 1):
+            try:
+                best_value, best_joint_move = self.search_root(root, depth, deadline)
+            except SearchTimeout:
+                break
+            searched_depth = depth
+            # the outcome is decided, searching deeper will not change it
+            if best_value <= LOSS // 2:
+                break
+
+        moves = {root.client_ids[index]: move for index, move in zip(self.team, best_joint_move)}
+        info = {
+            "depth": searched_depth,
+            "nodes": self.nodes,
+            "value": float(best_value),
+        }
+        return moves, info
+
+    def search_root(self, board, depth, deadline):
+        best_value = None
+        best_joint_move = None
+        alpha = LOSS * 2
+        for i, joint_move in self.order_moves(board, self.get_team_moves(board)):
+            value = self.min_value(board, joint_move, depth, alpha, -LOSS * 2, deadline)
+            if best_value is None or value > best_value:
+                best_value = value
+                best_joint_move = joint_move
+                self.best_moves[board.get_key()] = i
+            alpha = max(alpha, value)
+        return best_value, best_joint_move
+
+    # our team's turn
+    def max_value(self, board, depth, alpha, beta, deadline):
+        check_deadline(deadline)
+        self.nodes += 1
+        if depth == 0 or not any(board.is_alive(index) for index in self.team):
+            return self.evaluate(board)
+
+        value = None
+        for i, joint_move in self.order_moves(board, self.get_team_moves(board)):
+            move_value = self.min_value(board, joint_move, depth, alpha, beta, deadline)
+            if value is None or move_value > value:
+                value = move_value
+                self.best_moves[board.get_key()] = i
+            alpha = max(alpha, value)
+            if alpha >= beta:
+                break
+        return value
+
+    # the enemy team's answer to our joint move, after which the turn is resolved
+    def min_value(self, board, team_move, depth, alpha, beta, deadline):
+        moves = dict(zip(self.team, team_move))
+        value = None
+        for enemy_move in self.get_enemy_moves(board, depth):
+            moves.update(zip(self.enemies, enemy_move))
+            move_value = self.max_value(board.step(moves), depth - 1, alpha, beta, deadline)
+            if value is None or move_value < value:
+                value = move_value
+            beta = min(beta, value)
+            if alpha >= beta:
+                break
+        return value
+
+    # the joint moves of our living snakes, a dead snake's move is ignored by CompactBoard.step
+    def get_team_moves(self, board):
+        occupied = board.get_occupied()
+        return list(itertools.product(*[board.get_moves(index, occupied) or ["up"] for index in self.team]))
+
+    # the joint moves of the enemies, moves towards our snakes first, as those are the most dangerous
+    # an enemy that is too far away from our snakes to reach them within the search only gets its first move
+    def get_enemy_moves(self, board, depth):
+        occupied = board.get_occupied()
+        our_heads = [board.bodies[index][0] for index in self.team if board.is_alive(index)]
+        enemy_moves = []
+        for index in self.enemies:
+            moves = board.get_moves(index, occupied)
+            if len(moves) == 0:
+                enemy_moves.append(["up"])
+                continue
+            head = board.bodies[index][0]
+            distance = min([abs(head[0] - x) + abs(head[1] - y) for x, y in our_heads] or [0])
+            moves = sorted(moves, key=lambda move: self.get_distance_after_move(head, move, our_heads))
+            if distance > 2 * depth + 1:
+                moves = moves[:1]
+            enemy_moves.append(moves)
+        return list(itertools.product(*enemy_moves))
+
+    @staticmethod
+    def get_distance_after_move(head, move, heads):
+        offset = {"up": (0, 1), "down": (0, -1), "left": (-1, 0), "right": (1, 0)}[move]
+        x, y = head[0] + offset[0], head[1] + offset[1]
+        return min([abs(x - hx) + abs(y - hy) for hx, hy in heads] or [0])
+
+    # the best joint move found for the position before is searched first
+    def order_moves(self, board, joint_moves):
+        ordered = list(enumerate(joint_moves))
+        best = self.best_moves.get(board.get_key())
+        if best is not None and best < len(ordered):
+            ordered.insert(0, ordered.pop(best))
+        return ordered
+
+    # scores a position with the weights of SnakeDuo's final_move_scoring_function for every living snake of our team,
+    # with the territory increase since the start of the search
+    # the food fraction is 1 when food is close and 0 when it is far away
+    def evaluate(self, board):
+        if not any(board.is_alive(index) for index in self.team):
+            return LOSS
+
+        increase_in_territory = board.get_territory_size(self.team, self.territory_mode) - self.root_territory
+        value = 0
+        for index in self.team:
+            if not board.is_alive(index):
+                value -= self.death_penalty
+                continue
+            food_distance_fraction = 1 - board.distance_to_closest_food(index) / (board.width + board.height)
+            food_weight, territory_weight, edge_weight = scoring.get_move_weights(
+                food_distance_fraction,
+                increase_in_territory,
+                board.distance_to_edge(index),
+                board.healths[index]
+            )
+            value += food_weight + territory_weight + edge_weight
+        for index in self.enemies:
+            if not board.is_alive(index):
+                value += self.kill_reward
+        return value
@@ -0,0 +1,96 @@
+import json
+import time
+import traceback
+import gamestate
+
+
+# An ASGI application with the routes of NetworkManager's Flask app, served by an asyncio server like uvicorn
+# a request waits for its game worker on the event loop, so no thread is parked per request,
+# and the server keeps connections alive between the requests of a game
+class BattlesnakeApp():
+    def __init__(self, network_manager):
+        self.network_manager = network_manager
+        self.game_workers = network_manager.game_workers
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+
+        start = time.time()
+        try:
+            route, status, response = await self.handle(scope, receive, start)
+        except Exception as e:
+            traceback.print_exc()
+            route, status, response = None, 500, str(e)
+
+        if isinstance(response, (dict, list)):
+            body = json.dumps(response).encode("utf-8")
+            content_type = b"application/json"
+        else:
+            body = str(response).encode("utf-8")
+            content_type = b"text/html; charset=utf-8"
+
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (b"content-type", content_type),
+                (b"content-length", str(len(body)).encode()),
+                (b"server", b"Battlesnake"),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+        if route is not None:
+            self.network_manager.record_latency(route, (time.time() - start) * 1000)
+
+    # returns the name of the route, which is the name of its Flask endpoint, the status and the response
+    # start is when the request was received, the turn's time budget starts then
+    async def handle(self, scope, receive, start):
+        method = scope["method"]
+        parts = [part for part in scope["path"].split("/") if part != ""]
+
+        if method == "GET" and parts == ["ping"]:
+            return "ping", 200, "pong"
+        if method == "GET" and parts == ["stats"]:
+            return None, 200, self.network_manager.get_latency_stats()
+        if method == "GET" and len(parts) == 1:
+            return "on_info", 200, self.network_manager.get_info(parts[0])
+
+        if method == "POST" and len(parts) == 2 and parts[1] in ["start", "move", "end"]:
+            snake_id, request_type = parts
+            body = await self.read_body(receive)
+            request_header = gamestate.read_header(body)
+            game_id = request_header["game"]["id"]
+            if request_type == "start":
+                response = await self.game_workers.start_async(game_id, snake_id, request_header, body)
+            elif request_type == "move":
+                response = await self.game_workers.move_async(game_id, snake_id, request_header, body, start)
+            else:
+                response = await self.game_workers.end_async(game_id, snake_id, request_header, body)
+            return "on_" + request_type, 200, response
+
+        return None, 404, "Not Found"
+
+    @staticmethod
+    async def read_body(receive):
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body", False):
+                return body
+
+    # the pools are closed at exit by NetworkManager
+    @staticmethod
+    async def lifespan(receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
@@ -0,0 +1,591 @@
+import gzip
+import json
+import pickle
+import os
+import sys
+import tempfile
+import threading
+import time
+import random
+import tracemalloc
+import numpy as np
+from PIL import Image, ImageDraw
+from multiprocessing import Pool
+from board import GeneralBoard
+from bitboard import BitBoard
+from snake import Snake
+from mcts import MCTSEngine
+import zobrist
+import encoding
+import gamestate
+import journal
+import replayfile
+from history import BoardHistory
+
+
+# builds a game state with snakes lying in straight lines, spread out over the board
+def make_game_state(width, height, snake_count=2, length=4):
+    snakes = []
+    for i in range(snake_count):
+        x = (i + 1) * width // (snake_count + 1)
+        body = [{"x": x, "y": min(height - 1, height // 2 + j)} for j in range(length)]
+        snakes.append({
+            "id": "snake-" + str(i),
+            "name": "Snake " + str(i),
+            "health": 100,
+            "body": body,
+            "head": body[0],
+            "length": length,
+            "customizations": {"color": "#ff4e03"},
+        })
+    return {
+        "turn": 0,
+        "board": {
+            "width": width,
+            "height": height,
+            "snakes": snakes,
+            "food": [{"x": 0, "y": 0}, {"x": width - 1, "y": height - 1}],
+            "hazards": [],
+        },
+    }
+
+
+# places the snakes of a game state on a new board, the same way the notebook does
+def load_board(board_class, game_state):
+    board_state = game_state["board"]
+    board = board_class(board_state["width"], board_state["height"])
+    for food in board_state["food"]:
+        board.get_cell(food["x"], food["y"]).set_food(True)
+    for hazard in board_state["hazards"]:
+        board.get_cell(hazard["x"], hazard["y"]).set_hazard(True)
+
+    snakes = []
+    for snake_info in board_state["snakes"]:
+        snake = Snake(snake_info["id"])
+        snake.board = board
+        board.add_snake(snake, place=False)
+        snakes.append((snake, snake_info))
+    for snake, snake_info in snakes:
+        snake.update_state(snake_info)
+        snake.place_on_board(board, add=False)
+    return board
+
+
+# the 3-ply benchmark from main.ipynb, returns the duration in ms
+def subboard_benchmark(board):
+    start = time.time()
+    subboards = board.get_possible_subboards()
+    for subboard in subboards:
+        next_subboards = subboard.get_possible_subboards()
+        for next_subboard in next_subboards:
+            next_subboard.get_possible_subboards()
+    end = time.time()
+    return (end - start) * 1000
+
+
+# the time of a single move_snake, on copies of the board so every snake moves from the same state,
+# and of a single get_possible_subboards, in microseconds
+def move_benchmark(game_state, move="down", repeats=200):
+    results = {}
+    for board_class in [GeneralBoard, BitBoard]:
+        board = load_board(board_class, game_state)
+        snake_ids = [snake.client_id for snake in board.snakes if not snake.is_dead]
+        copies = [board.copy() for _ in range(repeats)]
+
+        start = time.time()
+        for copy in copies:
+            for snake_id in snake_ids:
+                copy.move_snake(copy.snake_map[snake_id], move)
+        middle = time.time()
+        for _ in range(repeats // 10):
+            board.get_possible_subboards()
+        end = time.time()
+
+        results[board_class.__name__] = {
+            "move_us": (middle - start) * 1e6 / (repeats * len(snake_ids)),
+            "subboards_us": (end - middle) * 1e6 / (repeats // 10),
+        }
+    return results
+
+
+def compare_engines(game_state, repeats=3):
+    results = {}
+    for board_class in [GeneralBoard, BitBoard]:
+        durations = []
+        for _ in range(repeats):
+            board = load_board(board_class, game_state)
+            durations.append(subboard_benchmark(board))
+        results[board_class.__name__] = min(durations)
+    return results
+
+
+def print_comparison(name, results):
+    speedup = results["GeneralBoard"] / results["BitBoard"]
+    print(f"{name:>24}  GeneralBoard {results['GeneralBoard']:9.1f} ms  BitBoard {results['BitBoard']:9.1f} ms  ({speedup:.1f}x)")
+
+
+# compares the bounded death timer (Snake.find_survival_depth) with the full depth search
+# on the game states SnakeDuo saves in ./game_states, every move of every snake is checked
+# both are timed without the transposition table, and checked against the futures of Snake.alternative_futures
+def death_timer_benchmark(directory="./game_states", board_class=BitBoard, max_depth=10):
+    game_states = (game_state for path in journal.find_games(directory) for game_state in journal.read_game(path))
+    results = {"states": 0, "moves": 0, "agreed": 0, "decided_by_bounds": 0, "search_ms": 0, "bounded_ms": 0}
+    for game_state in game_states:
+        board = load_board(board_class, game_state)
+        results["states"] += 1
+        for snake in board.snakes:
+            if snake.is_dead:
+                continue
+            for move in ["up", "down", "left", "right"]:
+                zobrist.transposition_table.clear()
+                start = time.time()
+                snake.search_survival_depth(move, max_depth)
+                middle = time.time()
+                zobrist.transposition_table.clear()
+                bounded = snake.find_survival_depth(move, max_depth)
+                end = time.time()
+                _, lower_bound, upper_bound = snake.get_survival_bounds(move, max_depth)
+                expected = len(snake.alternative_futures(move, max_depth=max_depth))
+
+                results["moves"] += 1
+                results["agreed"] += bounded == expected
+                results["decided_by_bounds"] += lower_bound == upper_bound
+                results["search_ms"] += (middle - start) * 1000
+                results["bounded_ms"] += (end - middle) * 1000
+    return results
+
+
+def print_death_timer_benchmark(results):
+    moves = max(1, results["moves"])
+    print(f"{results['states']} states, {results['moves']} moves")
+    print(f"agreement with the futures: {results['agreed'] / moves * 100:.1f}%")
+    print(f"decided by the bounds:      {results['decided_by_bounds'] / moves * 100:.1f}%")
+    print(f"search  {results['search_ms']:9.1f} ms")
+    print(f"bounded {results['bounded_ms']:9.1f} ms  ({results['search_ms'] / max(results['bounded_ms'], 1e-9):.1f}x)")
+
+
+# a death timer search in a worker, without the worker's transposition table
+def run_death_timer(task):
+    snake, move = task
+    zobrist.transposition_table.clear()
+    return snake.get_death_timer(move)
+
+
+# compares the playouts per second of MCTSEngine with the death timer searches per second of worker_pool.map,
+# both on a pool of the same size
+def engine_throughput_benchmark(game_state, duration=1.0, workers=4):
+    board = load_board(BitBoard, game_state)
+    team_ids = [snake.client_id for snake in board.snakes[:2]]
+    results = {}
+    with Pool(processes=workers) as pool:
+        engine = MCTSEngine(pool=pool, workers=workers)
+        _, info = engine.search(board, team_ids, time.time() + duration)
+        results["playouts_per_second"] = info["playouts_per_second"]
+
+        searches = 0
+        start = time.time()
+        while time.time() - start < duration:
+            pool.map(run_death_timer, [(board.snakes[0], move) for move in ["up", "down", "left", "right"]])
+            searches += 4
+        results["death_timers_per_second"] = searches / (time.time() - start)
+    return results
+
+
+# bytes per task and serialisation time of a pickled bound method, the way the worker tasks used to be sent,
+# and of the board encoding the worker tasks are sent as now
+def ipc_benchmark(game_state, repeats=100):
+    results = {}
+    for board_class in [GeneralBoard, BitBoard]:
+        board = load_board(board_class, game_state)
+        snake = board.snakes[0]
+
+        start = time.time()
+        for _ in range(repeats):
+            pickled = pickle.dumps((snake.get_death_timer, "up"))
+        middle = time.time()
+        for _ in range(repeats):
+            encoded = pickle.dumps(("get_death_timer", encoding.encode_board(board), snake.client_id, "up", {}))
+        end = time.time()
+
+        results[board_class.__name__] = {
+            "pickled_bytes": len(pickled),
+            "pickled_ms": (middle - start) * 1000 / repeats,
+            "encoded_bytes": len(encoded),
+            "encoded_ms": (end - middle) * 1000 / repeats,
+        }
+    return results
+
+
+# the latency of /start requests when games start in waves of concurrent games, like on a busy server
+# the four snakes of a game start at the same time, play a turn and end, replays are written to a temporary directory
+def start_latency_benchmark(games=40, concurrency=4, wave_interval=0.5, **pool_options):
+    from computepool import ComputePool
+    from networkmanager import GameWorkerPool
+    from replay import ReplayRenderer
+    compute_pool = ComputePool()
+    replay_renderer = ReplayRenderer()
+    game_workers = GameWorkerPool(compute_pool, replay_renderer, **pool_options)
+    # the workers that exist when the first game starts
+    time.sleep(1)
+    latencies = []
+    lock = threading.Lock()
+
+    def request(game_state, snake_id, index, request_type, turn):
+        state = dict(game_state, turn=turn, you=game_state["board"]["snakes"][index])
+        start = time.time()
+        getattr(game_workers, request_type)(state["game"]["id"], snake_id, state)
+        if request_type == "start":
+            with lock:
+                latencies.append((time.time() - start) * 1000)
+
+    def play(game_number):
+        game_state = make_game_state(11, 11, snake_count=4)
+        game_state["game"] = {"id": "%03d-benchmark" % game_number, "timeout": 500}
+        for request_type, turn in [("start", 0), ("move", 1), ("end", 1)]:
+            threads = [threading.Thread(target=request, args=(game_state, str(i + 1), i, request_type, turn)) for i in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+    directory = os.getcwd()
+    with tempfile.TemporaryDirectory() as temporary_directory:
+        os.chdir(temporary_directory)
+        try:
+            for wave in range(0, games, concurrency):
+                threads = [threading.Thread(target=play, args=(game_number,)) for game_number in range(wave, min(games, wave + concurrency))]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                time.sleep(wave_interval)
+        finally:
+            os.chdir(directory)
+            game_workers.close()
+            replay_renderer.close()
+            compute_pool.close()
+
+    return {
+        "starts": len(latencies),
+        "p50": float(np.percentile(latencies, 50)),
+        "p99": float(np.percentile(latencies, 99)),
+        "max": max(latencies),
+    }
+
+
+# the way GeneralBoard.convert_to_image drew boards before rasterizer.rasterize, with an ImageDraw call per cell and layer
+def draw_board(board, cell_size=25):
+    img = Image.new('RGB', (board.width*cell_size, board.height*cell_size), color = 'white')
+    draw = ImageDraw.Draw(img)
+
+    # draw grid
+    for x in range(board.width):
+        for y in range(board.height):
+            draw.rectangle((x*cell_size, y*cell_size, x*cell_size+cell_size, y*cell_size+cell_size), fill='white', outline='black')
+
+    # draw optional colors
+    for x in range(board.width):
+        for y in range(board.height):
+            if board.cells[x][y].color:
+                draw.rectangle((x*cell_size, y*cell_size, x*cell_size+cell_size, y*cell_size+cell_size), fill=board.cells[x][y].color, outline='black')
+
+    for x in range(board.width):
+        for y in range(board.height):
+            # fill in color of closest snake, but slightly lighter
+            if board.cells[x][y].closest_snakes is not None and len(board.cells[x][y].closest_snakes) > 0:
+                snakes_are_all_same_team = True
+                team = board.cells[x][y].closest_snakes[0].is_enemy
+                for snake in board.cells[x][y].closest_snakes:
+                    if not snake.is_enemy == team:
+                        snakes_are_all_same_team = False
+                        break
+
+                if snakes_are_all_same_team: 
+                    shade = 0.7
+                    color = board.cells[x][y].closest_snakes[0].color
+                    color = color.lstrip('#')
+                    rgb = tuple(int(color[i:i+2], 16) for i in (0, 2, 4))
+                    new_rgb = tuple([int((255 - rgb[i]) * shade + rgb[i]) for i in range(3)])
+                    new_color = '#%02x%02x%02x' % new_rgb
+                    draw.rectangle((x*cell_size, y*cell_size, x*cell_size+cell_size, y*cell_size+cell_size), fill=new_color, outline='black')
+
+            # # write closest snake distance to cell
+            # if board.cells[x][y].closest_snake_distance is not None:
+            #     draw.text((x*cell_size+0.1*cell_size, y*cell_size+0.1*cell_size), str(board.cells[x][y].closest_snake_distance), fill='black')
+
+
+
+    # draw food, small green circle
+    for x in range(board.width):
+        for y in range(board.height):
+            if board.cells[x][y].food:
+                draw.ellipse((x*cell_size+0.2*cell_size, y*cell_size+0.2*cell_size, x*cell_size+0.8*cell_size, y*cell_size+0.8*cell_size), fill='green', outline='green')
+
+    # draw hazards, small red circle
+    for x in range(board.width):
+        for y in range(board.height):
+            if board.cells[x][y].hazard:
+                draw.ellipse((x*cell_size+0.2*cell_size, y*cell_size+0.2*cell_size, x*cell_size+0.8*cell_size, y*cell_size+0.8*cell_size), fill='red', outline='red')
+
+    # draw snakes, according to their color, in squares slightly smaller than grid size
+    for x in range(board.width):
+        for y in range(board.height):
+            if board.cells[x][y].snake:
+                snake = board.cells[x][y].snake
+                color = snake.color
+                if board.cells[x][y].is_snake_head:
+                    draw.rectangle((x*cell_size+0.1*cell_size, y*cell_size+0.1*cell_size, x*cell_size+0.9*cell_size, y*cell_size+0.9*cell_size), fill=color, outline=color)
+                else:
+                    draw.rectangle((x*cell_size+0.2*cell_size, y*cell_size+0.2*cell_size, x*cell_size+0.8*cell_size, y*cell_size+0.8*cell_size), fill=color, outline=color)
+
+    # draw smaller black dots in the center of a cell
+    # if it is calculated to be a snakes future
+    for x in range(board.width):
+        for y in range(board.height):
+            if len(board.cells[x][y].future) > 0:
+                draw.ellipse((x*cell_size+0.4*cell_size, y*cell_size+0.4*cell_size, x*cell_size+0.6*cell_size, y*cell_size+0.6*cell_size), fill='black', outline='black')
+
+    return img
+
+
+# the time in ms to draw a frame with convert_to_image, as an image and as an array, and with draw_board,
+# and whether the pixels are the same, with and without the territories of the snakes
+def render_benchmark(game_state, cell_sizes=[50, 25, 10], repeats=50):
+    results = {}
+    for board_class in [GeneralBoard, BitBoard]:
+        for territory in [False, True]:
+            board = load_board(board_class, game_state)
+            if territory:
+                board.calculate_closest_snake()
+            for cell_size in cell_sizes:
+                start = time.time()
+                for _ in range(repeats):
+                    drawn = draw_board(board, cell_size)
+                middle = time.time()
+                for _ in range(repeats):
+                    image = board.convert_to_image(cell_size)
+                end = time.time()
+                for _ in range(repeats):
+                    board.convert_to_image(cell_size, as_array=True)
+                array_end = time.time()
+
+                results[(board_class.__name__, territory, cell_size)] = {
+                    "draw_ms": (middle - start) * 1000 / repeats,
+                    "image_ms": (end - middle) * 1000 / repeats,
+                    "array_ms": (array_end - end) * 1000 / repeats,
+                    "identical": np.array_equal(np.asarray(drawn), np.asarray(image)),
+                }
+    return results
+
+
+# the game states of a long game, the snakes circle around the quarters of the board and grow every 50 turns, as if they ate,
+# food appears and is eaten at random squares and the hazards grow from the left every 100 turns
+def make_long_game(width, height, turns, snake_count=4, seed=0):
+    rng = random.Random(seed)
+    rings = []
+    for i in range(snake_count):
+        left = (i % 2) * (width // 2)
+        top = (i // 2 % 2) * (height // 2)
+        right = left + width // 2 - 1
+        bottom = top + height // 2 - 1
+        ring = [(x, top) for x in range(left, right)] + [(right, y) for y in range(top, bottom)]
+        ring += [(x, bottom) for x in range(right, left, -1)] + [(left, y) for y in range(bottom, top, -1)]
+        rings.append(ring)
+
+    food = set()
+    for turn in range(turns):
+        if rng.random() < 0.3:
+            food.add((rng.randrange(width), rng.randrange(height)))
+        if len(food) > 0 and rng.random() < 0.2:
+            food.discard(rng.choice(sorted(food)))
+        snakes = []
+        for i, ring in enumerate(rings):
+            length = min(len(ring) - 1, 3 + turn // 50)
+            squares = [ring[(turn - j) % len(ring)] for j in range(length)]
+            # a snake that grows keeps its tail for a turn, so the tail is stacked, like after eating
+            if turn > 0 and length > min(len(ring) - 1, 3 + (turn - 1) // 50):
+                squares[-1] = squares[-2]
+            body = [{"x": x, "y": y} for x, y in squares]
+            snakes.append({
+                "id": "snake-" + str(i),
+                "name": "Snake " + str(i),
+                "health": 100 - turn % 50,
+                "body": body,
+                "head": body[0],
+                "length": length,
+                "customizations": {"color": "#ff4e03"},
+            })
+        yield {
+            "turn": turn,
+            "board": {
+                "width": width,
+                "height": height,
+                "snakes": snakes,
+                "food": [{"x": x, "y": y} for x, y in sorted(food)],
+                "hazards": [{"x": x, "y": y} for x in range(min(width, turn // 100)) for y in range(height)],
+            },
+        }
+
+
+# the memory a game's replay keeps, as the copies of its boards and as a BoardHistory, with the territories of the snakes
+# and the time to record a turn, to rebuild a single turn and to rebuild all turns for the replay,
+# and whether the history rebuilds the same boards
+def history_benchmark(turns=500, width=11, height=11, snake_count=4):
+    results = {}
+    for board_class in [GeneralBoard, BitBoard]:
+        boards = []
+        for game_state in make_long_game(width, height, turns, snake_count):
+            board = load_board(board_class, game_state)
+            board.calculate_closest_snake()
+            boards.append(board)
+
+        start = time.time()
+        copies = [board.copy() for board in boards]
+        copies_ms = (time.time() - start) * 1000
+        start = time.time()
+        history = BoardHistory()
+        for turn, board in enumerate(boards):
+            history.record(board, turn)
+        record_ms = (time.time() - start) * 1000
+
+        # the struct module caches the formats the encoding used above, which is memory of the process and not the game's
+        copies = None
+        tracemalloc.start()
+        start_memory = tracemalloc.get_traced_memory()[0]
+        copies = [board.copy() for board in boards]
+        copies_bytes = tracemalloc.get_traced_memory()[0] - start_memory
+        start_memory = tracemalloc.get_traced_memory()[0]
+        history = BoardHistory()
+        for turn, board in enumerate(boards):
+            history.record(board, turn)
+        # without the state the next turn is compared to, which a game keeps only once
+        history.last_state = None
+        history_bytes = tracemalloc.get_traced_memory()[0] - start_memory
+        tracemalloc.stop()
+
+        start = time.time()
+        for turn in range(0, turns, 7):
+            history.get_frame(turn)
+        frame_ms = (time.time() - start) * 1000 / len(range(0, turns, 7))
+        start = time.time()
+        frames = history.get_frames()
+        frames_ms = (time.time() - start) * 1000
+
+        results[board_class.__name__] = {
+            "copies_bytes": copies_bytes,
+            "copy_us": copies_ms * 1000 / turns,
+            "history_bytes": history_bytes,
+            "keyframes": len(history.keyframes),
+            "record_us": record_ms * 1000 / turns,
+            "frame_ms": frame_ms,
+            "frames_ms": frames_ms,
+            "identical": frames == [encoding.encode_state(encoding.decode_state(encoding.encode_board(board))) for board in copies],
+        }
+    return results
+
+
+# the time in ms to read a turn of a long game, from its journal file, which is read up to the turn,
+# and from its replay file, once as the turn's state and once as its board, and the time to read all turns of the game
+def replay_file_benchmark(turns=500, repeats=20):
+    with tempfile.TemporaryDirectory() as directory:
+        game_directory = os.path.join(directory, "game_states", "2023-05-20_21 (abc)")
+        os.makedirs(game_directory)
+        with gzip.open(os.path.join(game_directory, "abc.jsonl.gz"), "wb") as file:
+            for game_state in make_long_game(11, 11, turns):
+                game_state["game"] = {"id": "abc"}
+                file.write(gamestate.dumps(game_state) + b"\n")
+        journal_path = journal.find_games(os.path.join(directory, "game_states"))[0]
+        replay_path = replayfile.convert_games(os.path.join(directory, "game_states"), os.path.join(directory, "move_logs"), os.path.join(directory, "replays"))[0]
+
+        rng = random.Random(0)
+        read_turns = [rng.randrange(turns) for _ in range(repeats)]
+        start = time.time()
+        for turn in read_turns:
+            for game_state in journal.read_game(journal_path):
+                if game_state["turn"] == turn:
+                    break
+        journal_turn_ms = (time.time() - start) * 1000 / repeats
+        start = time.time()
+        for turn in read_turns:
+            with replayfile.ReplayFile(replay_path) as replay_file:
+                replay_file.get_state(turn)
+        state_ms = (time.time() - start) * 1000 / repeats
+        start = time.time()
+        for turn in read_turns:
+            with replayfile.ReplayFile(replay_path) as replay_file:
+                replay_file.get_board(turn)
+        board_ms = (time.time() - start) * 1000 / repeats
+
+        start = time.time()
+        for _ in journal.read_game(journal_path):
+            pass
+        journal_game_ms = (time.time() - start) * 1000
+        start = time.time()
+        with replayfile.ReplayFile(replay_path) as replay_file:
+            for turn in replay_file.get_turns():
+                replay_file.get_state(turn)
+        replay_game_ms = (time.time() - start) * 1000
+
+        return {
+            "journal_bytes": os.path.getsize(journal_path),
+            "replay_bytes": os.path.getsize(replay_path),
+            "journal_turn_ms": journal_turn_ms,
+            "state_ms": state_ms,
+            "board_ms": board_ms,
+            "journal_game_ms": journal_game_ms,
+            "replay_game_ms": replay_game_ms,
+        }
+
+
+# usage: python benchmark.py [path to a saved game state]
+#        python benchmark.py death-timer [directory of saved game states]
+#        python benchmark.py throughput [path to a saved game state]
+#        python benchmark.py ipc [path to a saved game state]
+#        python benchmark.py moves [path to a saved game state]
+#        python benchmark.py start-latency [number of games]
+#        python benchmark.py render [path to a saved game state]
+#        python benchmark.py history [number of turns]
+#        python benchmark.py replay-file [number of turns]
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "death-timer":
+        directory = sys.argv[2] if len(sys.argv) > 2 else "./game_states"
+        print_death_timer_benchmark(death_timer_benchmark(directory))
+    elif len(sys.argv) > 1 and sys.argv[1] == "ipc":
+        game_state = json.load(open(sys.argv[2], "r")) if len(sys.argv) > 2 else make_game_state(11, 11, snake_count=4)
+        for name, result in ipc_benchmark(game_state).items():
+            print(f"{name:>12}  pickled {result['pickled_bytes']:7d} bytes {result['pickled_ms']:7.3f} ms  encoded {result['encoded_bytes']:5d} bytes {result['encoded_ms']:7.3f} ms")
+    elif len(sys.argv) > 1 and sys.argv[1] == "moves":
+        game_states = [(sys.argv[2], json.load(open(sys.argv[2], "r")))] if len(sys.argv) > 2 else \
+            [(f"{size}x{size}, 4 snakes", make_game_state(size, size, snake_count=4)) for size in [11, 19, 25]]
+        for name, game_state in game_states:
+            for board_class_name, result in move_benchmark(game_state).items():
+                print(f"{name:>24}  {board_class_name:>12}  move_snake {result['move_us']:8.1f} us  get_possible_subboards {result['subboards_us']:9.1f} us")
+    elif len(sys.argv) > 1 and sys.argv[1] == "render":
+        game_state = json.load(open(sys.argv[2], "r")) if len(sys.argv) > 2 else make_game_state(11, 11, snake_count=4)
+        for (board_class_name, territory, cell_size), result in render_benchmark(game_state).items():
+            name = f"{board_class_name}{', territory' if territory else ''}, {cell_size} px"
+            print(f"{name:>32}  draw_board {result['draw_ms']:6.3f} ms  image {result['image_ms']:6.3f} ms ({result['draw_ms'] / result['image_ms']:4.1f}x)  array {result['array_ms']:6.3f} ms ({result['draw_ms'] / result['array_ms']:4.1f}x)  identical {result['identical']}")
+    elif len(sys.argv) > 1 and sys.argv[1] == "history":
+        turns = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+        for board_class_name, result in history_benchmark(turns).items():
+            print(f"{board_class_name:>12}  copies {result['copies_bytes'] / 1024:8.1f} KiB ({result['copy_us']:6.1f} us per turn)  history {result['history_bytes'] / 1024:6.1f} KiB ({result['record_us']:6.1f} us per turn, {result['keyframes']} keyframes, {result['copies_bytes'] / result['history_bytes']:5.1f}x less)  turn {result['frame_ms']:6.3f} ms  all turns {result['frames_ms']:6.1f} ms  identical {result['identical']}")
+    elif len(sys.argv) > 1 and sys.argv[1] == "replay-file":
+        result = replay_file_benchmark(int(sys.argv[2]) if len(sys.argv) > 2 else 500)
+        print(f"journal      {result['journal_bytes'] / 1024:7.1f} KiB  a turn {result['journal_turn_ms']:7.3f} ms  all turns {result['journal_game_ms']:7.1f} ms")
+        print(f"replay file  {result['replay_bytes'] / 1024:7.1f} KiB  a turn {result['state_ms']:7.3f} ms ({result['board_ms']:6.3f} ms as a board)  all turns {result['replay_game_ms']:7.1f} ms")
+    elif len(sys.argv) > 1 and sys.argv[1] == "start-latency":
+        games = int(sys.argv[2]) if len(sys.argv) > 2 else 40
+        results = start_latency_benchmark(games)
+        print(f"{results['starts']} starts  p50 {results['p50']:7.1f} ms  p99 {results['p99']:7.1f} ms  max {results['max']:7.1f} ms")
+    elif len(sys.argv) > 1 and sys.argv[1] == "throughput":
+        game_state = json.load(open(sys.argv[2], "r")) if len(sys.argv) > 2 else make_game_state(11, 11, snake_count=4)
+        results = engine_throughput_benchmark(game_state)
+        print(f"MCTS playouts          {results['playouts_per_second']:9.1f} per second")
+        print(f"death timer searches   {results['death_timers_per_second']:9.1f} per second")
+    elif len(sys.argv) > 1:
+        game_state = json.load(open(sys.argv[1], "r"))
+        print_comparison(sys.argv[1], compare_engines(game_state))
+    else:
+        for size in [11, 19, 25]:
+            game_state = make_game_state(size, size)
+            print_comparison(f"{size}x{size}, 2 snakes", compare_engines(game_state))
@@ -0,0 +1,435 @@
+from board import GeneralBoard
+import numpy as np
+import zobrist
+
+
+# A view of a single square of a BitBoard
+# it has the same interface as Cell, but all of its state lives in the board's bitboards
+class BitCell:
+    __slots__ = ("board", "x", "y", "index", "bit")
+
+    def __init__(self, board, x, y):
+        self.board = board
+        self.x = x
+        self.y = y
+        self.index = y * board.width + x
+        self.bit = 1 << self.index
+
+    @property
+    def food(self):
+        return self.board.food & self.bit != 0
+
+    @property
+    def hazard(self):
+        return self.board.hazards & self.bit != 0
+
+    @property
+    def snake(self):
+        return self.board.get_snake_at(self.bit)
+
+    @property
+    def is_snake_head(self):
+        return self.board.heads & self.bit != 0
+
+    @is_snake_head.setter
+    def is_snake_head(self, is_snake_head):
+        if is_snake_head:
+            self.board.heads |= self.bit
+        else:
+            self.board.heads &= ~self.bit
+
+    @property
+    def color(self):
+        return self.board.colors.get(self.index)
+
+    @color.setter
+    def color(self, color):
+        self.set_color(color)
+
+    @property
+    def closest_snakes(self):
+        if not self.board.closest_known & self.bit:
+            return None
+        return [snake for snake in self.board.snakes if not snake.is_dead and self.board.closest.get(snake.client_id, 0) & self.bit]
+
+    @property
+    def closest_snake_distance(self):
+        if not self.board.closest_known & self.bit:
+            return None
+        return self.board.get_closest_snake(self.x, self.y)[1]
+
+    @property
+    def future(self):
+        return self.board.futures.get(self.index, [])
+
+    def set_food(self, food):
+        if food != self.food:
+            self.board.zobrist_hash ^= zobrist.food_key(self.x, self.y)
+        if food:
+            self.board.food |= self.bit
+        else:
+            self.board.food &= ~self.bit
+
+    def set_hazard(self, hazard):
+        if hazard != self.hazard:
+            self.board.zobrist_hash ^= zobrist.hazard_key(self.x, self.y)
+        if hazard:
+            self.board.hazards |= self.bit
+        else:
+            self.board.hazards &= ~self.bit
+
+    def set_snake(self, snake, is_snake_head=False):
+        self.board.set_snake_bit(self.bit, snake)
+        self.is_snake_head = is_snake_head
+
+    def set_color(self, color):
+        if color is None:
+            self.board.colors.pop(self.index, None)
+        else:
+            self.board.colors[self.index] = color
+
+    def set_closest_snakes(self, snakes, distance):
+        board = self.board
+        for client_id in board.closest:
+            board.closest[client_id] &= ~self.bit
+        if snakes is None:
+            board.closest_known &= ~self.bit
+            return
+        board.closest_known |= self.bit
+        for snake in snakes:
+            board.closest[snake.client_id] = board.closest.get(snake.client_id, 0) | self.bit
+
+    def is_empty(self):
+        return not (self.board.occupied | self.board.food | self.board.hazards) & self.bit
+
+    def is_food(self):
+        return self.food
+
+    def is_safe(self):
+        return not (self.board.occupied | self.board.hazards) & self.bit
+
+    def is_occupied(self):
+        return self.board.occupied & self.bit != 0
+
+    def set_future(self, snake):
+        self.board.futures.setdefault(self.index, []).append(snake.client_id)
+
+    # the closest snakes are saved as the raw bits, so that snakes which are dead
+    # at the time of saving keep their territory when the state is restored
+    def get_snake_state(self):
+        closest = None
+        if self.board.closest_known & self.bit:
+            closest = [client_id for client_id, mask in self.board.closest.items() if mask & self.bit]
+        return self.snake, self.is_snake_head, closest
+
+    def restore_snake_state(self, state):
+        snake, is_snake_head, closest = state
+        self.set_snake(snake, is_snake_head)
+        board = self.board
+        for client_id in board.closest:
+            board.closest[client_id] &= ~self.bit
+        if closest is None:
+            board.closest_known &= ~self.bit
+            return
+        board.closest_known |= self.bit
+        for client_id in closest:
+            board.closest[client_id] |= self.bit
+
+    def clear_snake_info(self):
+        self.set_snake(None)
+        self.set_closest_snakes(None, None)
+        return self
+
+    def clear(self):
+        self.set_food(False)
+        self.set_hazard(False)
+        self.set_snake(None)
+        self.set_color(None)
+        self.set_closest_snakes(None, None)
+        self.board.futures.pop(self.index, None)
+        return self
+
+    def __eq__(self, other):
+        return isinstance(other, BitCell) and self.board is other.board and self.index == other.index
+
+    # cells of different boards are never equal, so the index alone is enough
+    def __hash__(self):
+        return self.index
+
+    def __repr__(self):
+        return f"Cell({self.x}, {self.y})"
+
+
+# A board that keeps its state as integer bitboards instead of a grid of Cell objects
+# bit y * width + x of each bitboard describes the square (x, y)
+# it keeps the GeneralBoard interface, so snakes and teams can use it as a drop in replacement
+class BitBoard(GeneralBoard):
+    def __init__(self, width, height):
+        self.food = 0
+        self.hazards = 0
+        self.heads = 0
+        self.occupied = 0
+        self.bodies = {}
+        self.closest = {}
+        self.closest_known = 0
+        self.colors = {}
+        self.futures = {}
+        self._cells = None
+        super().__init__(width, height)
+
+    def create_cells(self):
+        self.full_mask = (1 << (self.width * self.height)) - 1
+        first_column = 0
+        for y in range(self.height):
+            first_column |= 1 << (y * self.width)
+        last_column = first_column << (self.width - 1)
+        # masks that stop shifts from wrapping around to the other side of the board
+        self.not_first_column = self.full_mask & ~first_column
+        self.not_last_column = self.full_mask & ~last_column
+
+    @property
+    def cells(self):
+        if self._cells is None:
+            self._cells = [[BitCell(self, x, y) for y in range(self.height)] for x in range(self.width)]
+        return self._cells
+
+    @property
+    def all_cells(self):
+        return [cell for column in self.cells for cell in column]
+
+    def clear_cells(self):
+        self.food = 0
+        self.hazards = 0
+        self.heads = 0
+        self.occupied = 0
+        self.bodies = {client_id: 0 for client_id in self.bodies}
+        self.closest = {}
+        self.closest_known = 0
+        self.colors = {}
+        self.futures = {}
+        self.rehash()
+
+    def get_cell(self, x, y):
+        if x < 0 or x >= self.width or y < 0 or y >= self.height:
+            return None
+        return BitCell(self, x, y)
+
+    def get_bit(self, x, y):
+        return 1 << (y * self.width + x)
+
+    def is_safe(self, x, y):
+        if not self.is_valid_cell(x, y):
+            return False
+        return not (self.occupied | self.hazards) & self.get_bit(x, y)
+
+    def get_snake_at(self, bit):
+        if not self.occupied & bit:
+            return None
+        for snake in self.snakes:
+            if self.bodies.get(snake.client_id, 0) & bit:
+                return snake
+        return None
+
+    # marks the squares of a bitboard as belonging to a snake, or to no snake if it is None
+    def set_snake_bit(self, bit, snake):
+        if self.occupied & bit:
+            for client_id in self.bodies:
+                self.bodies[client_id] &= ~bit
+            self.occupied &= ~bit
+        if snake is None:
+            return
+        self.bodies[snake.client_id] = self.bodies.get(snake.client_id, 0) | bit
+        self.occupied |= bit
+
+    # returns all squares next to the given squares
+    def neighbours(self, mask):
+        return (
+            ((mask << 1) & self.not_first_column) |
+            ((mask >> 1) & self.not_last_column) |
+            ((mask << self.width) & self.full_mask) |
+            (mask >> self.width)
+        )
+
+    def safe_mask(self):
+        return self.full_mask & ~(self.occupied | self.hazards)
+
+    def free_mask(self):
+        return self.full_mask & ~self.occupied
+
+    # returns the squares that can be reached from (x, y) without crossing a snake
+    def flood_fill(self, x, y, passable=None):
+        if passable is None:
+            passable = self.free_mask()
+        reached = self.get_bit(x, y)
+        while True:
+            expanded = reached | (self.neighbours(reached) & passable)
+            if expanded == reached:
+                return reached
+            reached = expanded
+
+    def reachable_area(self, x, y, passable=None):
+        return self.flood_fill(x, y, passable).bit_count() - 1
+
+    def free_path_length(self, x, y, max_length):
+        passable = self.free_mask()
+        reached = frontier = self.get_bit(x, y)
+        length = 0
+        while length < max_length:
+            frontier = self.neighbours(frontier) & passable & ~reached
+            if frontier == 0:
+                break
+            reached |= frontier
+            length += 1
+        return length
+
+    def tail_aware_flood_fill(self, snake, x, y, turns):
+        vacated = [0] * (turns + 1)
+        for (vx, vy), turn in self.get_vacate_turns(snake).items():
+            if turn <= turns:
+                vacated[turn] |= self.get_bit(vx, vy)
+
+        passable = self.free_mask() | vacated[1]
+        reached = self.get_bit(x, y) & passable if self.is_valid_cell(x, y) else 0
+        reached_counts = [reached.bit_count()]
+        for turn in range(2, turns + 1):
+            passable |= vacated[turn]
+            reached |= self.neighbours(reached) & passable
+            reached_counts.append(reached.bit_count())
+        return reached_counts
+
+    def place_snake(self, snake):
+        self.clear_snake(snake)
+        if snake.is_dead:
+            return
+        body = 0
+        for cell in snake.body:
+            body |= self.get_bit(cell.x, cell.y)
+        self.set_snake_bit(body, snake)
+        self.heads |= self.get_bit(snake.head.x, snake.head.y)
+
+    def clear_snake(self, snake):
+        body = self.bodies.get(snake.client_id, 0)
+        self.bodies[snake.client_id] = 0
+        self.occupied &= ~body
+        self.heads &= ~body
+        self.closest_known &= ~body
+        for client_id in self.closest:
+            self.closest[client_id] &= ~body
+
+    def get_occupied_grid(self):
+        bits = np.frombuffer(self.occupied.to_bytes((self.width * self.height + 7) // 8, "little"), dtype=np.uint8)
+        bits = np.unpackbits(bits, bitorder="little")[:self.width * self.height]
+        return bits.reshape(self.height, self.width).T.astype(bool)
+
+    # sets the closest snakes of every square
+    # growing a diamond around every head one step at a time gives the manhattan distance,
+    # in bfs mode the diamonds can not grow through snakes
+    def calculate_closest_snake(self):
+        self.closest = {}
+        self.closest_known = self.full_mask
+        passable = self.full_mask
+        if self.territory_mode == "bfs":
+            passable = self.free_mask()
+        balls = {}
+        for snake in self.snakes:
+            if snake.is_dead:
+                continue
+            balls[snake.client_id] = self.get_bit(snake.head.x, snake.head.y)
+            self.closest[snake.client_id] = 0
+
+        frontiers = dict(balls)
+        claimed = 0
+        while claimed != self.full_mask and len(frontiers) > 0:
+            newly_claimed = 0
+            for client_id, frontier in frontiers.items():
+                self.closest[client_id] |= frontier & ~claimed
+                newly_claimed |= frontier
+            claimed |= newly_claimed
+
+            for client_id in list(frontiers):
+                ball = balls[client_id]
+                grown = ball | (self.neighbours(ball) & passable)
+                balls[client_id] = grown
+                if grown == ball:
+                    del frontiers[client_id]
+                else:
+                    frontiers[client_id] = grown & ~ball
+
+    # the xs and ys of the squares of a bitboard
+    def get_squares(self, mask):
+        bits = np.frombuffer(mask.to_bytes((self.width * self.height + 7) // 8, "little"), dtype=np.uint8)
+        indices = np.flatnonzero(np.unpackbits(bits, bitorder="little")[:self.width * self.height])
+        return indices % self.width, indices // self.width
+
+    # the layers of GeneralBoard.get_image_layers, from the bitboards instead of the cells
+    def get_image_layers(self):
+        layers = {}
+        colored = list(self.colors)
+        layers["color"] = ([index % self.width for index in colored], [index // self.width for index in colored], list(self.colors.values()))
+
+        # the squares whose closest snakes are all on the same team, in the color of the first of them,
+        # the way BitCell.closest_snakes lists them
+        snakes = [snake for snake in self.snakes if not snake.is_dead]
+        teams = {}
+        for snake in snakes:
+            teams[snake.is_enemy] = teams.get(snake.is_enemy, 0) | self.closest.get(snake.client_id, 0)
+        claimed = 0
+        shared = 0
+        for mask in teams.values():
+            shared |= claimed & mask
+            claimed |= mask
+        left = claimed & ~shared & self.closest_known
+        xs, ys, colors = [], [], []
+        for snake in snakes:
+            mask = self.closest.get(snake.client_id, 0) & left
+            left &= ~mask
+            if mask:
+                snake_xs, snake_ys = self.get_squares(mask)
+                xs.append(snake_xs)
+                ys.append(snake_ys)
+                colors += [snake.color] * len(snake_xs)
+        layers["territory"] = (np.concatenate(xs) if xs else [], np.concatenate(ys) if ys else [], colors)
+
+        layers["food"] = (*self.get_squares(self.food), None)
+        layers["hazard"] = (*self.get_squares(self.hazards), None)
+
+        # a square belongs to the first snake whose body has it, see get_snake_at
+        for name, part in [("body", ~self.heads), ("head", self.heads)]:
+            xs, ys, colors = [], [], []
+            for snake in self.snakes:
+                mask = self.bodies.get(snake.client_id, 0) & part
+                if mask and snake.color is not None:
+                    snake_xs, snake_ys = self.get_squares(mask)
+                    xs.append(snake_xs)
+                    ys.append(snake_ys)
+                    colors += [snake.color] * len(snake_xs)
+            layers[name] = (np.concatenate(xs) if xs else [], np.concatenate(ys) if ys else [], colors)
+
+        futures = [index for index, future in self.futures.items() if len(future) > 0]
+        layers["future"] = ([index % self.width for index in futures], [index // self.width for index in futures], None)
+        return layers
+
+    def get_territory_size(self, snakes):
+        self.calculate_closest_snake()
+        territory = 0
+        for snake in snakes:
+            territory |= self.closest.get(snake.client_id, 0)
+        return territory.bit_count()
+
+    def copy(self, new_board=None):
+        if new_board is None:
+            new_board = BitBoard(self.width, self.height)
+
+        new_board.food = self.food
+        new_board.hazards = self.hazards
+        new_board.colors = dict(self.colors)
+        new_board.futures = dict(self.futures)
+        new_board.territory_mode = self.territory_mode
+
+        new_board.snakes = []
+        new_board.snake_map = {}
+        for snake in self.snakes:
+            snake.copy_to_board(new_board)
+
+        new_board.zobrist_hash = self.zobrist_hash
+        return new_board
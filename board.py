@@ -1,14 +1,18 @@
 from IPython.display import display_png
 from snake import Snake, ControllableSnake
-from PIL import Image, ImageDraw
 import itertools
 import os
+import numpy as np
+import zobrist
+import territory
+import rasterizer
 
 
 class Cell:
-    def __init__(self, x, y):
+    def __init__(self, x, y, board=None):
         self.x = x
         self.y = y
+        self.board = None
         self.set_food(False)
         self.set_hazard(False)
         self.set_snake(None, False)
@@ -16,14 +20,25 @@ class Cell:
         self.closest_snakes = None
         self.closest_snake_distance = None
         self.future = []
+        # the board whose hash is updated when the cell changes
+        self.board = board
     
     def set_food(self, food):
+        if self.board is not None and food != self.food:
+            self.board.zobrist_hash ^= zobrist.food_key(self.x, self.y)
         self.food = food 
     
     def set_hazard(self, hazard):
+        if self.board is not None and hazard != self.hazard:
+            self.board.zobrist_hash ^= zobrist.hazard_key(self.x, self.y)
         self.hazard = hazard
     
     def set_snake(self, snake, is_snake_head=False):
+        if self.board is not None and snake is not self.snake:
+            if self.snake is not None:
+                self.board.occupancy[self.snake.client_id].discard(self)
+            if snake is not None:
+                self.board.occupancy.setdefault(snake.client_id, set()).add(self)
         self.snake = snake
         self.is_snake_head = is_snake_head
 
@@ -49,6 +64,15 @@ class Cell:
     def set_future(self, snake):
         self.future.append(snake.client_id)
     
+    # the part of a cell that a snake move can change, used to undo moves
+    def get_snake_state(self):
+        return self.snake, self.is_snake_head, self.closest_snakes, self.closest_snake_distance
+    
+    def restore_snake_state(self, state):
+        snake, is_snake_head, closest_snakes, closest_snake_distance = state
+        self.set_snake(snake, is_snake_head)
+        self.set_closest_snakes(closest_snakes, closest_snake_distance)
+    
     def clear_snake_info(self):
         self.set_snake(None)
         self.is_snake_head = False
@@ -64,8 +88,8 @@ class Cell:
         self.future = []
         return self
     
-    def copy(self):
-        new_cell = Cell(self.x, self.y)
+    def copy(self, board=None):
+        new_cell = Cell(self.x, self.y, board)
         new_cell.set_food(self.food)
         new_cell.set_hazard(self.hazard)
         new_cell.set_snake(self.snake, self.is_snake_head)
@@ -85,6 +109,26 @@ class GeneralBoard:
         self.height = height
         self.snakes = []
         self.snake_map = {}
+        # the cells that each snake covers, per client id, kept up to date by the cells
+        self.occupancy = {}
+        # records of the moves made with apply_move, newest last
+        self.undo_stack = []
+        # cells that a moved snake still covers, but that were cleared when its stacked tail was popped
+        self.uncovered_cells = []
+        # kept up to date by cells and snakes as they change
+        self.zobrist_hash = 0
+        # "manhattan" or "bfs", see territory.compute_territory
+        self.territory_mode = "manhattan"
+        # the result of the last calculate_closest_snake, and the snakes it was calculated for
+        self.territory = None
+        self.territory_snakes = []
+        # the lists of closest snakes that cells share, per bitmask of territory_snakes
+        self.closest_lists = {}
+        # the last territory baseline from get_territory_delta, and the state it belongs to
+        self.territory_delta = None
+        self.territory_delta_key = None
+        # client ids of the snakes that die whatever they do, per state key and depth, see get_doomed_snakes
+        self.doomed_snakes = {}
 
         self.create_cells()
         self.save_replay = False
@@ -138,7 +182,7 @@ class GeneralBoard:
         for x in range(self.width):
             self.cells.append([])
             for y in range(self.height):
-                self.cells[x].append(Cell(x, y))
+                self.cells[x].append(Cell(x, y, self))
                 self.all_cells.append(self.cells[x][y])
     
     # adds a snake to the board
@@ -161,9 +205,8 @@ class GeneralBoard:
     
     # unpplaces a snakes from the board
     def clear_snake(self, snake):
-        for cell in self.all_cells:
-            if cell.snake and cell.snake == snake:
-                cell.clear_snake_info()
+        for cell in list(self.occupancy.get(snake.client_id, ())):
+            cell.clear_snake_info()
 
     # places all a board's snakes on the correct cells
     def place_snakes(self):
@@ -202,12 +245,113 @@ class GeneralBoard:
                 closest_distance = distance
         return closest_snakes, closest_distance
 
+    # squares covered by a snake, as a bool array indexed [x, y]
+    def get_occupied_grid(self):
+        return np.array([[cell.is_occupied() for cell in column] for column in self.cells], dtype=bool).reshape(self.width, self.height)
+
+    # the squares around (x, y) on the board
+    def get_neighbour_coords(self, x, y):
+        return [(nx, ny) for nx, ny in ((x, y + 1), (x, y - 1), (x - 1, y), (x + 1, y)) if self.is_valid_cell(nx, ny)]
+
+    # the number of moves of the longest shortest path from (x, y) through free squares, at most max_length
+    # every square on such a path is free until the snake gets there, so it is a path the snake can survive
+    def free_path_length(self, x, y, max_length):
+        reached = {(x, y)}
+        frontier = [(x, y)]
+        length = 0
+        while length < max_length:
+            next_frontier = []
+            for fx, fy in frontier:
+                for coords in self.get_neighbour_coords(fx, fy):
+                    if coords not in reached and not self.cells[coords[0]][coords[1]].is_occupied():
+                        reached.add(coords)
+                        next_frontier.append(coords)
+            if len(next_frontier) == 0:
+                break
+            frontier = next_frontier
+            length += 1
+        return length
+
+    # the turn at which each square of the snake's body becomes free, if the snake does not grow
+    # a stacked tail is freed by the first move
+    def get_vacate_turns(self, snake):
+        vacate_turns = {}
+        for i, cell in enumerate(snake.body):
+            vacate_turns[(cell.x, cell.y)] = len(snake.body) - i
+        return vacate_turns
+
+    # flood fill from (x, y), the square the snake moves to first, where the snake's own body
+    # becomes passable at the turn it vacates and other snakes stay where they are
+    # returns the number of squares the head can be on by turn 1, 2, ..., turns
+    def tail_aware_flood_fill(self, snake, x, y, turns):
+        vacate_turns = self.get_vacate_turns(snake)
+
+        def is_open(coords, turn):
+            cell = self.get_cell(coords[0], coords[1])
+            if cell is None:
+                return False
+            if not cell.is_occupied():
+                return True
+            return cell.snake is snake and vacate_turns.get(coords, turns + 1) <= turn
+
+        reached = set()
+        if is_open((x, y), 1):
+            reached.add((x, y))
+        reached_counts = [len(reached)]
+        for turn in range(2, turns + 1):
+            new_reached = set()
+            for rx, ry in reached:
+                for coords in self.get_neighbour_coords(rx, ry):
+                    if coords not in reached and is_open(coords, turn):
+                        new_reached.add(coords)
+            reached |= new_reached
+            reached_counts.append(len(reached))
+        return reached_counts
+
+    # calculates the territory of all living snakes at once
+    def get_territory(self):
+        snakes = [snake for snake in self.snakes if not snake.is_dead]
+        heads = [(snake.head.x, snake.head.y) for snake in snakes]
+        walls = self.get_occupied_grid() if self.territory_mode == "bfs" else None
+        return snakes, territory.compute_territory(self.width, self.height, heads, mode=self.territory_mode, walls=walls)
+
     # sets the closest snake to each cell
+    # only cells whose closest snakes or distance changed since the last calculation are written
     def calculate_closest_snake(self):
-        for col in self.cells:
-            for cell in col:
-                closest_snakes, closest_distance = self.get_closest_snake(cell.x, cell.y)
-                cell.set_closest_snakes(closest_snakes, closest_distance)
+        snakes, result = self.get_territory()
+        self.territory = result
+        if len(snakes) != len(self.territory_snakes) or any(snake is not old for snake, old in zip(snakes, self.territory_snakes)):
+            self.closest_lists = {}
+        self.territory_snakes = snakes
+
+        # cells with the same closest snakes share a list, which is kept while the living snakes stay the same
+        closest_masks = result.get_closest_masks().tolist()
+        closest_distances = result.closest_distance.tolist()
+        closest_lists = self.closest_lists
+        for cell in self.all_cells:
+            mask = closest_masks[cell.x][cell.y]
+            closest = closest_lists.get(mask)
+            if closest is None:
+                closest = closest_lists[mask] = [snake for i, snake in enumerate(snakes) if mask & (1 << i)]
+            distance = closest_distances[cell.x][cell.y]
+            if cell.closest_snakes is not closest or cell.closest_snake_distance != distance:
+                cell.set_closest_snakes(closest, distance)
+    
+    # recomputes the hash of the board from scratch
+    def rehash(self):
+        self.zobrist_hash = zobrist.board_hash(self)
+        return self.zobrist_hash
+    
+    # identifies the board state in transposition table keys
+    # cells waiting to be given back to a snake change which moves are free, so they are part of the state,
+    # only the cells that are still free are, sorted, so a decoded board has the key of the board that was encoded
+    def get_state_key(self):
+        if len(self.uncovered_cells) == 0:
+            return self.zobrist_hash
+        uncovered = sorted((cell.x, cell.y) for cell, snake in self.uncovered_cells if not snake.is_dead and cell.snake is None)
+        if len(uncovered) == 0:
+            return self.zobrist_hash
+        return self.zobrist_hash, tuple(uncovered)
     
     def get_snake(self, client_id):
         for snake in self.snakes:
@@ -215,25 +359,78 @@ class GeneralBoard:
                 return snake
         return None
     
+    # only the cells of the new head and the old tail change,
+    # Snake.move clears the old tail even when another segment of the snake still covers it, like after eating
     def move_snake(self, snake, direction):
+        tail = snake.tail
         snake.move(direction)
-        self.place_snakes()
+        if not snake.is_dead and tail in snake.body_counts and tail.snake is None:
+            tail.set_snake(snake)
+    
+    # moves a snake in place, without copying the board
+    # the move follows Snake.move and can be reverted with undo_move
+    def apply_move(self, snake, direction):
+        return snake.apply_move(direction)
+    
+    # reverts the last move made with apply_move
+    def undo_move(self):
+        record = self.undo_stack.pop()
+        record.undo()
+        return record
+    
+    # client ids of the snakes that can not survive depth moves in the current state, whatever they do
+    # the result is kept for the state, and is copied to the worker processes together with the board
+    def get_doomed_snakes(self, depth=10, deadline=None):
+        key = (self.get_state_key(), depth)
+        doomed_snakes = self.doomed_snakes.get(key)
+        if doomed_snakes is None:
+            doomed_snakes = frozenset(
+                snake.client_id for snake in self.snakes
+                if len(snake.get_moves_without_future_death(prediction_depth=depth, deadline=deadline)) == 0
+            )
+            self.doomed_snakes[key] = doomed_snakes
+        return doomed_snakes
+    
+    # the territory of a team in the current state, calculated once per state
+    def get_territory_delta(self, team_snakes):
+        key = (self.get_state_key(), self.territory_mode, tuple(snake.client_id for snake in team_snakes))
+        if self.territory_delta_key != key:
+            snakes = [snake for snake in self.snakes if not snake.is_dead]
+            heads = [(snake.head.x, snake.head.y) for snake in snakes]
+            team_indices = [i for i, snake in enumerate(snakes) if snake in team_snakes]
+            walls = self.get_occupied_grid() if self.territory_mode == "bfs" else None
+            self.territory_delta = territory.TerritoryDelta(self.width, self.height, heads, team_indices, mode=self.territory_mode, walls=walls)
+            self.territory_delta.snakes = snakes
+            self.territory_delta_key = key
+        return self.territory_delta
+    
+    # how much the team's territory changes for each move of snake
+    # the move is applied in place to find the new head, and reverted again
+    def get_territory_increases(self, team_snakes, snake):
+        territory_delta = self.get_territory_delta(team_snakes)
+        index = territory_delta.snakes.index(snake)
+
+        increases = {}
+        for move in ["up", "down", "left", "right"]:
+            self.apply_move(snake, move)
+            head = None if snake.is_dead else (snake.head.x, snake.head.y)
+            walls = None
+            if self.territory_mode == "bfs":
+                walls = self.get_occupied_grid()
+            self.undo_move()
+            increases[move] = territory_delta.get_delta(index, head, walls)
+        return increases
     
     def get_territory_size(self, snakes):
         self.calculate_closest_snake()
-        territory_size = 0
-        for cell in self.all_cells:
-            for closest_snake in cell.closest_snakes:
-                if closest_snake in snakes:
-                    territory_size += 1
-                    break
-        return territory_size
+        indices = [i for i, snake in enumerate(self.territory_snakes) if snake in snakes]
+        return self.territory.get_territory_size(indices)
     
     def copy(self, new_board=None):
         if new_board is None:
             new_board = GeneralBoard(self.width, self.height)
 
-        new_board.cells = [[cell.copy().clear_snake_info() for cell in row] for row in self.cells]
+        new_board.cells = [[cell.copy(new_board).clear_snake_info() for cell in row] for row in self.cells]
         new_board.all_cells = []
         for row in new_board.cells:
             for cell in row:
@@ -244,80 +441,58 @@ class GeneralBoard:
         for snake in self.snakes:
             snake.copy_to_board(new_board)
 
+        new_board.zobrist_hash = self.zobrist_hash
+        new_board.territory_mode = self.territory_mode
         return new_board
     
-    def convert_to_image(self, cell_size=25):
-        img = Image.new('RGB', (self.width*cell_size, self.height*cell_size), color = 'white')
-        draw = ImageDraw.Draw(img)
-
-        # draw grid
-        for x in range(self.width):
-            for y in range(self.height):
-                draw.rectangle((x*cell_size, y*cell_size, x*cell_size+cell_size, y*cell_size+cell_size), fill='white', outline='black')
-        
-        # draw optional colors
-        for x in range(self.width):
-            for y in range(self.height):
-                if self.cells[x][y].color:
-                    draw.rectangle((x*cell_size, y*cell_size, x*cell_size+cell_size, y*cell_size+cell_size), fill=self.cells[x][y].color, outline='black')
-        
-        for x in range(self.width):
-            for y in range(self.height):
-                # fill in color of closest snake, but slightly lighter
-                if self.cells[x][y].closest_snakes is not None and len(self.cells[x][y].closest_snakes) > 0:
-                    snakes_are_all_same_team = True
-                    team = self.cells[x][y].closest_snakes[0].is_enemy
-                    for snake in self.cells[x][y].closest_snakes:
-                        if not snake.is_enemy == team:
-                            snakes_are_all_same_team = False
-                            break
-
-                    if snakes_are_all_same_team: 
-                        shade = 0.7
-                        color = self.cells[x][y].closest_snakes[0].color
-                        color = color.lstrip('#')
-                        rgb = tuple(int(color[i:i+2], 16) for i in (0, 2, 4))
-                        new_rgb = tuple([int((255 - rgb[i]) * shade + rgb[i]) for i in range(3)])
-                        new_color = '#%02x%02x%02x' % new_rgb
-                        draw.rectangle((x*cell_size, y*cell_size, x*cell_size+cell_size, y*cell_size+cell_size), fill=new_color, outline='black')
-
-                # # write closest snake distance to cell
-                # if self.cells[x][y].closest_snake_distance is not None:
-                #     draw.text((x*cell_size+0.1*cell_size, y*cell_size+0.1*cell_size), str(self.cells[x][y].closest_snake_distance), fill='black')
-                
-
-        
-        # draw food, small green circle
-        for x in range(self.width):
-            for y in range(self.height):
-                if self.cells[x][y].food:
-                    draw.ellipse((x*cell_size+0.2*cell_size, y*cell_size+0.2*cell_size, x*cell_size+0.8*cell_size, y*cell_size+0.8*cell_size), fill='green', outline='green')
-        
-        # draw hazards, small red circle
-        for x in range(self.width):
-            for y in range(self.height):
-                if self.cells[x][y].hazard:
-                    draw.ellipse((x*cell_size+0.2*cell_size, y*cell_size+0.2*cell_size, x*cell_size+0.8*cell_size, y*cell_size+0.8*cell_size), fill='red', outline='red')
-
-        # draw snakes, according to their color, in squares slightly smaller than grid size
-        for x in range(self.width):
-            for y in range(self.height):
-                if self.cells[x][y].snake:
-                    snake = self.cells[x][y].snake
-                    color = snake.color
-                    if self.cells[x][y].is_snake_head:
-                        draw.rectangle((x*cell_size+0.1*cell_size, y*cell_size+0.1*cell_size, x*cell_size+0.9*cell_size, y*cell_size+0.9*cell_size), fill=color, outline=color)
-                    else:
-                        draw.rectangle((x*cell_size+0.2*cell_size, y*cell_size+0.2*cell_size, x*cell_size+0.8*cell_size, y*cell_size+0.8*cell_size), fill=color, outline=color)
-        
-        # draw smaller black dots in the center of a cell
-        # if it is calculated to be a snakes future
-        for x in range(self.width):
-            for y in range(self.height):
-                if len(self.cells[x][y].future) > 0:
-                    draw.ellipse((x*cell_size+0.4*cell_size, y*cell_size+0.4*cell_size, x*cell_size+0.6*cell_size, y*cell_size+0.6*cell_size), fill='black', outline='black')
-
-        return img
+    # the squares of every layer that convert_to_image draws, and their colors, see rasterizer.rasterize
+    def get_image_layers(self):
+        cells = self.all_cells
+        # most cells are empty, the cells of the layers are looked for among the cells that have something in them
+        marked_cells = [cell for cell in cells if cell.color or cell.closest_snakes or cell.future]
+        item_cells = [cell for cell in cells if cell.food or cell.hazard]
+        snake_cells = [cell for cell in cells if cell.snake and cell.snake.color is not None]
+        layers = {}
+
+        colored = [cell for cell in marked_cells if cell.color]
+        layers["color"] = (*rasterizer.get_squares(colored), [cell.color for cell in colored])
+
+        # a cell is in the territory of its closest snakes if they are all on the same team,
+        # the cells with the same closest snakes share their list, see calculate_closest_snake
+        territory_cells = []
+        territory_colors = []
+        team_colors = {}
+        for cell in marked_cells:
+            closest_snakes = cell.closest_snakes
+            if not closest_snakes:
+                continue
+            color = team_colors.get(id(closest_snakes), False)
+            if color is False:
+                team = closest_snakes[0].is_enemy
+                color = closest_snakes[0].color if all(snake.is_enemy == team for snake in closest_snakes) else None
+                team_colors[id(closest_snakes)] = color
+            if color is not None:
+                territory_cells.append(cell)
+                territory_colors.append(color)
+        layers["territory"] = (*rasterizer.get_squares(territory_cells), territory_colors)
+
+        layers["food"] = (*rasterizer.get_squares([cell for cell in item_cells if cell.food]), None)
+        layers["hazard"] = (*rasterizer.get_squares([cell for cell in item_cells if cell.hazard]), None)
+
+        bodies = [cell for cell in snake_cells if not cell.is_snake_head]
+        heads = [cell for cell in snake_cells if cell.is_snake_head]
+        layers["body"] = (*rasterizer.get_squares(bodies), [cell.snake.color for cell in bodies])
+        layers["head"] = (*rasterizer.get_squares(heads), [cell.snake.color for cell in heads])
+
+        layers["future"] = (*rasterizer.get_squares([cell for cell in marked_cells if len(cell.future) > 0]), None)
+        return layers
+
+    # the board drawn with a square of cell_size pixels per cell, as an image, or as an array of RGB values
+    # indexed [pixel y, pixel x] if as_array is set
+    def convert_to_image(self, cell_size=25, as_array=False):
+        if as_array:
+            return rasterizer.to_rgb(rasterizer.rasterize(self.width, self.height, self.get_image_layers(), cell_size))
+        return rasterizer.draw_image(self.width, self.height, self.get_image_layers(), cell_size)
 
     
     def _repr_png_(self):
@@ -350,8 +525,8 @@ class GeneralBoard:
 # A board that is aware of its own snake team, and can update based on API data
 # this board should not be copied
 class Board():
-    def __init__(self, width, height, our_snakes, all_snakes_json):
-        self.b = GeneralBoard(width, height)
+    def __init__(self, width, height, our_snakes, all_snakes_json, board_class=GeneralBoard):
+        self.b = board_class(width, height)
         self.width = width
         self.height = height
 
@@ -361,6 +536,13 @@ class Board():
             snake_id = snake.client_id
             self.our_snakes_map[snake_id] = snake
 
+        # the food, hazards and snake bodies of the last game state as coordinates, update_state applies the next state
+        # as a diff to them, and counts how often the board had to be rebuilt instead
+        self.food_positions = set()
+        self.hazard_positions = set()
+        self.snake_bodies = None
+        self.rebuilds = 0
+
         self.create_snakes(all_snakes_json)
     
     # creates snakes and places them on board
@@ -375,45 +557,125 @@ class Board():
 
             snake_obj.place_on_board(self.b, add=False)
 
+            # our snakes are the team of the replays and images, see BoardHistory.record
             if snake_id in self.our_snakes_map:
                 self.our_snakes_map[snake_id].snake = snake_obj
+                snake_obj.is_enemy = False
 
     
-    def set_snake_position(self, snake_state):
-        snake_id = snake_state["id"]
-        snake = self.b.snake_map[snake_id]
-
-        never_set_head = True
-        for body_part in snake_state["body"]:
-
-            is_head = body_part == snake_state["head"]
-            if is_head and never_set_head:
-                never_set_head = False
-            self.b.cells[body_part["x"]][body_part["y"]].set_snake(snake, is_head)
-        if never_set_head:
-            print("ERROR: snake head not found")
-
-    
+    # writes a game state's board into the board
+    # consecutive turns only differ in the heads and tails of the snakes and a few food and hazard squares,
+    # so only those cells are changed, unless the state does not follow from the last one
     def update_state(self, board_state):
-        self.b.clear_cells()
+        food_positions = set((food["x"], food["y"]) for food in board_state["food"])
+        hazard_positions = set((hazard["x"], hazard["y"]) for hazard in board_state["hazards"])
+        snake_bodies = {}
+        for snake_state in board_state["snakes"]:
+            snake_bodies[snake_state["id"]] = [(body_part["x"], body_part["y"]) for body_part in snake_state["body"]]
+
+        if not self.apply_diff(board_state, food_positions, hazard_positions, snake_bodies):
+            self.rebuild(board_state, snake_bodies)
+        self.food_positions = food_positions
+        self.hazard_positions = hazard_positions
+        self.snake_bodies = snake_bodies
+
+        self.b.doomed_snakes = {}
+        self.b.calculate_closest_snake()
+
+    # writes a game state's board into the board in one pass,
+    # every snake is placed once and the board is hashed once, instead of after every snake
+    def rebuild(self, board_state, snake_bodies):
+        board = self.b
+        board.clear_cells()
         for food in board_state["food"]:
-            self.b.cells[food["x"]][food["y"]].set_food(True)
+            board.get_cell(food["x"], food["y"]).set_food(True)
         
         for hazard in board_state["hazards"]:
-            self.b.cells[hazard["x"]][hazard["y"]].set_hazard(True)
-        
-        updated_snakes = []
-        for snake in board_state["snakes"]:
-            self.set_snake_position(snake)
-            updated_snakes.append(snake["id"])
-            snake_obj = self.b.snake_map[snake["id"]]
-            snake_obj.update_state(snake)
+            board.get_cell(hazard["x"], hazard["y"]).set_hazard(True)
         
-        for snake in self.b.snakes:
-            if snake.client_id not in updated_snakes:
+        # snakes that are gone are killed first, a snake that died earlier clears the cells of its last body
+        for snake in board.snakes:
+            if snake.client_id not in snake_bodies:
                 snake.kill()
         
-        self.b.calculate_closest_snake()
+        for snake_state in board_state["snakes"]:
+            snake = board.snake_map[snake_state["id"]]
+            self.set_snake_state(snake, snake_state, snake_bodies[snake.client_id])
+            if snake.is_dead:
+                continue
+            for cell in snake.body:
+                cell.set_snake(snake)
+            snake.head.is_snake_head = True
+        
+        board.rehash()
+        self.rebuilds += 1
+
+    # changes only the cells that differ from the last game state, and keeps the hash up to date while doing so
+    # returns False when the state does not follow from the last one in a single turn, the board has to be rebuilt then
+    def apply_diff(self, board_state, food_positions, hazard_positions, snake_bodies):
+        if self.snake_bodies is None:
+            return False
+        for snake_id, body in snake_bodies.items():
+            if snake_id not in self.snake_bodies or not self.is_next_body(self.snake_bodies[snake_id], body):
+                return False
+
+        board = self.b
+        for x, y in self.food_positions ^ food_positions:
+            board.get_cell(x, y).set_food((x, y) in food_positions)
+        for x, y in self.hazard_positions ^ hazard_positions:
+            board.get_cell(x, y).set_hazard((x, y) in hazard_positions)
+
+        for snake in board.snakes:
+            if snake.client_id not in snake_bodies:
+                snake.kill()
+
+        # the cells that the snakes left are cleared before any snake takes its new cells,
+        # our own snakes already moved on the board, so the cells are compared with the board and not the last state
+        moved_snakes = []
+        for snake_state in board_state["snakes"]:
+            snake = board.snake_map[snake_state["id"]]
+            if snake.is_dead:
+                self.set_snake_state(snake, snake_state, snake_bodies[snake.client_id])
+                continue
+            board.zobrist_hash ^= zobrist.snake_hash(snake)
+            old_body = snake.body
+            old_head = snake.head
+            self.set_snake_state(snake, snake_state, snake_bodies[snake.client_id])
+            for cell in old_body:
+                if cell not in snake.body_counts and cell.snake is snake:
+                    cell.clear_snake_info()
+            old_head.is_snake_head = False
+            moved_snakes.append(snake)
+
+        for snake in moved_snakes:
+            for cell in snake.body:
+                if cell.snake is not snake:
+                    # a square that two snakes claim, the board does not match the last state
+                    if cell.snake is not None:
+                        return False
+                    cell.set_snake(snake)
+            snake.head.is_snake_head = True
+            board.zobrist_hash ^= zobrist.snake_hash(snake)
+        return True
+
+    # whether a body can follow from the last one in a single move,
+    # the tail is stacked for a turn after the snake ate
+    @staticmethod
+    def is_next_body(old_body, new_body):
+        if len(new_body) != len(old_body) and len(new_body) != len(old_body) + 1:
+            return False
+        (old_x, old_y), (new_x, new_y) = old_body[0], new_body[0]
+        if abs(old_x - new_x) + abs(old_y - new_y) != 1:
+            return False
+        return new_body[1:len(old_body)] == old_body[:-1] and new_body[len(old_body):] in ([], [new_body[len(old_body) - 1]])
+
+    def set_snake_state(self, snake, snake_state, body):
+        snake.health = snake_state["health"]
+        snake.length = snake_state["length"]
+        snake.set_body(self.b.get_cell(x, y) for x, y in body)
+        snake.tail = snake.body[-1]
+        snake.head = self.b.get_cell(snake_state["head"]["x"], snake_state["head"]["y"])
+        snake.color = snake_state["customizations"]["color"]
     
     def copy(self):
         new_board = Board(self.width, self.height, self.our_snakes, [])
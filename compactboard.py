@@ -0,0 +1,158 @@
+import numpy as np
+import territory
+
+DIRECTIONS = ["up", "down", "left", "right"]
+DIRECTION_OFFSETS = {
+    "up": (0, 1),
+    "down": (0, -1),
+    "left": (-1, 0),
+    "right": (1, 0)
+}
+
+
+# A small board for search engines, made once from a GeneralBoard and then only stepped
+# squares are (x, y) tuples, a body is a tuple of squares with the head first, and a dead snake has no body
+# stepping returns a new board, which is much cheaper than GeneralBoard.copy because only tuples are copied
+# moves are resolved for all snakes at once, like the game engine does
+class CompactBoard():
+    def __init__(self, width, height, client_ids, bodies, healths, food, hazards, hazard_damage=14):
+        self.width = width
+        self.height = height
+        self.client_ids = client_ids
+        self.bodies = bodies
+        self.healths = healths
+        self.food = food
+        self.hazards = hazards
+        self.hazard_damage = hazard_damage
+
+    @staticmethod
+    def from_board(board):
+        client_ids = []
+        bodies = []
+        healths = []
+        for snake in board.snakes:
+            client_ids.append(snake.client_id)
+            if snake.is_dead:
+                bodies.append(None)
+                healths.append(0)
+            else:
+                bodies.append(tuple((cell.x, cell.y) for cell in snake.body))
+                healths.append(snake.health)
+        food = frozenset((cell.x, cell.y) for cell in board.all_cells if cell.food)
+        hazards = frozenset((cell.x, cell.y) for cell in board.all_cells if cell.hazard)
+        return CompactBoard(board.width, board.height, tuple(client_ids), tuple(bodies), tuple(healths), food, hazards)
+
+    def get_index(self, client_id):
+        return self.client_ids.index(client_id)
+
+    def is_alive(self, index):
+        return self.bodies[index] is not None
+
+    def get_key(self):
+        return self.bodies, self.healths, self.food
+
+    def is_on_board(self, square):
+        return 0 <= square[0] < self.width and 0 <= square[1] < self.height
+
+    def get_occupied(self):
+        occupied = set()
+        for body in self.bodies:
+            if body is not None:
+                occupied.update(body)
+        return occupied
+
+    # the moves of a snake that do not run into a wall or a body that stays where it is,
+    # tails are left out of the bodies because they move away, unless the snake just ate
+    # when every move is fatal all moves are returned, so the snake still has something to do
+    def get_moves(self, index, occupied=None):
+        body = self.bodies[index]
+        if body is None:
+            return []
+        if occupied is None:
+            occupied = self.get_occupied()
+        tails = {other[-1] for other in self.bodies if other is not None and len(other) > 1 and other[-1] != other[-2]}
+
+        moves = []
+        for direction in DIRECTIONS:
+            offset = DIRECTION_OFFSETS[direction]
+            square = (body[0][0] + offset[0], body[0][1] + offset[1])
+            if self.is_on_board(square) and (square not in occupied or square in tails):
+                moves.append(direction)
+        if len(moves) == 0:
+            return list(DIRECTIONS)
+        return moves
+
+    # returns the board after every living snake made its move, moves maps snake indices to directions
+    def step(self, moves):
+        new_bodies = list(self.bodies)
+        new_healths = list(self.healths)
+        food = self.food
+        eaten = set()
+
+        for index, body in enumerate(self.bodies):
+            if body is None:
+                continue
+            offset = DIRECTION_OFFSETS[moves.get(index, "up")]
+            head = (body[0][0] + offset[0], body[0][1] + offset[1])
+            new_bodies[index] = (head,) + body[:-1]
+            new_healths[index] -= 1
+            if head in self.hazards:
+                new_healths[index] -= self.hazard_damage
+
+        for index, body in enumerate(new_bodies):
+            if body is None or not self.is_on_board(body[0]):
+                continue
+            if body[0] in food:
+                eaten.add(body[0])
+                new_healths[index] = 100
+                new_bodies[index] = body + (body[-1],)
+        if len(eaten) > 0:
+            food = food - eaten
+
+        body_squares = {}
+        for body in new_bodies:
+            if body is not None:
+                for square in body[1:]:
+                    body_squares[square] = True
+
+        eliminated = []
+        for index, body in enumerate(new_bodies):
+            if body is None:
+                continue
+            head = body[0]
+            if not self.is_on_board(head) or new_healths[index] <= 0 or head in body_squares:
+                eliminated.append(index)
+                continue
+            for other_index, other_body in enumerate(new_bodies):
+                if other_index != index and other_body is not None and other_body[0] == head and len(other_body) >= len(body):
+                    eliminated.append(index)
+                    break
+
+        for index in eliminated:
+            new_bodies[index] = None
+            new_healths[index] = 0
+
+        return CompactBoard(self.width, self.height, self.client_ids, tuple(new_bodies), tuple(new_healths), food, self.hazards, self.hazard_damage)
+
+    def distance_to_closest_food(self, index):
+        head = self.bodies[index][0]
+        if len(self.food) == 0:
+            return self.width + self.height
+        return min(abs(head[0] - x) + abs(head[1] - y) for x, y in self.food)
+
+    def distance_to_edge(self, index):
+        x, y = self.bodies[index][0]
+        return min(x, y, self.width - 1 - x, self.height - 1 - y)
+
+    # the number of squares the given snakes are closest to, see territory.TerritoryDelta.get_owned
+    def get_territory_size(self, indices, mode="manhattan"):
+        alive = [index for index in range(len(self.bodies)) if self.is_alive(index)]
+        heads = [self.bodies[index][0] for index in alive]
+        walls = None
+        if mode == "bfs":
+            walls = np.zeros((self.width, self.height), dtype=bool)
+            for x, y in self.get_occupied():
+                walls[x, y] = True
+        distances = territory.compute_distances(self.width, self.height, heads, mode=mode, walls=walls)
+        is_team = np.array([index in indices for index in alive], dtype=bool)
+        return int(territory.TerritoryDelta.get_owned(distances, is_team).sum())
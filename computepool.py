@@ -0,0 +1,226 @@
+import atexit
+import math
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import deque
+from functools import partial
+from multiprocessing import Pool, Queue, SimpleQueue
+import sharedboard
+from timebudget import SearchTimeout
+
+
+# The pool of worker processes that all games of the server share, sized to the machine
+# every game gets its own queue of tasks, and a free worker takes the next task of the game that is furthest below
+# its fair share of the workers, then of the game whose deadline is closest, so one busy game can not starve the others
+# games talk to the pool through a ComputeClient, which also works from the game's own process:
+# tasks are sent through a queue that all games share, and the results come back through a queue per game
+class ComputePool():
+    def __init__(self, processes=None):
+        self.processes = processes or os.cpu_count() or 1
+        # the workers have to share the resource tracker of the server, see sharedboard.start_resource_tracker
+        sharedboard.start_resource_tracker()
+        self.pool = Pool(processes=self.processes)
+        self.submissions = SimpleQueue()
+
+        self.condition = threading.Condition()
+        # per game id, the queue its results are sent to, its tasks that wait for a worker,
+        # and the number of its tasks that are running
+        self.result_queues = {}
+        self.pending = {}
+        self.running = {}
+        # the game id, batch and index of the tasks that are running
+        self.started = set()
+        self.in_flight = 0
+        # tasks of games with the same deadline and the same share of the workers run in the order they were sent
+        self.sequence = 0
+        self.closed = False
+
+        self.receiver = threading.Thread(target=self.receive, daemon=True)
+        self.dispatcher = threading.Thread(target=self.dispatch, daemon=True)
+        self.receiver.start()
+        self.dispatcher.start()
+
+    # registers a game and returns the client it sends its tasks with,
+    # has to be called in the process that created the pool, before the game's process is started
+    def connect(self, game_id=None):
+        if game_id is None:
+            game_id = uuid.uuid4().hex
+        # the client waits for its results with a timeout, which a SimpleQueue does not have
+        results = Queue()
+        with self.condition:
+            if self.closed:
+                raise Exception("The compute pool is shut down")
+            self.result_queues[game_id] = results
+            self.pending[game_id] = deque()
+            self.running[game_id] = 0
+        return ComputeClient(game_id, self.processes, self.submissions, results)
+
+    # forgets a game, its tasks that did not start yet are dropped
+    def remove_game(self, game_id):
+        with self.condition:
+            self.result_queues.pop(game_id, None)
+            self.pending.pop(game_id, None)
+            self.running.pop(game_id, None)
+
+    # moves the tasks that the games send into their queues
+    # a cancelled batch's tasks that did not start are dropped, an abandoned batch's running tasks are counted as finished too,
+    # as their results are not waited for, and a task whose worker process died never finishes
+    def receive(self):
+        while True:
+            message = self.submissions.get()
+            if message is None:
+                break
+            request_type, game_id, batch = message[:3]
+            with self.condition:
+                if game_id not in self.pending:
+                    continue
+                if request_type in ["cancel", "abandon"]:
+                    self.pending[game_id] = deque(task for task in self.pending[game_id] if task[2] != batch)
+                    if request_type == "abandon":
+                        abandoned = [task for task in self.started if task[:2] == (game_id, batch)]
+                        self.started.difference_update(abandoned)
+                        self.running[game_id] -= len(abandoned)
+                        self.in_flight -= len(abandoned)
+                        self.condition.notify_all()
+                    continue
+                deadline, func, tasks = message[3:]
+                for index, task in enumerate(tasks):
+                    self.pending[game_id].append((math.inf if deadline is None else deadline, self.sequence, batch, index, func, task))
+                    self.sequence += 1
+                self.condition.notify_all()
+
+    # starts the next task whenever a worker is free
+    def dispatch(self):
+        while True:
+            with self.condition:
+                while not self.closed and (self.in_flight >= self.processes or self.get_next_game() is None):
+                    self.condition.wait()
+                if self.closed:
+                    break
+                game_id = self.get_next_game()
+                _, _, batch, index, func, task = self.pending[game_id].popleft()
+                self.running[game_id] += 1
+                self.started.add((game_id, batch, index))
+                self.in_flight += 1
+
+            self.pool.apply_async(
+                func,
+                (task,),
+                callback=partial(self.finish, game_id, batch, index, True),
+                error_callback=partial(self.finish, game_id, batch, index, False)
+            )
+
+    # the game whose task runs next, None when no task is waiting
+    # a game's fair share is the number of workers divided by the number of games that have tasks waiting or running
+    def get_next_game(self):
+        waiting = [game_id for game_id, tasks in self.pending.items() if len(tasks) > 0]
+        if len(waiting) == 0:
+            return None
+        busy_games = len([game_id for game_id in self.pending if len(self.pending[game_id]) > 0 or self.running[game_id] > 0])
+        fair_share = max(1, math.ceil(self.processes / busy_games))
+        return min(waiting, key=lambda game_id: (
+            self.running[game_id] >= fair_share,
+            self.pending[game_id][0][0],
+            self.running[game_id],
+            self.pending[game_id][0][1]
+        ))
+
+    # called by the pool when a task is done, the result goes to the game's client
+    # the task of an abandoned batch was already counted as finished, and its result is not waited for
+    def finish(self, game_id, batch, index, ok, result):
+        with self.condition:
+            if (game_id, batch, index) not in self.started:
+                return
+            self.started.remove((game_id, batch, index))
+            self.in_flight -= 1
+            if game_id in self.running:
+                self.running[game_id] -= 1
+            results = self.result_queues.get(game_id)
+            self.condition.notify_all()
+        if results is not None:
+            results.put((batch, index, ok, result))
+
+    # stops taking new tasks, tells the games that their waiting tasks will not run,
+    # and waits for the running tasks before the worker processes exit
+    def close(self):
+        with self.condition:
+            if self.closed:
+                return
+            self.closed = True
+            self.condition.notify_all()
+        self.submissions.put(None)
+        self.receiver.join()
+        self.dispatcher.join()
+
+        with self.condition:
+            for game_id, tasks in self.pending.items():
+                for _, _, batch, index, _, _ in tasks:
+                    self.result_queues[game_id].put((batch, index, False, Exception("The compute pool was shut down")))
+                tasks.clear()
+
+            # the tasks of abandoned batches are not waited for, Pool.join would wait forever for a task whose worker died
+            while self.in_flight > 0:
+                self.condition.wait()
+        self.pool.terminate()
+        self.pool.join()
+
+
+# The side of a ComputePool that a game uses, map runs a function on every task like Pool.map
+# the client belongs to one game, and only one map of it runs at a time
+class ComputeClient():
+    def __init__(self, game_id, processes, submissions, results):
+        self.game_id = game_id
+        self.processes = processes
+        self.submissions = submissions
+        self.results = results
+        self.batch = 0
+        # the deadline of the tasks that are sent without one, usually the end of the turn
+        self.deadline = None
+        # the seconds after the deadline that a map waits for its results, see map
+        self.grace = 0.1
+
+    def set_deadline(self, deadline):
+        self.deadline = deadline
+
+    # the deadline decides which game's tasks run first when the workers are busy, it does not stop tasks,
+    # a map whose results are not back grace seconds after the deadline, like when a worker process died during
+    # one of its tasks, is abandoned and raises SearchTimeout, so the game does not wait for it forever
+    def map(self, func, tasks, deadline=None):
+        tasks = list(tasks)
+        if deadline is None:
+            deadline = self.deadline
+        self.batch += 1
+        self.submissions.put(("map", self.game_id, self.batch, deadline, func, tasks))
+
+        results = [None] * len(tasks)
+        received = 0
+        while received < len(tasks):
+            timeout = None if deadline is None else max(0, deadline + self.grace - time.time())
+            try:
+                batch, index, ok, result = self.results.get(timeout=timeout)
+            except queue.Empty:
+                self.submissions.put(("abandon", self.game_id, self.batch))
+                raise SearchTimeout()
+            # the results of a map that failed earlier are still arriving
+            if batch != self.batch:
+                continue
+            if not ok:
+                self.submissions.put(("cancel", self.game_id, self.batch))
+                raise result
+            results[index] = result
+            received += 1
+        return results
+
+
+# the pool of a process that is not a server, like a benchmark, which all its teams share
+local_pool = None
+
+def get_local_client():
+    global local_pool
+    if local_pool is None:
+        local_pool = ComputePool()
+        atexit.register(local_pool.close)
+    return local_pool.connect()
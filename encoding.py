@@ -0,0 +1,222 @@
+import struct
+from board import GeneralBoard
+from bitboard import BitBoard
+from snake import Snake
+
+# A compact binary encoding of a board state, sent to the worker processes instead of pickled boards
+# all numbers are little endian, squares are two unsigned bytes (x, y)
+#
+#   header     magic "BSNK", version, board class, territory mode, width, height, number of snakes
+#   snake      id, dead, health, length, body squares, indices of body squares that are uncovered
+#   food       squares
+#   hazards    squares
+#   doomed     for every depth in the board's doomed snake cache: depth, indices of the doomed snakes
+#
+# the version has to be increased whenever the layout changes, old encodings are then refused
+ENCODING_MAGIC = b"BSNK"
+ENCODING_VERSION = 1
+
+BOARD_CLASSES = [GeneralBoard, BitBoard]
+TERRITORY_MODES = ["manhattan", "bfs"]
+
+HEADER = struct.Struct("<4sBBBBBH")
+SNAKE_HEADER = struct.Struct("<BhH")
+
+
+# the coordinates are packed as bytes, a struct format per number of squares would fill the struct module's cache
+def pack_squares(squares):
+    coordinates = bytearray()
+    for x, y in squares:
+        coordinates.append(x)
+        coordinates.append(y)
+    return struct.pack("<H", len(squares)) + coordinates
+
+def unpack_squares(data, offset):
+    count, = struct.unpack_from("<H", data, offset)
+    offset += 2
+    coordinates = bytes(data[offset:offset + 2 * count])
+    offset += 2 * count
+    return [(coordinates[i], coordinates[i + 1]) for i in range(0, 2 * count, 2)], offset
+
+def pack_indices(indices):
+    return struct.pack("<H%dH" % len(indices), len(indices), *indices)
+
+def unpack_indices(data, offset):
+    count, = struct.unpack_from("<H", data, offset)
+    offset += 2
+    indices = struct.unpack_from("<%dH" % count, data, offset)
+    return list(indices), offset + 2 * count
+
+
+def encode_board(board):
+    if board.width > 255 or board.height > 255:
+        raise Exception("Boards larger than 255x255 can not be encoded")
+    board_class = 1 if isinstance(board, BitBoard) else 0
+
+    parts = [HEADER.pack(
+        ENCODING_MAGIC,
+        ENCODING_VERSION,
+        board_class,
+        TERRITORY_MODES.index(board.territory_mode),
+        board.width,
+        board.height,
+        len(board.snakes)
+    )]
+
+    for snake in board.snakes:
+        client_id = snake.client_id.encode("utf-8")
+        parts.append(struct.pack("<H", len(client_id)))
+        parts.append(client_id)
+        if snake.is_dead:
+            parts.append(SNAKE_HEADER.pack(1, 0, 0))
+            continue
+        parts.append(SNAKE_HEADER.pack(0, snake.health, snake.length))
+        parts.append(pack_squares([(cell.x, cell.y) for cell in snake.body]))
+        # a popped stacked tail leaves a square of the body uncovered, see GeneralBoard.uncovered_cells
+        parts.append(pack_indices([i for i, cell in enumerate(snake.body) if cell.snake is not snake]))
+
+    parts.append(pack_squares([(cell.x, cell.y) for cell in board.all_cells if cell.food]))
+    parts.append(pack_squares([(cell.x, cell.y) for cell in board.all_cells if cell.hazard]))
+
+    state_key = board.get_state_key()
+    doomed = [(depth, doomed_snakes) for (key, depth), doomed_snakes in board.doomed_snakes.items() if key == state_key]
+    parts.append(struct.pack("<H", len(doomed)))
+    indices = {snake.client_id: i for i, snake in enumerate(board.snakes)}
+    for depth, doomed_snakes in doomed:
+        parts.append(struct.pack("<H", depth))
+        parts.append(pack_indices([indices[client_id] for client_id in doomed_snakes]))
+
+    return b"".join(parts)
+
+
+# data can be any buffer, like a view of a shared memory segment
+def decode_board(data):
+    magic, version, board_class, territory_mode, width, height, snake_count = HEADER.unpack_from(data, 0)
+    if magic != ENCODING_MAGIC:
+        raise Exception("Not an encoded board")
+    if version != ENCODING_VERSION:
+        raise Exception("Unsupported board encoding version: {}".format(version))
+    offset = HEADER.size
+
+    board = BOARD_CLASSES[board_class](width, height)
+    board.territory_mode = TERRITORY_MODES[territory_mode]
+
+    uncovered = []
+    for _ in range(snake_count):
+        id_length, = struct.unpack_from("<H", data, offset)
+        offset += 2
+        client_id = bytes(data[offset:offset + id_length]).decode("utf-8")
+        offset += id_length
+
+        snake = Snake(client_id)
+        snake.board = board
+        board.add_snake(snake, place=False)
+
+        is_dead, health, length = SNAKE_HEADER.unpack_from(data, offset)
+        offset += SNAKE_HEADER.size
+        if is_dead:
+            snake.is_dead = True
+            snake.set_body(None)
+            snake.length = 0
+            snake.health = 0
+            continue
+
+        squares, offset = unpack_squares(data, offset)
+        uncovered_indices, offset = unpack_indices(data, offset)
+        snake.health = health
+        snake.length = length
+        snake.set_body(board.get_cell(x, y) for x, y in squares)
+        snake.head = snake.body[0]
+        snake.tail = snake.body[-1]
+        board.place_snake(snake)
+        uncovered += [(snake.body[i], snake) for i in uncovered_indices]
+
+    # the cells are given back to their snakes before the next move, like on the board that was encoded
+    for cell, snake in uncovered:
+        cell.clear_snake_info()
+        board.uncovered_cells.append((cell, snake))
+
+    food, offset = unpack_squares(data, offset)
+    for x, y in food:
+        board.get_cell(x, y).set_food(True)
+    hazards, offset = unpack_squares(data, offset)
+    for x, y in hazards:
+        board.get_cell(x, y).set_hazard(True)
+
+    board.rehash()
+
+    doomed_count, = struct.unpack_from("<H", data, offset)
+    offset += 2
+    state_key = board.get_state_key()
+    for _ in range(doomed_count):
+        depth, = struct.unpack_from("<H", data, offset)
+        offset += 2
+        indices, offset = unpack_indices(data, offset)
+        board.doomed_snakes[(state_key, depth)] = frozenset(board.snakes[i].client_id for i in indices)
+
+    return board
+
+
+# the parts of an encoded board that describe its turn, as plain values that can be changed without a board:
+# a dict with the board's class, territory mode, width and height, its food and hazards as lists of squares,
+# and per snake a list of its id, whether it is dead, its health, its length, its body squares and the indices
+# of its uncovered body squares
+def decode_state(data):
+    magic, version, board_class, territory_mode, width, height, snake_count = HEADER.unpack_from(data, 0)
+    if magic != ENCODING_MAGIC:
+        raise Exception("Not an encoded board")
+    if version != ENCODING_VERSION:
+        raise Exception("Unsupported board encoding version: {}".format(version))
+    offset = HEADER.size
+
+    snakes = []
+    for _ in range(snake_count):
+        id_length, = struct.unpack_from("<H", data, offset)
+        offset += 2
+        client_id = bytes(data[offset:offset + id_length]).decode("utf-8")
+        offset += id_length
+        is_dead, health, length = SNAKE_HEADER.unpack_from(data, offset)
+        offset += SNAKE_HEADER.size
+        squares, uncovered_indices = [], []
+        if not is_dead:
+            squares, offset = unpack_squares(data, offset)
+            uncovered_indices, offset = unpack_indices(data, offset)
+        snakes.append([client_id, bool(is_dead), health, length, squares, uncovered_indices])
+
+    food, offset = unpack_squares(data, offset)
+    hazards, offset = unpack_squares(data, offset)
+    return {
+        "board_class": board_class,
+        "territory_mode": territory_mode,
+        "width": width,
+        "height": height,
+        "snakes": snakes,
+        "food": food,
+        "hazards": hazards,
+    }
+
+# encodes a state of decode_state, without a doomed snake cache
+def encode_state(state):
+    parts = [HEADER.pack(
+        ENCODING_MAGIC,
+        ENCODING_VERSION,
+        state["board_class"],
+        state["territory_mode"],
+        state["width"],
+        state["height"],
+        len(state["snakes"])
+    )]
+    for client_id, is_dead, health, length, squares, uncovered_indices in state["snakes"]:
+        client_id = client_id.encode("utf-8")
+        parts.append(struct.pack("<H", len(client_id)))
+        parts.append(client_id)
+        if is_dead:
+            parts.append(SNAKE_HEADER.pack(1, 0, 0))
+            continue
+        parts.append(SNAKE_HEADER.pack(0, health, length))
+        parts.append(pack_squares(squares))
+        parts.append(pack_indices(uncovered_indices))
+    parts.append(pack_squares(state["food"]))
+    parts.append(pack_squares(state["hazards"]))
+    parts.append(struct.pack("<H", 0))
+    return b"".join(parts)
@@ -0,0 +1,39 @@
+import json
+import re
+
+# orjson decodes and encodes game states several times faster than json, it is used when it is installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# decodes the body of a request, which can be bytes or a str
+def loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+# encodes a game state as compact JSON bytes
+def dumps(data):
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(",", ":")).encode("utf-8")
+
+
+# the game id, in the game object before any object nested in it, and the turn, which only the top level has
+GAME_ID_PATTERN = re.compile(rb'"game"\s*:\s*\{[^{}]*?"id"\s*:\s*"([^"\\]*)"')
+TURN_PATTERN = re.compile(rb'"turn"\s*:\s*(-?\d+)')
+
+# the game id and turn of the body of a request, as a game state with only those, which the server routes requests by,
+# they are found without decoding the body, which the game worker decodes once into its board
+# a body they can not be found in like that is decoded
+def read_header(data):
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    game_id = GAME_ID_PATTERN.search(data)
+    turn = TURN_PATTERN.search(data)
+    if game_id is None or turn is None:
+        game_state = loads(data)
+        return {"game": {"id": game_state["game"]["id"]}, "turn": game_state.get("turn")}
+    return {"game": {"id": game_id.group(1).decode("utf-8")}, "turn": int(turn.group(1))}
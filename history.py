@@ -0,0 +1,188 @@
+import bisect
+import struct
+import sys
+from array import array
+import encoding
+
+# The boards of the turns of a game, for its replay, kept as encoded keyframes and the changes between turns
+# a keyframe is the encoding of a board, see encoding.encode_board, every turn after it until the next keyframe
+# is stored as the heads its snakes moved to, the number of squares their tails left, how often their tails are stacked
+# after eating, their health, length and deaths,
+# and the food and hazards that appeared or disappeared, which is a few bytes per snake instead of a copy of the board
+# a turn is rebuilt on demand from the keyframe before it, so at most keyframe_interval deltas are applied
+# when the history takes more than max_bytes, its oldest keyframe and the turns until the next one are dropped
+# the territories are not stored, like the copies of the boards did not keep them, they can be calculated again,
+# see decode_board, neither are the doomed snakes of the encoding, which only the search uses
+class BoardHistory():
+    def __init__(self, keyframe_interval=32, max_bytes=4 * 1024 * 1024):
+        self.keyframe_interval = keyframe_interval
+        self.max_bytes = max_bytes
+        # per recorded turn, in order, its turn number and its keyframe or delta
+        self.turns = array("i")
+        self.records = []
+        # the indices of the keyframes in records
+        self.keyframes = []
+        self.size = 0
+        # the colors and teams of the snakes, which the encoding does not keep, they do not change during a game
+        self.colors = {}
+        self.enemies = {}
+        # the state of the last recorded turn, which the next delta is taken from
+        self.last_state = None
+
+    def __len__(self):
+        return len(self.records)
+
+    def record(self, board, turn=None):
+        if turn is None:
+            turn = self.turns[-1] + 1 if len(self.turns) > 0 else 0
+        if len(self.turns) > 0 and turn <= self.turns[-1]:
+            raise Exception("Turn {} was recorded after turn {}".format(turn, self.turns[-1]))
+        for snake in board.snakes:
+            if getattr(snake, "color", None) is not None:
+                self.colors[snake.client_id] = snake.color
+            self.enemies[snake.client_id] = snake.is_enemy
+
+        data = encoding.encode_board(board)
+        state = encoding.decode_state(data)
+        delta = None
+        if self.last_state is not None and len(self.records) - self.keyframes[-1] < self.keyframe_interval:
+            delta = encode_delta(self.last_state, state)
+        if delta is None:
+            # the doomed snakes are dropped, so every frame of the history has the same encoding
+            self.keyframes.append(len(self.records))
+            self.records.append(encoding.encode_state(state))
+        else:
+            self.records.append(delta)
+        self.turns.append(turn)
+        self.size += sys.getsizeof(self.records[-1])
+        self.last_state = state
+
+        # the last segment is kept, however large it is
+        while self.size > self.max_bytes and len(self.keyframes) > 1:
+            self.drop_segment()
+
+    def drop_segment(self):
+        end = self.keyframes[1]
+        self.size -= sum(sys.getsizeof(record) for record in self.records[:end])
+        del self.records[:end]
+        del self.turns[:end]
+        self.keyframes = [index - end for index in self.keyframes[1:]]
+
+    # the turns that can be rebuilt, the first ones are missing if the history was over max_bytes
+    def get_turns(self):
+        return list(self.turns)
+
+    # the encoded board of a turn
+    def get_frame(self, turn):
+        index = bisect.bisect_left(self.turns, turn)
+        if index == len(self.turns) or self.turns[index] != turn:
+            raise Exception("Turn {} is not in the history".format(turn))
+        keyframe = self.keyframes[bisect.bisect_right(self.keyframes, index) - 1]
+        state = encoding.decode_state(self.records[keyframe])
+        for record in self.records[keyframe + 1:index + 1]:
+            apply_delta(state, record)
+        return encoding.encode_state(state)
+
+    # the encoded boards of all turns, in order, which applies every delta once
+    def get_frames(self):
+        frames = []
+        state = None
+        for record in self.records:
+            if state is not None and record[:4] != encoding.ENCODING_MAGIC:
+                apply_delta(state, record)
+                frames.append(encoding.encode_state(state))
+            else:
+                state = encoding.decode_state(record)
+                frames.append(record)
+        return frames
+
+    # the board of a turn, see decode_board
+    def get_board(self, turn, territory=False):
+        return decode_board(self.get_frame(turn), self.colors, self.enemies, territory)
+
+
+# a new BitBoard or GeneralBoard like encoding.decode_board returns, with the colors and teams of its snakes,
+# which are given per snake id, and with their territories if territory is True, which are calculated again,
+# the boards of the replays have none, as the copies of the boards that were drawn before did not keep them
+def decode_board(data, colors, enemies, territory=False):
+    board = encoding.decode_board(data)
+    for snake in board.snakes:
+        snake.color = colors.get(snake.client_id)
+        snake.is_enemy = enemies.get(snake.client_id, True)
+    if territory:
+        board.calculate_closest_snake()
+    return board
+
+
+# a delta starts with its magic, which can not be the start of an encoded board, then per snake of the previous turn,
+# in the same order, whether it died, its health, its length, the number of squares its tail left, the number of times
+# its new tail is repeated, the squares its head moved to and the indices of its uncovered body squares,
+# then the food and hazards added and removed
+DELTA_MAGIC = b"BSND"
+SNAKE_DELTA = struct.Struct("<BhHHB")
+DEAD = 1
+
+def encode_delta(previous, state):
+    for key in ["board_class", "territory_mode", "width", "height"]:
+        if previous[key] != state[key]:
+            return None
+    if [snake[0] for snake in previous["snakes"]] != [snake[0] for snake in state["snakes"]]:
+        return None
+
+    parts = [DELTA_MAGIC]
+    for (_, was_dead, _, _, old_squares, _), (_, is_dead, health, length, squares, uncovered_indices) in zip(previous["snakes"], state["snakes"]):
+        if is_dead:
+            parts.append(SNAKE_DELTA.pack(DEAD, 0, 0, 0, 0))
+            continue
+        if was_dead:
+            return None
+        move = get_move(old_squares, squares)
+        if move is None:
+            return None
+        heads, stacked = move
+        parts.append(SNAKE_DELTA.pack(0, health, length, len(old_squares) - len(squares) + heads + stacked, stacked))
+        parts.append(encoding.pack_squares(squares[:heads]))
+        parts.append(encoding.pack_indices(uncovered_indices))
+
+    for key in ["food", "hazards"]:
+        old_squares, squares = set(previous[key]), set(state[key])
+        parts.append(encoding.pack_squares([square for square in state[key] if square not in old_squares]))
+        parts.append(encoding.pack_squares([square for square in previous[key] if square not in squares]))
+    return b"".join(parts)
+
+# the number of squares at the front of the new body that the snake moved to, and the number of times its new tail
+# is repeated at the end of it, like the tail of a snake that ate, the rest of it has to be the front of the old body,
+# None if the body is not the old one moved, like a snake that was placed again
+def get_move(old_squares, squares):
+    for stacked in range(3):
+        if stacked > 0 and (len(squares) < stacked + 1 or squares[-stacked - 1:] != [squares[-1]] * (stacked + 1)):
+            break
+        for heads in range(min(len(squares) - stacked, 3) + 1):
+            rest = len(squares) - heads - stacked
+            if rest <= len(old_squares) and squares[heads:heads + rest] == old_squares[:rest]:
+                return heads, stacked
+    return None
+
+def apply_delta(state, data):
+    offset = len(DELTA_MAGIC)
+    for snake in state["snakes"]:
+        flags, health, length, removed, stacked = SNAKE_DELTA.unpack_from(data, offset)
+        offset += SNAKE_DELTA.size
+        if flags & DEAD:
+            snake[1:] = [True, 0, 0, [], []]
+            continue
+        heads, offset = encoding.unpack_squares(data, offset)
+        uncovered_indices, offset = encoding.unpack_indices(data, offset)
+        squares = heads + snake[4][:len(snake[4]) - removed]
+        squares += squares[-1:] * stacked
+        snake[1:] = [False, health, length, squares, uncovered_indices]
+
+    for key in ["food", "hazards"]:
+        added, offset = encoding.unpack_squares(data, offset)
+        removed, offset = encoding.unpack_squares(data, offset)
+        if len(removed) > 0:
+            removed = set(removed)
+            state[key] = [square for square in state[key] if square not in removed]
+        if len(added) > 0:
+            # in the order of the board's cells, like encoding.encode_board
+            state[key] = sorted(state[key] + added)
@@ -0,0 +1,199 @@
+import atexit
+import glob
+import gzip
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from datetime import datetime
+import gamestate
+
+
+# The game states of the turns of the games a process plays, appended to one gzip compressed JSONL file per game
+# a turn only puts its state in a queue, a background thread writes the queue in batches
+# and flushes the files after every batch, so the file of a game that was never closed can be read up to its last batch
+# both teams of a game record every turn, a turn that is already in the file is skipped
+class GameJournal():
+    def __init__(self, directory="./game_states", batch_size=64, flush_interval=1.0):
+        self.directory = directory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.pid = os.getpid()
+        self.queue = queue.SimpleQueue()
+        # per game id, its open file, its path and the last turn written to it
+        self.files = {}
+        self.paths = {}
+        self.last_turns = {}
+        self.closed = False
+
+        self.writer = threading.Thread(target=self.write, daemon=True)
+        self.writer.start()
+
+    # the state must not change after it was recorded, it is written later by the writer thread
+    def record(self, game_id, game_state):
+        self.queue.put(("record", game_id, game_state))
+
+    # closes the file of a game once the states recorded before are written
+    def close_game(self, game_id):
+        self.queue.put(("close", game_id, None))
+
+    # writes everything that was recorded and closes the files
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.put(None)
+        self.writer.join()
+
+    # the path of a game's file, the directory is named like the directories of the old one file per turn layout
+    def get_path(self, game_id):
+        path = self.paths.get(game_id)
+        if path is None:
+            directory = os.path.join(self.directory, datetime.now().strftime("%Y-%m-%d_%H") + " (" + game_id[:3] + ")")
+            os.makedirs(directory, exist_ok=True)
+            path = self.paths[game_id] = os.path.join(directory, game_id + ".jsonl.gz")
+        return path
+
+    def write(self):
+        stopped = False
+        while not stopped:
+            # a batch is what arrives within flush_interval of its first message
+            batch = [self.queue.get()]
+            batch_end = time.time() + self.flush_interval
+            while batch[-1] is not None and len(batch) < self.batch_size:
+                timeout = batch_end - time.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+
+            written = set()
+            for message in batch:
+                if message is None:
+                    stopped = True
+                    break
+                request_type, game_id, game_state = message
+                try:
+                    if request_type == "record":
+                        if self.write_state(game_id, game_state):
+                            written.add(game_id)
+                    else:
+                        self.close_file(game_id)
+                        written.discard(game_id)
+                except Exception as e:
+                    print("[WARNING] Could not write the journal of game {}: {}".format(game_id, e))
+
+            for game_id in written:
+                self.files[game_id].flush()
+
+        for game_id in list(self.files):
+            self.close_file(game_id)
+
+    def write_state(self, game_id, game_state):
+        turn = game_state["turn"]
+        if turn <= self.last_turns.get(game_id, -1):
+            return False
+        file = self.files.get(game_id)
+        if file is None:
+            # appending to a closed file adds a gzip member, which the reader reads as one stream
+            file = self.files[game_id] = gzip.open(self.get_path(game_id), "ab", compresslevel=6)
+        file.write(gamestate.dumps(game_state) + b"\n")
+        self.last_turns[game_id] = turn
+        return True
+
+    def close_file(self, game_id):
+        file = self.files.pop(game_id, None)
+        self.paths.pop(game_id, None)
+        self.last_turns.pop(game_id, None)
+        if file is not None:
+            file.close()
+
+
+# the journal of the process, which all the games it plays share
+journal = None
+
+def get_journal():
+    global journal
+    # a forked process gets a copy of the journal without its writer thread
+    if journal is None or journal.pid != os.getpid():
+        journal = GameJournal()
+        atexit.register(journal.close)
+    return journal
+
+# closes the journal of the process if it has one, for processes that do not run atexit handlers
+def close_journal():
+    if journal is not None and journal.pid == os.getpid():
+        journal.close()
+
+
+# the states of a game one turn at a time, from a journal file or from a directory of the old layout
+# with one JSON file per turn, a file that is still being written is read up to its last flushed batch
+def read_game(path):
+    if os.path.isdir(path):
+        yield from read_legacy_game(path)
+        return
+    with gzip.open(path, "rb") as file:
+        try:
+            for line in file:
+                # the last line of a file whose writer stopped while writing it
+                if not line.endswith(b"\n"):
+                    return
+                yield gamestate.loads(line)
+        except EOFError:
+            return
+
+def read_legacy_game(directory):
+    turns = []
+    for path in glob.glob(os.path.join(glob.escape(directory), "*.json")):
+        name = os.path.splitext(os.path.basename(path))[0]
+        if name.isdigit():
+            turns.append((int(name), path))
+    for _, path in sorted(turns):
+        with open(path, "r") as file:
+            yield json.load(file)
+
+# the journal files in a directory, and the directories of the old layout that were not imported
+def find_games(directory="./game_states"):
+    paths = glob.glob(os.path.join(glob.escape(directory), "**", "*.jsonl.gz"), recursive=True)
+    journal_directories = set(os.path.dirname(path) for path in paths)
+    legacy_directories = set()
+    for path in glob.glob(os.path.join(glob.escape(directory), "**", "*.json"), recursive=True):
+        game_directory = os.path.dirname(path)
+        if os.path.splitext(os.path.basename(path))[0].isdigit() and game_directory not in journal_directories:
+            legacy_directories.add(game_directory)
+    return sorted(paths + list(legacy_directories))
+
+# writes the states of every game of the old layout in a directory to a journal file in the game's directory
+# the old files are kept, find_games only returns the journal once it exists
+def import_legacy_games(directory="./game_states"):
+    imported = []
+    for path in find_games(directory):
+        if not os.path.isdir(path):
+            continue
+        states = read_legacy_game(path)
+        first_state = next(states, None)
+        if first_state is None:
+            continue
+        journal_path = os.path.join(path, first_state["game"]["id"] + ".jsonl.gz")
+        with gzip.open(journal_path, "wb", compresslevel=6) as file:
+            file.write(gamestate.dumps(first_state) + b"\n")
+            for game_state in states:
+                file.write(gamestate.dumps(game_state) + b"\n")
+        imported.append(journal_path)
+    return imported
+
+
+# usage: python journal.py import [directory of saved game states]
+#        python journal.py list [directory of saved game states]
+if __name__ == "__main__":
+    directory = sys.argv[2] if len(sys.argv) > 2 else "./game_states"
+    if len(sys.argv) > 1 and sys.argv[1] == "import":
+        for path in import_legacy_games(directory):
+            print(path)
+    else:
+        for path in find_games(directory):
+            print(path, sum(1 for _ in read_game(path)))
@@ -0,0 +1,51 @@
+import bisect
+import threading
+
+# the upper bounds of the buckets in ms, the last bucket holds everything slower
+LATENCY_BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, 350, 500, 1000]
+
+
+# The latencies of the requests of one route, counted in buckets so recording a request costs next to nothing
+# percentiles are the upper bound of the bucket they fall in
+class LatencyHistogram():
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+        self.lock = threading.Lock()
+
+    # latency is in ms
+    def record(self, latency):
+        with self.lock:
+            self.counts[bisect.bisect_left(LATENCY_BUCKETS, latency)] += 1
+            self.count += 1
+            self.total += latency
+            self.max = max(self.max, latency)
+
+    def get_percentile(self, percentile):
+        if self.count == 0:
+            return 0
+        needed = percentile / 100 * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= needed:
+                return LATENCY_BUCKETS[i] if i < len(LATENCY_BUCKETS) else self.max
+        return self.max
+
+    def get_stats(self):
+        with self.lock:
+            buckets = {}
+            for i, count in enumerate(self.counts):
+                name = "<=" + str(LATENCY_BUCKETS[i]) if i < len(LATENCY_BUCKETS) else ">" + str(LATENCY_BUCKETS[-1])
+                buckets[name] = count
+            return {
+                "count": self.count,
+                "mean": self.total / self.count if self.count > 0 else 0,
+                "max": self.max,
+                "p50": self.get_percentile(50),
+                "p90": self.get_percentile(90),
+                "p99": self.get_percentile(99),
+                "buckets": buckets,
+            }
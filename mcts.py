@@ -0,0 +1,159 @@
+import math
+import random
+import time
+from compactboard import CompactBoard
+from timebudget import SearchTimeout
+
+
+# A node of the search tree, with separate move statistics for every living snake (decoupled UCT)
+# every snake picks its own move from its own statistics, and the joint move leads to the child
+class MCTSNode():
+    def __init__(self, board):
+        self.board = board
+        self.visits = 0
+        occupied = board.get_occupied()
+        # per snake index, a dict from move to [visits, total reward]
+        self.stats = []
+        for index in range(len(board.bodies)):
+            self.stats.append({move: [0, 0.0] for move in board.get_moves(index, occupied)})
+        self.children = {}
+
+    def select(self, exploration):
+        joint_move = []
+        for index, stats in enumerate(self.stats):
+            if len(stats) == 0:
+                continue
+            unvisited = [move for move, (visits, _) in stats.items() if visits == 0]
+            if len(unvisited) > 0:
+                joint_move.append((index, random.choice(unvisited)))
+                continue
+            log_visits = math.log(self.visits)
+            best_move = max(stats, key=lambda move: stats[move][1] / stats[move][0] + exploration * math.sqrt(log_visits / stats[move][0]))
+            joint_move.append((index, best_move))
+        return tuple(joint_move)
+
+    def update(self, joint_move, rewards):
+        self.visits += 1
+        for index, move in joint_move:
+            self.stats[index][move][0] += 1
+            self.stats[index][move][1] += rewards[index]
+
+
+# Monte Carlo tree search over the simultaneous moves of all snakes
+# every worker grows its own tree from the same position until the deadline (root parallelisation),
+# and the move statistics of the roots are added together
+class MCTSEngine():
+    def __init__(self, pool=None, workers=4, exploration=1.4, playout_depth=15, return_margin=0.01):
+        self.pool = pool
+        self.workers = workers
+        self.exploration = exploration
+        self.playout_depth = playout_depth
+        # seconds before the deadline at which the workers stop, to send their statistics back in time
+        self.return_margin = return_margin
+
+    # returns a dict from client id to move for the living snakes of team_ids, and information about the search
+    def search(self, board, team_ids, deadline=None):
+        start = time.time()
+        if deadline is None:
+            deadline = start + 0.2
+        root = CompactBoard.from_board(board)
+        team = [root.get_index(client_id) for client_id in team_ids if root.is_alive(root.get_index(client_id))]
+        if len(team) == 0:
+            return {}, {"playouts": 0, "playouts_per_second": 0}
+
+        worker_deadline = deadline - self.return_margin
+        tasks = [(root, team, worker_deadline, self.exploration, self.playout_depth, random.getrandbits(32)) for _ in range(self.workers)]
+        if self.pool is None:
+            results = list(map(run_mcts, tasks))
+        else:
+            try:
+                results = self.pool.map(run_mcts, tasks)
+            except SearchTimeout:
+                # the pool did not answer in time, one tree is grown here, which stops at once after the deadline
+                print("[WARNING] The compute pool did not answer the MCTS search in time")
+                results = [run_mcts(tasks[0])]
+
+        # the root statistics of all trees are added together
+        stats = {index: {} for index in team}
+        playouts = 0
+        for root_stats, worker_playouts in results:
+            playouts += worker_playouts
+            for index in team:
+                for move, (visits, reward) in root_stats[index].items():
+                    merged = stats[index].setdefault(move, [0, 0.0])
+                    merged[0] += visits
+                    merged[1] += reward
+
+        moves = {}
+        for index in team:
+            if len(stats[index]) == 0:
+                moves[root.client_ids[index]] = "up"
+                continue
+            moves[root.client_ids[index]] = max(stats[index], key=lambda move: stats[index][move][0])
+
+        duration = time.time() - start
+        info = {
+            "playouts": playouts,
+            "playouts_per_second": playouts / duration if duration > 0 else 0,
+            "root_stats": {root.client_ids[index]: stats[index] for index in team},
+        }
+        return moves, info
+
+
+# the reward of every snake at the end of a playout, between 0 and 1
+# our snakes share a reward for surviving, and for the enemies that died, an enemy is rewarded for surviving
+def get_rewards(board, team):
+    enemies = [index for index in range(len(board.bodies)) if index not in team]
+    team_alive = sum(1 for index in team if board.is_alive(index)) / len(team)
+    enemies_dead = sum(1 for index in enemies if not board.is_alive(index)) / max(1, len(enemies))
+    team_reward = 0.8 * team_alive + 0.2 * enemies_dead
+
+    rewards = []
+    for index in range(len(board.bodies)):
+        if index in team:
+            rewards.append(team_reward)
+        else:
+            rewards.append(1.0 if board.is_alive(index) else 0.0)
+    return rewards
+
+
+# plays random moves that do not run into walls or bodies until the depth is reached or our team is dead
+def playout(board, team, depth):
+    for _ in range(depth):
+        if not any(board.is_alive(index) for index in team):
+            break
+        occupied = board.get_occupied()
+        moves = {}
+        for index in range(len(board.bodies)):
+            if board.is_alive(index):
+                moves[index] = random.choice(board.get_moves(index, occupied))
+        board = board.step(moves)
+    return get_rewards(board, team)
+
+
+# grows one tree until the deadline, runs in a worker process
+# returns the move statistics of the root and the number of playouts
+def run_mcts(task):
+    board, team, deadline, exploration, playout_depth, seed = task
+    random.seed(seed)
+    root = MCTSNode(board)
+    playouts = 0
+    while playouts == 0 or time.time() < deadline:
+        node = root
+        path = []
+        while any(node.board.is_alive(index) for index in team):
+            joint_move = node.select(exploration)
+            path.append((node, joint_move))
+            child = node.children.get(joint_move)
+            if child is None:
+                child = MCTSNode(node.board.step(dict(joint_move)))
+                node.children[joint_move] = child
+                node = child
+                break
+            node = child
+
+        rewards = playout(node.board, team, playout_depth)
+        for path_node, joint_move in path:
+            path_node.update(joint_move, rewards)
+        playouts += 1
+    return [root.stats[index] for index in range(len(board.bodies))], playouts
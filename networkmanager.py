@@ -1,44 +1,120 @@
 from flask import Flask
 from flask import request
+from flask import g
 import os
 import logging
+import asyncio
+import atexit
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future
 from snakeduo import SnakeDuo
+from board import Board
+import encoding
+import gamestate
+import journal
+import zobrist
 from snake import Snake, ControllableSnake as CSnake
-from multiprocessing import Process, Lock, Manager, Queue, Pool
+from multiprocessing import Pipe, Process, Queue
+from computepool import ComputePool
+from replay import ReplayRenderer
+from asgiserver import BattlesnakeApp
+from latency import LatencyHistogram
 
 our_color = "#ff4e03"
 
 class Game():
-    def __init__(self, game_id):
+    def __init__(self, game_id, compute, replays):
         self.game_id = game_id
+        # the game's client of the server's compute pool, shared by both teams
+        self.compute = compute
+        # the client of the server's replay renderer
+        self.replays = replays
         self.snakes = {}
         self.teams = {}
 
-def game_process(game_id, input_queue, output_queue):
-    game = Game(game_id)
+# the board sizes of the game modes, a game worker runs the board code on each of them before it takes a game
+WARM_UP_BOARD_SIZES = [(7, 7), (11, 11), (19, 19)]
+
+# computes the zobrist keys of the squares and makes the first calls into the board code and numpy,
+# so the first turn of a worker's first game is not slower than the turns after it
+def warm_up():
+    for width, height in WARM_UP_BOARD_SIZES:
+        for x in range(width):
+            for y in range(height):
+                zobrist.food_key(x, y)
+                zobrist.hazard_key(x, y)
+
+        snakes = []
+        for i, x in enumerate([1, width - 2]):
+            body = [{"x": x, "y": y} for y in range(3)]
+            snakes.append({"id": "warm-up-" + str(i), "health": 100, "body": body, "head": body[0], "length": 3, "customizations": {"color": our_color}})
+        board_state = {"width": width, "height": height, "snakes": snakes, "food": [{"x": width // 2, "y": height // 2}], "hazards": []}
+        board = Board(width, height, our_snakes=[], all_snakes_json=snakes)
+        board.update_state(board_state)
+        board.b.get_doomed_snakes(2)
+        board.b.get_territory_increases(board.b.snakes, board.b.snakes[0])
+        encoding.decode_board(encoding.encode_board(board.b))
+
+# the loop of a game worker, which handles the requests of one game at a time and then waits for the next game
+# the worker keeps its client of the compute pool for all the games it plays
+def game_worker(input_queue, responses, compute, replays):
+    warm_up()
+    responses.send("ready")
+
+    game = None
     while True:
-        request_type, snake_id, request_data = input_queue.get()
+        message = input_queue.get()
+        if message is None:
+            break
+        request_type, game_id, snake_id, request_data, request_time = message
+
+        if game is None or game.game_id != game_id:
+            game = Game(game_id, compute, replays)
+
+        if request_type == "abandon":
+            abandon_game(game)
+            game = None
+            continue
+
+        # the server sends the body of the request, which is decoded here
+        decode_time = 0
+        if isinstance(request_data, (bytes, str)):
+            t1_decode = time.time()
+            request_data = gamestate.loads(request_data)
+            decode_time = (time.time() - t1_decode)*1000
 
         if request_type == "start":
             response = start_function(game, snake_id, request_data)
         elif request_type == "move":
-            response = move_function(game, snake_id, request_data)
+            response = move_function(game, snake_id, request_data, decode_time, request_time)
         elif request_type == "end":
             response, all_ended = end_function(game, snake_id, request_data)
-            output_queue.put(all_ended)
+            responses.send(all_ended)
         else:
             print("Invalid request type: ", request_type)
         
-        output_queue.put(response)
+        responses.send(response)
+
+        if request_type == "end" and all_ended:
+            game = None
+
+    # the process exits without running atexit handlers
+    journal.close_journal()
+
+def get_team_id(snake_id):
+    return 1 if snake_id == "1" or snake_id == "2" else 2
 
 def start_function(game, snake_id, request_data):
-    team_id = 1 if snake_id == "1" or snake_id == "2" else 2
+    team_id = get_team_id(snake_id)
 
     if not team_id in game.teams:
         if team_id == 1:
-            team = SnakeDuo("Team 1", our_color, CSnake("1", "Snake 1"), CSnake("2", "Snake 2"), save_replay=True)
+            team = SnakeDuo("Team 1", our_color, CSnake("1", "Snake 1"), CSnake("2", "Snake 2"), save_replay=True, compute=game.compute, replays=game.replays)
         elif team_id == 2:
-            team = SnakeDuo("Team 2", "#00FF00", CSnake("3", "Snake 1"), CSnake("4", "Snake 2"), save_replay=False)
+            team = SnakeDuo("Team 2", "#00FF00", CSnake("3", "Snake 1"), CSnake("4", "Snake 2"), save_replay=False, compute=game.compute, replays=game.replays)
 
         game.teams[team_id] = team
         game.snakes[team.snake1.id] = team.snake1
@@ -58,8 +134,459 @@ def end_function(game, snake_id, request_data):
 
     return result, all_teams_ended
 
-def move_function(game, snake_id, request_data):
-    return game.snakes[snake_id].net.on_move(request_data)
+# returns the responses of the snakes of the team, the team calculates the moves of both its snakes in the first request
+# of a turn, so the server answers the other snake's request of the turn without asking again, see GameWorkerPool.move
+# request_time is when the server received the request, the turn's time budget starts then
+def move_function(game, snake_id, request_data, decode_time=0, request_time=None):
+    snake = game.snakes[snake_id]
+    snake.team.decode_time = decode_time
+    snake.team.request_time = request_time
+    responses = {snake_id: snake.net.on_move(request_data)}
+    for other_id, other in game.snakes.items():
+        move = snake.team.get_move(other) if other.team is snake.team and other is not snake else None
+        if move is not None:
+            responses[other_id] = {"move": move}
+    return responses
+
+# frees what the teams of a game that never ended hold, without saving replays
+def abandon_game(game):
+    for team in game.teams.values():
+        team.release_shared_board()
+    journal.get_journal().close_game(game.game_id)
+
+# A process that plays games for the server, one game at a time
+# requests are sent through a queue, and the responses come back through a pipe,
+# which an event loop can wait on as well as a thread, see get_response_async
+class GameWorker():
+    def __init__(self, compute_pool, replay_renderer):
+        self.worker_id = uuid.uuid4().hex
+        self.compute_pool = compute_pool
+        self.compute = compute_pool.connect(self.worker_id)
+        self.replays = replay_renderer.connect()
+        self.input_queue = Queue()
+        self.responses, responses = Pipe(duplex=False)
+        self.process = Process(target=game_worker, args=(self.input_queue, responses, self.compute, self.replays), daemon=True)
+        self.process.start()
+        # only the worker writes to the pipe, so reading it ends when the worker dies
+        responses.close()
+        self.game_id = None
+        self.games_played = 0
+        self.last_active = time.time()
+
+    def is_alive(self):
+        return self.process.is_alive()
+
+    # sends a request of the worker's game and returns the number of responses it was asked for
+    # request_time is when the server received the request, see move_function
+    def request(self, game_id, request_type, snake_id, request_data, responses=1, request_time=None):
+        self.send_request(game_id, request_type, snake_id, request_data, request_time)
+        result = [self.get_response() for _ in range(responses)]
+        self.last_active = time.time()
+        return result
+
+    async def request_async(self, game_id, request_type, snake_id, request_data, responses=1, request_time=None):
+        self.send_request(game_id, request_type, snake_id, request_data, request_time)
+        result = [await self.get_response_async() for _ in range(responses)]
+        self.last_active = time.time()
+        return result
+
+    # the game can have ended while the request waited for the game's lock
+    def send_request(self, game_id, request_type, snake_id, request_data, request_time=None):
+        if self.game_id != game_id:
+            raise Exception("Unknown game: {}".format(game_id))
+        self.last_active = time.time()
+        self.input_queue.put((request_type, game_id, snake_id, request_data, request_time))
+
+    def get_response(self):
+        while not self.responses.poll(1):
+            if not self.is_alive():
+                raise Exception("The game worker of game {} died".format(self.game_id))
+        return self.receive()
+
+    # waits for the response on the running event loop instead of in a thread
+    async def get_response_async(self):
+        loop = asyncio.get_running_loop()
+        while not self.responses.poll():
+            readable = loop.create_future()
+            loop.add_reader(self.responses.fileno(), lambda: readable.done() or readable.set_result(None))
+            try:
+                await asyncio.wait_for(readable, 1)
+            except asyncio.TimeoutError:
+                if not self.is_alive():
+                    raise Exception("The game worker of game {} died".format(self.game_id))
+            finally:
+                loop.remove_reader(self.responses.fileno())
+        return self.receive()
+
+    def receive(self):
+        try:
+            return self.responses.recv()
+        except EOFError:
+            raise Exception("The game worker of game {} died".format(self.game_id))
+
+    # waits until the worker has warmed up, see warm_up
+    def wait_ready(self):
+        if self.get_response() != "ready":
+            raise Exception("The game worker did not start")
+
+    # tells the worker to drop its game, it does not answer
+    def abandon(self):
+        self.input_queue.put(("abandon", self.game_id, None, None, None))
+        self.last_active = time.time()
+
+    def stop(self, timeout=5):
+        if self.is_alive():
+            self.input_queue.put(None)
+            self.process.join(timeout)
+        if self.is_alive():
+            self.process.terminate()
+            self.process.join()
+        self.responses.close()
+        self.compute_pool.remove_game(self.worker_id)
+
+
+# The game workers of the server, a worker is assigned to a game on its first /start and returned on its last /end
+# spare_workers idle workers are kept ready, so a /start only hands the game to a worker that is already warmed up
+# other idle workers are stopped after idle_timeout seconds, a game without requests for game_timeout seconds is abandoned,
+# and a worker is replaced after max_games_per_worker games, so the number of processes and their memory stay flat
+class GameWorkerPool():
+    def __init__(self, compute_pool, replay_renderer, max_workers=32, spare_workers=4, idle_timeout=300, game_timeout=60, max_games_per_worker=100, reap_interval=5, answered_turn_cache_size=64):
+        self.compute_pool = compute_pool
+        self.replay_renderer = replay_renderer
+        self.max_workers = max_workers
+        self.spare_workers = spare_workers
+        self.idle_timeout = idle_timeout
+        self.game_timeout = game_timeout
+        self.max_games_per_worker = max_games_per_worker
+        self.reap_interval = reap_interval
+
+        self.condition = threading.Condition()
+        # the workers without a game, the most recently used one last
+        self.idle = []
+        # per game id, its worker and the lock that keeps its requests in order, and the lock of the asyncio server
+        self.games = {}
+        self.locks = {}
+        self.async_locks = {}
+        # per game id, the number of requests of the asyncio server that are using its worker,
+        # and the games the reaper is abandoning, which do not take new requests
+        self.active = {}
+        self.reaping = set()
+        # per (game id, team id, turn), the future of the responses of the team's snakes, while the worker calculates them,
+        # and of the last answered turns
+        self.turns = {}
+        self.answered_turns = OrderedDict()
+        self.answered_turn_cache_size = answered_turn_cache_size
+        # the workers that are being started, and the games that wait for one of them
+        self.starting = 0
+        self.assigning = set()
+        self.closed = False
+
+        self.reaper = threading.Thread(target=self.reap, daemon=True)
+        self.reaper.start()
+
+    def get_worker_count(self):
+        return len(self.idle) + len(self.games) + self.starting
+
+    # starts a worker and waits until it is warmed up, without holding the pool's lock
+    def start_worker(self):
+        worker = GameWorker(self.compute_pool, self.replay_renderer)
+        try:
+            worker.wait_ready()
+        except Exception:
+            worker.stop()
+            raise
+        return worker
+
+    # the worker of a game, a worker is assigned to the game when it has none
+    # a new worker is only started when there is no idle one, the other snakes of the game wait for it
+    def get_game(self, game_id, start_timeout=10):
+        with self.condition:
+            waited = time.time() + start_timeout
+            while game_id not in self.games:
+                if self.closed:
+                    raise Exception("The game workers are shut down")
+                if game_id not in self.assigning:
+                    worker = self.get_idle_worker()
+                    if worker is not None:
+                        self.assign(game_id, worker)
+                        break
+                    if self.get_worker_count() < self.max_workers:
+                        self.assigning.add(game_id)
+                        self.starting += 1
+                        break
+                if time.time() > waited:
+                    raise Exception("No game worker is free for game {}".format(game_id))
+                self.condition.wait(waited - time.time())
+            if game_id in self.games:
+                return self.games[game_id], self.locks[game_id]
+
+        worker = None
+        try:
+            worker = self.start_worker()
+        finally:
+            with self.condition:
+                self.starting -= 1
+                self.assigning.discard(game_id)
+                if worker is not None:
+                    self.assign(game_id, worker)
+                self.condition.notify_all()
+        return worker, self.locks[game_id]
+
+    def assign(self, game_id, worker):
+        print("[INFO] Game started, " + game_id[:3])
+        worker.game_id = game_id
+        self.games[game_id] = worker
+        self.locks[game_id] = threading.Lock()
+        self.async_locks[game_id] = asyncio.Lock()
+        # the reaper starts a new spare worker
+        self.condition.notify_all()
+
+    def get_idle_worker(self):
+        while len(self.idle) > 0:
+            worker = self.idle.pop()
+            if worker.is_alive():
+                return worker
+            worker.stop()
+        return None
+
+    # request_data is the decoded request, or only its game id and turn, see gamestate.read_header, which the pool routes by,
+    # and body the request's body, which is sent to the worker instead of request_data when it is given,
+    # so the body is only decoded once, by the worker, straight into its board
+    def start(self, game_id, snake_id, request_data, body=None):
+        worker, lock = self.get_game(game_id)
+        with lock:
+            return worker.request(game_id, "start", snake_id, request_data if body is None else body)[0]
+
+    # the first move request of a team's turn asks the worker, which answers for both snakes of the team,
+    # the other snake's request waits for the same answer, and repeated requests are answered from answered_turns
+    # request_time is when the server received the request, the time the request waits for the game's lock
+    # is taken from the turn's time budget, see TurnBudget.start_turn
+    def move(self, game_id, snake_id, request_data, body=None, request_time=None):
+        future, first = self.join_turn(game_id, snake_id, request_data)
+        if first:
+            try:
+                worker, lock = self.get_running_game(game_id)
+                with lock:
+                    responses = worker.request(game_id, "move", snake_id, request_data if body is None else body, request_time=request_time)[0]
+            except Exception as e:
+                self.finish_turn(game_id, snake_id, request_data, future, exception=e)
+                raise
+            self.finish_turn(game_id, snake_id, request_data, future, responses)
+
+        responses = future.result()
+        if snake_id not in responses:
+            return self.move_uncoalesced(game_id, snake_id, request_data, body, request_time)
+        return responses[snake_id]
+
+    # the turn's request of a snake the team did not answer for, like a snake that is dead on the team's board
+    def move_uncoalesced(self, game_id, snake_id, request_data, body=None, request_time=None):
+        worker, lock = self.get_running_game(game_id)
+        with lock:
+            return worker.request(game_id, "move", snake_id, request_data if body is None else body, request_time=request_time)[0][snake_id]
+
+    def get_turn_key(self, game_id, snake_id, request_data):
+        return game_id, get_team_id(snake_id), request_data.get("turn")
+
+    # returns the future of the responses of a team's turn, and whether the request is the first of the turn,
+    # which then asks the worker and finishes the future
+    def join_turn(self, game_id, snake_id, request_data):
+        key = self.get_turn_key(game_id, snake_id, request_data)
+        with self.condition:
+            future = self.answered_turns.get(key)
+            if future is not None:
+                self.answered_turns.move_to_end(key)
+                return future, False
+            future = self.turns.get(key)
+            if future is not None:
+                return future, False
+            future = Future()
+            self.turns[key] = future
+            return future, True
+
+    # failed turns are not kept, the requests that wait for them fail too, and a retry asks the worker again
+    def finish_turn(self, game_id, snake_id, request_data, future, responses=None, exception=None):
+        key = self.get_turn_key(game_id, snake_id, request_data)
+        with self.condition:
+            del self.turns[key]
+            if exception is None:
+                self.answered_turns[key] = future
+                if len(self.answered_turns) > self.answered_turn_cache_size:
+                    self.answered_turns.popitem(last=False)
+        if exception is None:
+            future.set_result(responses)
+        else:
+            future.set_exception(exception)
+
+    # the worker is returned after the last team of the game has ended
+    def end(self, game_id, snake_id, request_data, body=None):
+        worker, lock = self.get_running_game(game_id)
+        with lock:
+            all_teams_ended, response = worker.request(game_id, "end", snake_id, request_data if body is None else body, responses=2)
+            if all_teams_ended:
+                self.release(game_id)
+                print("[INFO] Game ended, deleting game", game_id[:3])
+        return response
+
+    # the requests of the asyncio server wait for the worker on the event loop,
+    # a game's requests are kept in order by an asyncio lock, and are counted while they use the worker,
+    # the reaper does not abandon a game with requests, so nothing on the event loop waits for the reaper
+    # only assigning a worker, which can wait for a worker to start, and returning it run in a thread
+    async def start_async(self, game_id, snake_id, request_data, body=None):
+        await asyncio.get_running_loop().run_in_executor(None, self.get_game, game_id)
+        worker, async_lock = self.enter_game(game_id)
+        try:
+            async with async_lock:
+                return (await worker.request_async(game_id, "start", snake_id, request_data if body is None else body))[0]
+        finally:
+            self.leave_game(game_id)
+
+    async def move_async(self, game_id, snake_id, request_data, body=None, request_time=None):
+        future, first = self.join_turn(game_id, snake_id, request_data)
+        if first:
+            try:
+                worker, async_lock = self.enter_game(game_id)
+                try:
+                    async with async_lock:
+                        responses = (await worker.request_async(game_id, "move", snake_id, request_data if body is None else body, request_time=request_time))[0]
+                finally:
+                    self.leave_game(game_id)
+            except Exception as e:
+                self.finish_turn(game_id, snake_id, request_data, future, exception=e)
+                raise
+            self.finish_turn(game_id, snake_id, request_data, future, responses)
+
+        responses = await asyncio.wrap_future(future)
+        if snake_id not in responses:
+            return await self.move_uncoalesced_async(game_id, snake_id, request_data, body, request_time)
+        return responses[snake_id]
+
+    async def move_uncoalesced_async(self, game_id, snake_id, request_data, body=None, request_time=None):
+        worker, async_lock = self.enter_game(game_id)
+        try:
+            async with async_lock:
+                return (await worker.request_async(game_id, "move", snake_id, request_data if body is None else body, request_time=request_time))[0][snake_id]
+        finally:
+            self.leave_game(game_id)
+
+    async def end_async(self, game_id, snake_id, request_data, body=None):
+        worker, async_lock = self.enter_game(game_id)
+        try:
+            async with async_lock:
+                all_teams_ended, response = await worker.request_async(game_id, "end", snake_id, request_data if body is None else body, responses=2)
+                if all_teams_ended:
+                    await asyncio.get_running_loop().run_in_executor(None, self.release, game_id)
+                    print("[INFO] Game ended, deleting game", game_id[:3])
+        finally:
+            self.leave_game(game_id)
+        return response
+
+    # the worker and the asyncio lock of a game, for a request of the asyncio server, which has to call leave_game after it
+    def enter_game(self, game_id):
+        with self.condition:
+            if game_id not in self.async_locks or game_id in self.reaping:
+                raise Exception("Unknown game: {}".format(game_id))
+            self.active[game_id] = self.active.get(game_id, 0) + 1
+            return self.games[game_id], self.async_locks[game_id]
+
+    def leave_game(self, game_id):
+        with self.condition:
+            self.active[game_id] -= 1
+            if self.active[game_id] == 0:
+                del self.active[game_id]
+
+    def get_running_game(self, game_id):
+        with self.condition:
+            if game_id not in self.games:
+                raise Exception("Unknown game: {}".format(game_id))
+            return self.games[game_id], self.locks[game_id]
+
+    def release(self, game_id):
+        with self.condition:
+            worker = self.games.pop(game_id)
+            del self.locks[game_id]
+            del self.async_locks[game_id]
+            worker.game_id = None
+            worker.games_played += 1
+            retire = not worker.is_alive() or worker.games_played >= self.max_games_per_worker
+            if not retire:
+                self.idle.append(worker)
+            self.condition.notify_all()
+        if retire:
+            worker.stop()
+
+    # starts spare workers, stops idle workers and abandons the games that stopped sending requests
+    def reap(self):
+        while True:
+            with self.condition:
+                if self.closed:
+                    break
+                now = time.time()
+                stopped = [worker for worker in self.idle if not worker.is_alive()]
+                # the workers that were idle the longest are stopped first, until only the spare workers are left
+                for worker in sorted(self.idle, key=lambda worker: worker.last_active):
+                    if len(self.idle) - len(stopped) <= self.spare_workers:
+                        break
+                    if worker not in stopped and now - worker.last_active > self.idle_timeout:
+                        stopped.append(worker)
+                self.idle = [worker for worker in self.idle if worker not in stopped]
+                timed_out = [game_id for game_id, worker in self.games.items() if now - worker.last_active > self.game_timeout or not worker.is_alive()]
+                locks = [self.locks[game_id] for game_id in timed_out]
+                spares = max(0, min(self.spare_workers - len(self.idle) - self.starting, self.max_workers - self.get_worker_count()))
+                self.starting += spares
+
+            for worker in stopped:
+                worker.stop()
+
+            # a game that is answering a request right now is not timed out,
+            # a request of the asyncio server that comes in while the game is abandoned fails instead of waiting
+            for game_id, lock in zip(timed_out, locks):
+                with self.condition:
+                    if game_id not in self.games or self.active.get(game_id, 0) > 0 or not lock.acquire(blocking=False):
+                        continue
+                    self.reaping.add(game_id)
+                try:
+                    print("[INFO] Game timed out, deleting game", game_id[:3])
+                    self.games[game_id].abandon()
+                    self.release(game_id)
+                finally:
+                    with self.condition:
+                        self.reaping.discard(game_id)
+                    lock.release()
+
+            failed = False
+            for _ in range(spares):
+                worker = None
+                try:
+                    worker = self.start_worker()
+                except Exception as e:
+                    print("[WARNING] Could not start a spare game worker: {}".format(e))
+                    failed = True
+                with self.condition:
+                    self.starting -= 1
+                    if worker is not None and not self.closed:
+                        self.idle.insert(0, worker)
+                        worker = None
+                    self.condition.notify_all()
+                if worker is not None:
+                    worker.stop()
+
+            # a spare worker that was taken while the others started is replaced right away
+            with self.condition:
+                if not self.closed and (failed or len(self.idle) + self.starting >= self.spare_workers or self.get_worker_count() >= self.max_workers):
+                    self.condition.wait(self.reap_interval)
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            workers = self.idle + list(self.games.values())
+            self.idle = []
+            self.games = {}
+            self.locks = {}
+            self.async_locks = {}
+            self.condition.notify_all()
+        self.reaper.join()
+        for worker in workers:
+            worker.stop()
 
 class SingletonMeta(type):
     _instances = {}
@@ -76,99 +603,116 @@ class NetworkManager(metaclass=SingletonMeta):
         self.snakes = []
         self.games = {}
         self.snake_ids = [1, 2, 3, 4]
-        self.live_games = set()
-        self.input_queues = {}
-        self.output_queues = {}
-        self.locks = {}
-        self.processing_pool = Pool(processes=16)
-        self.game_start_lock = Lock()
+        # the worker processes that all games share, instead of a pool per team
+        self.compute_pool = ComputePool()
+        atexit.register(self.compute_pool.close)
+        # the process that renders the replays of the games, it saves the replays it was sent before the server exits
+        self.replay_renderer = ReplayRenderer()
+        atexit.register(self.replay_renderer.close)
+        # the processes that play the games
+        self.game_workers = GameWorkerPool(self.compute_pool, self.replay_renderer)
+        atexit.register(self.game_workers.close)
+        # per route, the latencies of its requests, see /stats
+        self.latencies = {}
+        self.latencies_lock = threading.Lock()
+
+    def get_info(self, snake_id):
+        if snake_id == "favicon.ico":
+            return ""
+        
+        team_id = get_team_id(snake_id)
+        color = our_color if team_id == 1 else "#00FF00"
+        return {
+            "apiversion": "1",
+            "author": "Anton Forsman & Nils Odin",
+            "color": color,
+            "head": "tiger-king",
+            "tail": "tiger-tail",
+        }
+
+    # latency is in ms
+    def record_latency(self, route, latency):
+        with self.latencies_lock:
+            histogram = self.latencies.setdefault(route, LatencyHistogram())
+        histogram.record(latency)
+
+    def get_latency_stats(self):
+        with self.latencies_lock:
+            histograms = dict(self.latencies)
+        return {route: histogram.get_stats() for route, histogram in histograms.items()}
     
     def create_endpoints(self):
 
         @self.app.get("/<snake_id>/")
         def on_info(snake_id):
-            if snake_id == "favicon.ico":
-                return ""
-            
-            team_id = 1 if snake_id == "1" or snake_id == "2" else 2 
-            color = our_color if team_id == 1 else "#00FF00"
-            return {
-                "apiversion": "1",
-                "author": "Anton Forsman & Nils Odin",
-                "color": color,
-                "head": "tiger-king",
-                "tail": "tiger-tail",
-            }
+            return self.get_info(snake_id)
         
         @self.app.post("/<snake_id>/start/")
         def on_start(snake_id):
-            with self.game_start_lock:
-                request_json = request.get_json()
-                game_id = request_json["game"]["id"]
-
-                if game_id not in self.live_games:
-                    print("[INFO] Game started, " + game_id[:3])
-                    self.live_games.add(game_id)
-                    self.locks[game_id] = Lock()
-                    self.input_queues[game_id] = Queue()
-                    self.output_queues[game_id] = Queue()
-                    Process(target=game_process, args=(game_id, self.input_queues[game_id], self.output_queues[game_id])).start()
-            
-                with self.locks[game_id]:
-                    self.input_queues[game_id].put(("start", snake_id, request_json))
-                    response = self.output_queues[game_id].get()
-            
-                return response
+            body = request.get_data()
+            request_header = gamestate.read_header(body)
+            game_id = request_header["game"]["id"]
+            return self.game_workers.start(game_id, snake_id, request_header, body)
 
         
         @self.app.post("/<snake_id>/move/")
         def on_move(snake_id):
-            request_json = request.get_json()
-            game_id = request_json["game"]["id"]
-
-            with self.locks[game_id]:
-                self.input_queues[game_id].put(("move", snake_id, request_json))
-                response = self.output_queues[game_id].get()
-
-            return response
+            body = request.get_data()
+            request_header = gamestate.read_header(body)
+            game_id = request_header["game"]["id"]
+            return self.game_workers.move(game_id, snake_id, request_header, body, g.request_start)
 
         
         @self.app.post("/<snake_id>/end/")
         def on_end(snake_id):
-            request_json = request.get_json()
-            game_id = request_json["game"]["id"]
+            body = request.get_data()
+            request_header = gamestate.read_header(body)
+            game_id = request_header["game"]["id"]
+            return self.game_workers.end(game_id, snake_id, request_header, body)
 
-            with self.locks[game_id]:
-                self.input_queues[game_id].put(("end", snake_id, request_json))
-                all_teams_ended = self.output_queues[game_id].get()
-                response = self.output_queues[game_id].get()
+        @self.app.get("/stats")
+        def stats():
+            return self.get_latency_stats()
 
-            if all_teams_ended:
-                del self.locks[game_id]
-                del self.input_queues[game_id]
-                del self.output_queues[game_id]
-                self.live_games.remove(game_id)
-                print("[INFO] Game ended, deleting game", game_id[:3])
-
-
-            return response
+        @self.app.before_request
+        def start_timer():
+            g.request_start = time.time()
 
         @self.app.after_request
         def identify_server(response):
             response.headers.set(
                 "server", "Battlesnake"
             )
+            if request.endpoint in ["on_info", "on_start", "on_move", "on_end", "ping"]:
+                self.record_latency(request.endpoint, (time.time() - g.request_start) * 1000)
             return response
     
     def delete_game(self, game_id):
         del self.games[game_id]
 
-    def start_server(self):
+    # mode is "asgi", which serves the routes with uvicorn on an event loop, or "flask",
+    # the default comes from the SERVER_MODE environment variable, and Flask is used when uvicorn is not installed
+    def start_server(self, mode=None):
         #host = "0.0.0.0"
         #host = "10.10.20.13"
         host = "10.10.10.101"
         port = int(os.environ.get("PORT", "8000"))
 
+        if mode is None:
+            mode = os.environ.get("SERVER_MODE", "asgi")
+        if mode == "asgi":
+            try:
+                import uvicorn
+            except ImportError:
+                print("[WARNING] uvicorn is not installed, serving with Flask")
+                mode = "flask"
+        if mode == "asgi":
+            # games send a request every turn, so connections are kept alive for longer than uvicorn's default
+            uvicorn.run(BattlesnakeApp(self), host=host, port=port, log_level="warning", timeout_keep_alive=65)
+            return
+        if mode != "flask":
+            raise Exception("Unknown server mode: {}".format(mode))
+
         logging.getLogger("werkzeug").setLevel(logging.ERROR)
 
         self.create_endpoints()
@@ -176,4 +720,5 @@ class NetworkManager(metaclass=SingletonMeta):
         def ping():
             return "pong"
 
-        self.app.run(host=host, port=port, debug=True, threaded=True)
+        # the reloader would run the server in a second process, with a second compute pool
+        self.app.run(host=host, port=port, debug=True, threaded=True, use_reloader=False)
@@ -0,0 +1,215 @@
+import threading
+import numpy as np
+from PIL import Image, ImageColor, ImageDraw
+
+# Draws boards as NumPy arrays of pixels, for GeneralBoard.convert_to_image
+# a board is drawn as layers, in order, over a grid of white cells with black outlines, each layer is a list of squares
+# and the colors they are drawn in, see GeneralBoard.get_image_layers, every square of a layer gets the same sprite,
+# the pixels PIL draws in a cell for the layer's shape, so the frames are the same as drawing every cell with ImageDraw
+# a cell with its outline and the sprites of its layers is drawn once as a tile, and the frames are put together
+# from the tiles, see Tiles
+# the frames are arrays of 32 bit RGBX pixels indexed [pixel y, pixel x], the layout of the pixels of a PIL image
+LAYERS = ["color", "territory", "food", "hazard", "body", "head", "future"]
+
+# the shapes of the layers, from where to where in a cell they reach in both directions, as fractions of the cell
+# the colors and territories fill the cell inside its outline
+SHAPES = {
+    "food": ("ellipse", 0.2, 0.8),
+    "hazard": ("ellipse", 0.2, 0.8),
+    "body": ("rectangle", 0.2, 0.8),
+    "head": ("rectangle", 0.1, 0.9),
+    "future": ("ellipse", 0.4, 0.6),
+}
+# the color of the layers whose squares do not have their own colors
+LAYER_COLORS = {"food": "green", "hazard": "red", "future": "black"}
+
+# the brightness of a territory, between the color of its snake (0) and white (1)
+TERRITORY_SHADE = 0.7
+
+# the number of tiles kept per cell size, the games of a server bring new colors, so the tiles are drawn again
+# when there are more, which is about 10 MB for the largest cells
+MAX_TILES = 1024
+
+# per cell size, the sprites of the layers
+sprites = {}
+# per thread, the frames that images are drawn in, see draw_image, and per cell size the tiles, see get_tiles
+scratch = threading.local()
+# per color, its pixel, and the pixel of its territory
+pixels = {}
+territory_pixels = {}
+
+
+def get_rgb(color):
+    return ImageColor.getrgb(color)[:3] if isinstance(color, str) else tuple(color[:3])
+
+def to_pixel(rgb):
+    return int(np.frombuffer(bytes((rgb[0], rgb[1], rgb[2], 255)), dtype=np.uint32)[0])
+
+def get_pixel(color):
+    pixel = pixels.get(color)
+    if pixel is None:
+        pixel = pixels[color] = to_pixel(get_rgb(color))
+    return pixel
+
+# the color of a snake, but lighter
+def get_territory_pixel(color):
+    pixel = territory_pixels.get(color)
+    if pixel is None:
+        rgb = get_rgb(color)
+        pixel = territory_pixels[color] = to_pixel([int((255 - rgb[i]) * TERRITORY_SHADE + rgb[i]) for i in range(3)])
+    return pixel
+
+
+# draws a shape in the top left cell of a canvas the size of 2x2 cells, with the coordinates it has in the cells
+# of a board, PIL draws the same pixels in every cell, which the frames of all cell sizes up to 60 were checked for
+# a sprite is the box the shape fills, or the offsets of its pixels in the cell if it is not a box
+def draw_sprite(cell_size, shape):
+    draw_function, start, end = shape
+    canvas = Image.new("1", (2 * cell_size, 2 * cell_size), color=0)
+    getattr(ImageDraw.Draw(canvas), draw_function)((start*cell_size, start*cell_size, end*cell_size, end*cell_size), fill=1, outline=1)
+    mask = np.array(canvas, dtype=bool)
+    if mask[cell_size:, :].any() or mask[:, cell_size:].any():
+        raise Exception("Cells of {} pixels are too small to draw".format(cell_size))
+
+    ys, xs = np.nonzero(mask)
+    if len(ys) > 0 and len(ys) == (ys.max() + 1 - ys.min()) * (xs.max() + 1 - xs.min()):
+        return "box", (slice(ys.min(), ys.max() + 1), slice(xs.min(), xs.max() + 1))
+    return "mask", (ys, xs)
+
+def get_sprites(cell_size):
+    cell_sprites = sprites.get(cell_size)
+    if cell_sprites is None:
+        cell_sprites = {name: draw_sprite(cell_size, shape) for name, shape in SHAPES.items()}
+        fill = slice(1, cell_size)
+        cell_sprites["color"] = cell_sprites["territory"] = ("box", (fill, fill))
+        sprites[cell_size] = cell_sprites
+    return cell_sprites
+
+
+# The cells of one size that were drawn, as tiles of pixels that the frames are taken from
+# a tile is a white cell with its outline, the top row and left column, and the sprites of the layers of a square
+# in their order, it is looked up by the names and pixels of those layers
+# the rows of the tiles are the rows of one array, so a frame is one np.take of the rows of its cells, see rasterize
+class Tiles():
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        self.sprites = get_sprites(cell_size)
+        self.clear()
+
+    # forgets the tiles, except the empty cell, which is tile 0
+    def clear(self):
+        self.ids = {}
+        self.rows = np.empty((16 * self.cell_size, self.cell_size), dtype=np.uint32)
+        self.count = 0
+        self.get_id(())
+
+    # the id of the tile of a square, pieces are the names and pixels of the layers of the square, in order
+    def get_id(self, pieces):
+        tile_id = self.ids.get(pieces)
+        if tile_id is None:
+            tile_id = self.ids[pieces] = self.add(self.draw(pieces))
+        return tile_id
+
+    def draw(self, pieces):
+        tile = np.full((self.cell_size, self.cell_size), get_pixel("white"), dtype=np.uint32)
+        tile[0, :] = get_pixel("black")
+        tile[:, 0] = get_pixel("black")
+        # a box is sliced and a mask is indexed by its offsets, which are both the rows and columns of the sprite
+        for name, pixel in pieces:
+            rows, columns = self.sprites[name][1]
+            tile[rows, columns] = pixel
+        return tile
+
+    def add(self, tile):
+        if (self.count + 1) * self.cell_size > len(self.rows):
+            rows = np.empty((2 * len(self.rows), self.cell_size), dtype=np.uint32)
+            rows[:len(self.rows)] = self.rows
+            self.rows = rows
+        self.rows[self.count * self.cell_size:(self.count + 1) * self.cell_size] = tile
+        self.count += 1
+        return self.count - 1
+
+def get_tiles(cell_size):
+    tiles = getattr(scratch, "tiles", None)
+    if tiles is None:
+        tiles = scratch.tiles = {}
+    if cell_size not in tiles:
+        tiles[cell_size] = Tiles(cell_size)
+    return tiles[cell_size]
+
+# the coordinates of the cells, as the xs and the ys of a layer
+def get_squares(cells):
+    return [cell.x for cell in cells], [cell.y for cell in cells]
+
+# returns the board as a frame, layers has the xs, ys and colors of the squares of each layer, as lists or arrays,
+# the colors of a layer in LAYER_COLORS can be None, the board is drawn in frame if it is given
+def rasterize(width, height, layers, cell_size=25, frame=None):
+    # per square that is in a layer, a number that says which pixel each layer draws in it, with a digit per layer
+    # that is 0 if the square is not in the layer, the squares with the same number get the same tile
+    keys = {}
+    radix = 1
+    # per layer that has squares, its name, the radix of its digit and the pixels of its digits
+    digits = []
+    for name in LAYERS:
+        if name not in layers:
+            continue
+        xs, ys, colors = layers[name]
+        if len(xs) == 0:
+            continue
+        if colors is None:
+            layer_pixels = [get_pixel(LAYER_COLORS[name])]
+            codes = [radix] * len(xs)
+        else:
+            # the colors are numbered in the order they first appear in the layer
+            numbers = {color: number * radix for number, color in enumerate(dict.fromkeys(colors), 1)}
+            codes = list(map(numbers.__getitem__, colors))
+            pixel_function = get_territory_pixel if name == "territory" else get_pixel
+            layer_pixels = [pixel_function(color) for color in numbers]
+        # a square that is in a layer twice is drawn in the last of its colors, like drawing the squares in order does
+        layer_keys = dict(zip(map(int, ys * width + xs if isinstance(xs, np.ndarray) else [y * width + x for x, y in zip(xs, ys)]), codes))
+        for index, code in layer_keys.items():
+            keys[index] = keys.get(index, 0) + code
+        digits.append((name, radix, layer_pixels))
+        radix *= len(layer_pixels) + 1
+
+    tiles = get_tiles(cell_size)
+    # the tiles of a frame are drawn before it is put together, so they are all kept until then
+    key_tiles = dict.fromkeys(keys.values())
+    if tiles.count + len(key_tiles) > MAX_TILES:
+        tiles.clear()
+    for key in key_tiles:
+        pieces = []
+        for name, digit_radix, layer_pixels in digits:
+            code = key // digit_radix % (len(layer_pixels) + 1)
+            if code > 0:
+                pieces.append((name, layer_pixels[code - 1]))
+        key_tiles[key] = tiles.get_id(tuple(pieces))
+    tile_ids = np.zeros(height * width, dtype=np.intp)
+    if len(keys) > 0:
+        tile_ids[list(keys)] = list(map(key_tiles.__getitem__, keys.values()))
+
+    if frame is None:
+        frame = np.empty((height * cell_size, width * cell_size), dtype=np.uint32)
+    # the row of the tiles for every [y, pixel y, x] of the frame, which np.take puts in the frame indexed [y, pixel y, x, pixel x]
+    rows = tile_ids.reshape(height, 1, width) * cell_size + np.arange(cell_size).reshape(1, cell_size, 1)
+    np.take(tiles.rows, rows, axis=0, out=frame.reshape(height, cell_size, width, cell_size), mode="clip")
+    return frame
+
+# the frame as an array of RGB values indexed [pixel y, pixel x], which is a view of the frame
+def to_rgb(frame):
+    return frame.view(np.uint8).reshape(frame.shape[0], frame.shape[1], 4)[:, :, :3]
+
+# the frame as an RGB image, which keeps its pixels in the same layout, so they are copied without unpacking them
+def to_image(frame):
+    return Image.frombytes("RGB", (frame.shape[1], frame.shape[0]), frame, "raw", "RGBX")
+
+# returns the board as an RGB image, the frame it is drawn in is kept for the next image of the same size,
+# as the memory of a new frame costs more than drawing the board in it
+def draw_image(width, height, layers, cell_size=25):
+    frames = getattr(scratch, "frames", None)
+    if frames is None:
+        frames = scratch.frames = {}
+    frame = frames.get((width, height, cell_size))
+    if frame is None:
+        frame = frames[(width, height, cell_size)] = np.empty((height * cell_size, width * cell_size), dtype=np.uint32)
+    return to_image(rasterize(width, height, layers, cell_size, frame))
@@ -0,0 +1,121 @@
+import atexit
+import os
+import queue
+import threading
+from functools import partial
+from multiprocessing import Pool, Process, SimpleQueue
+from PIL import Image
+import history
+import replayfile
+
+# the cell size in pixels of the replay resolutions, see Board.save_to_img
+CELL_SIZES = {"high": 50, "medium": 25, "low": 10}
+
+
+# The process that renders the replays of the server's games, so a game's /end request only encodes its boards
+# and sends them, instead of drawing every turn of the game before it answers
+# the frames of a replay are rendered by a few worker processes and kept in memory until the GIF is saved,
+# the process and its workers run at the lowest priority, so they only get the time the games do not use
+# games send their replays through a ReplayClient, which also works from the game's own process
+class ReplayRenderer():
+    def __init__(self, processes=None, niceness=19):
+        self.processes = processes or max(1, (os.cpu_count() or 1) // 4)
+        self.jobs = SimpleQueue()
+        # the process starts worker processes of its own, so it can not be a daemon, see close
+        self.process = Process(target=render_replays, args=(self.jobs, self.processes, niceness))
+        self.process.start()
+        self.closed = False
+
+    # has to be called in the process that created the renderer, before the game's process is started
+    def connect(self):
+        return ReplayClient(self.jobs)
+
+    # waits for the replays that were sent before to be saved
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.jobs.put(None)
+        self.process.join()
+
+
+class ReplayClient():
+    def __init__(self, jobs):
+        self.jobs = jobs
+
+    # saves encoded boards as a GIF in the directory, see history.BoardHistory.get_frames
+    # the encoding does not keep the colors and teams of the snakes, they are given per snake id
+    def submit(self, path, frames, colors, enemies=None, res="high"):
+        if len(frames) == 0:
+            return
+        # the renderer's working directory can be another than the game's
+        self.jobs.put((os.path.abspath(path), frames, colors, enemies or {}, CELL_SIZES.get(res, CELL_SIZES["low"]), None))
+
+    # saves the turns of a history like submit, and the replay file of the game with the move logs of the team,
+    # see replayfile.write_replay, the renderer rebuilds the frames, so the game only sends the history's records
+    def submit_history(self, path, board_history, move_logs=None, game_id=None, res="high"):
+        if len(board_history) == 0:
+            return
+        self.jobs.put((os.path.abspath(path), board_history, board_history.colors, board_history.enemies,
+            CELL_SIZES.get(res, CELL_SIZES["low"]), (move_logs or [], game_id)))
+
+
+# draws an encoded board the way Board.save_to_img does, as the palette image the GIF stores,
+# which is a third of the size of the drawn image
+def render_frame(data, colors, enemies, cell_size):
+    board = history.decode_board(data, colors, enemies)
+    return board.convert_to_image(cell_size=cell_size).convert("P", palette=Image.Palette.ADAPTIVE)
+
+def save_gif(path, frames):
+    os.makedirs(path, exist_ok=True)
+    # enable infinte loop
+    frames[0].save(os.path.join(path, "_board.gif"), save_all=True, append_images=frames[1:], loop=0)
+
+# the loop of the renderer's process, one replay at a time
+def render_replays(jobs, processes, niceness):
+    os.nice(niceness)
+    # the jobs are taken from the pipe while a replay renders, so sending one never waits for the renderer
+    pending = queue.SimpleQueue()
+
+    def receive():
+        while True:
+            job = jobs.get()
+            pending.put(job)
+            if job is None:
+                break
+
+    receiver = threading.Thread(target=receive, daemon=True)
+    receiver.start()
+
+    # the workers inherit the priority of the process
+    with Pool(processes=processes) as pool:
+        while True:
+            job = pending.get()
+            if job is None:
+                break
+            path, frames, colors, enemies, cell_size, replay_file = job
+            try:
+                turns = None
+                if isinstance(frames, history.BoardHistory):
+                    turns, frames = frames.get_turns(), frames.get_frames()
+                save_gif(path, pool.map(partial(render_frame, colors=colors, enemies=enemies, cell_size=cell_size), frames, chunksize=8))
+            except Exception as e:
+                print("[WARNING] Could not save the replay {}: {}".format(path, e))
+            if replay_file is None or turns is None:
+                continue
+            move_logs, game_id = replay_file
+            try:
+                replayfile.write_replay(os.path.join(path, "{}.bsr".format(game_id)), turns, frames, colors, enemies, move_logs, game_id)
+            except Exception as e:
+                print("[WARNING] Could not save the replay file of {}: {}".format(path, e))
+
+
+# the renderer of a process that is not a server, like a notebook, which all its teams share
+local_renderer = None
+
+def get_local_client():
+    global local_renderer
+    if local_renderer is None:
+        local_renderer = ReplayRenderer()
+        atexit.register(local_renderer.close)
+    return local_renderer.connect()
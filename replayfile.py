@@ -0,0 +1,288 @@
+import glob
+import json
+import mmap
+import os
+import re
+import struct
+import sys
+from datetime import datetime
+from board import GeneralBoard
+import encoding
+import history
+import journal
+
+# A game in one binary file, for analysing many games without parsing their game states
+# all numbers are little endian, the sections are in this order
+#
+#   header     magic "BSRP", version, first turn, number of turns, frame size, offsets and lengths of the sections
+#   index      per turn from the first to the last, the offset of its frame in the file and its length, 0 if it is missing
+#   frames     the encoded boards of the turns, see encoding.encode_state, each in a slot of the frame size,
+#              a turn's board is its state as the server sent it, before any snake moved, the move logs have the moves
+#   meta       JSON, the game's id and the colors and teams of the snakes per snake id
+#   move logs  JSON, the move logs of the team, see SnakeDuo.set_snake_move
+#
+# as every turn has an entry in the index, a reader finds a turn's frame without reading the other turns,
+# the file is mapped into memory, so only the pages of the turns that are read are loaded
+# the version has to be increased whenever the layout changes, old files are then refused
+REPLAY_MAGIC = b"BSRP"
+REPLAY_VERSION = 1
+
+HEADER = struct.Struct("<4sHHiIIQQQQQQ")
+INDEX_ENTRY = struct.Struct("<QI")
+
+
+# writes the encoded boards of a game's turns, the turns have to be in order, the file is replaced at once,
+# so a reader never sees half of it
+def write_replay(path, turns, frames, colors=None, enemies=None, move_logs=None, game_id=None):
+    turns = list(turns)
+    if len(turns) != len(frames):
+        raise Exception("Got {} turns for {} frames".format(len(turns), len(frames)))
+    if any(turns[i] >= turns[i + 1] for i in range(len(turns) - 1)):
+        raise Exception("The turns of a replay have to be in order")
+
+    first_turn = turns[0] if len(turns) > 0 else 0
+    turn_count = turns[-1] + 1 - first_turn if len(turns) > 0 else 0
+    frame_size = max((len(frame) for frame in frames), default=0)
+    meta = json.dumps({"game_id": game_id, "colors": colors or {}, "enemies": enemies or {}}).encode("utf-8")
+    move_log = json.dumps(move_logs or []).encode("utf-8")
+
+    index_offset = HEADER.size
+    frames_offset = index_offset + turn_count * INDEX_ENTRY.size
+    meta_offset = frames_offset + len(frames) * frame_size
+    move_log_offset = meta_offset + len(meta)
+
+    index = bytearray(turn_count * INDEX_ENTRY.size)
+    for slot, (turn, frame) in enumerate(zip(turns, frames)):
+        INDEX_ENTRY.pack_into(index, (turn - first_turn) * INDEX_ENTRY.size, frames_offset + slot * frame_size, len(frame))
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path + ".tmp", "wb") as file:
+        file.write(HEADER.pack(
+            REPLAY_MAGIC,
+            REPLAY_VERSION,
+            0,
+            first_turn,
+            turn_count,
+            frame_size,
+            index_offset,
+            frames_offset,
+            meta_offset,
+            len(meta),
+            move_log_offset,
+            len(move_log)
+        ))
+        file.write(index)
+        for frame in frames:
+            file.write(frame)
+            file.write(bytes(frame_size - len(frame)))
+        file.write(meta)
+        file.write(move_log)
+    os.replace(path + ".tmp", path)
+
+
+# A replay file mapped into memory, the turns are read on demand
+class ReplayFile():
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        try:
+            self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            self.file.close()
+            raise
+        (magic, version, _, self.first_turn, self.turn_count, self.frame_size, self.index_offset,
+            self.frames_offset, self.meta_offset, self.meta_length, self.move_log_offset, self.move_log_length) = HEADER.unpack_from(self.data, 0)
+        if magic != REPLAY_MAGIC:
+            self.close()
+            raise Exception("Not a replay file: {}".format(path))
+        if version != REPLAY_VERSION:
+            self.close()
+            raise Exception("Unsupported replay file version: {}".format(version))
+
+        meta = json.loads(self.data[self.meta_offset:self.meta_offset + self.meta_length])
+        self.game_id = meta["game_id"]
+        self.colors = meta["colors"]
+        self.enemies = meta["enemies"]
+        # the move logs in the order they were written and per turn, parsed by the first get_move_logs
+        self.move_logs = None
+        self.turn_move_logs = None
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    # the offset and length of a turn's frame, the length is 0 if the turn is missing
+    def get_entry(self, turn):
+        if turn < self.first_turn or turn >= self.first_turn + self.turn_count:
+            return 0, 0
+        return INDEX_ENTRY.unpack_from(self.data, self.index_offset + (turn - self.first_turn) * INDEX_ENTRY.size)
+
+    def has_turn(self, turn):
+        return self.get_entry(turn)[1] > 0
+
+    # the turns that have a frame, a team that missed a turn has no frame for it
+    def get_turns(self):
+        return [turn for turn in range(self.first_turn, self.first_turn + self.turn_count) if self.has_turn(turn)]
+
+    # the encoded board of a turn
+    def get_frame(self, turn):
+        offset, length = self.get_entry(turn)
+        if length == 0:
+            raise Exception("Turn {} is not in the replay {}".format(turn, self.path))
+        return self.data[offset:offset + length]
+
+    # the snakes, food and hazards of a turn as plain values, see encoding.decode_state
+    def get_state(self, turn):
+        return encoding.decode_state(self.get_frame(turn))
+
+    # the board of a turn, with the colors and teams of the snakes, see history.decode_board
+    def get_board(self, turn, territory=False):
+        return history.decode_board(self.get_frame(turn), self.colors, self.enemies, territory)
+
+    # the move logs of the game, or of one of its turns, the section is only parsed once
+    def get_move_logs(self, turn=None):
+        if self.move_logs is None:
+            self.move_logs = json.loads(self.data[self.move_log_offset:self.move_log_offset + self.move_log_length])
+            self.turn_move_logs = {}
+            for move_log in self.move_logs:
+                self.turn_move_logs.setdefault(move_log["turn"], []).append(move_log)
+        if turn is None:
+            return list(self.move_logs)
+        return list(self.turn_move_logs.get(turn, []))
+
+
+# the replay files in a directory
+def find_replays(directory="./replays"):
+    return sorted(glob.glob(os.path.join(glob.escape(directory), "**", "*.bsr"), recursive=True))
+
+
+# the encoded boards of a game's states, as Board.update_state would leave them on a GeneralBoard without the doomed
+# snakes, which are built from the states directly, as the territories that update_state calculates are not stored
+# the snakes are in the order of the first state, a snake that is gone from a state is dead
+def encode_game_states(states):
+    turns, frames = [], []
+    snake_ids = []
+    for game_state in states:
+        board_state = game_state["board"]
+        for snake_state in board_state["snakes"]:
+            if snake_state["id"] not in snake_ids:
+                snake_ids.append(snake_state["id"])
+
+        # the snakes are placed in the order of the state, a square belongs to the last snake placed on it
+        owners = {}
+        bodies = {}
+        for snake_state in board_state["snakes"]:
+            squares = bodies[snake_state["id"]] = [(part["x"], part["y"]) for part in snake_state["body"]]
+            for square in squares:
+                owners[square] = snake_state["id"]
+
+        snakes = []
+        snake_states = {snake_state["id"]: snake_state for snake_state in board_state["snakes"]}
+        for snake_id in snake_ids:
+            snake_state = snake_states.get(snake_id)
+            if snake_state is None:
+                snakes.append([snake_id, True, 0, 0, [], []])
+                continue
+            squares = bodies[snake_id]
+            uncovered_indices = [i for i, square in enumerate(squares) if owners[square] != snake_id]
+            snakes.append([snake_id, False, snake_state["health"], snake_state["length"], squares, uncovered_indices])
+
+        turns.append(game_state["turn"])
+        frames.append(encoding.encode_state({
+            "board_class": encoding.BOARD_CLASSES.index(GeneralBoard),
+            "territory_mode": encoding.TERRITORY_MODES.index("manhattan"),
+            "width": board_state["width"],
+            "height": board_state["height"],
+            "snakes": snakes,
+            "food": sorted(set((food["x"], food["y"]) for food in board_state["food"])),
+            "hazards": sorted(set((hazard["x"], hazard["y"]) for hazard in board_state["hazards"])),
+        }))
+    return turns, frames
+
+# the name of a game's directory, "<date> (<first 3 characters of the game id>)", as its date and id
+def parse_directory_name(name, date_format):
+    match = re.fullmatch(r"(.*) \((.*)\)", name)
+    if match is None:
+        return None, None
+    try:
+        return datetime.strptime(match.group(1), date_format), match.group(2)
+    except ValueError:
+        return None, None
+
+# the directories of the move logs, by the first 3 characters of the game id, in the order the games ended
+def find_move_logs(directory="./move_logs"):
+    move_logs = {}
+    for path in sorted(glob.glob(os.path.join(glob.escape(directory), "*", "move_logs.json"))):
+        date, short_id = parse_directory_name(os.path.basename(os.path.dirname(path)), "%Y-%m-%d_%H-%M-%S")
+        if date is not None:
+            move_logs.setdefault(short_id, []).append((date, path))
+    for paths in move_logs.values():
+        paths.sort()
+    return move_logs
+
+# converts the games of journal.find_games to replay files in the output directory, with the move logs of the team,
+# a game's move logs are the first ones with its id that were written after the hour its states started in
+# returns the paths of the new files, the games that already have a file are skipped
+def convert_games(game_states_directory="./game_states", move_logs_directory="./move_logs", output_directory="./replays", overwrite=False):
+    move_logs = find_move_logs(move_logs_directory)
+    converted = []
+    for path in journal.find_games(game_states_directory):
+        game_directory = path if os.path.isdir(path) else os.path.dirname(path)
+        states = list(journal.read_game(path))
+        if len(states) == 0:
+            continue
+        game_id = states[0]["game"]["id"]
+        output_path = os.path.join(output_directory, os.path.basename(game_directory), game_id + ".bsr")
+        if os.path.exists(output_path) and not overwrite:
+            continue
+
+        game_move_logs = []
+        start, short_id = parse_directory_name(os.path.basename(game_directory), "%Y-%m-%d_%H")
+        for date, move_log_path in move_logs.get(game_id[:3], []):
+            if start is None or date >= start:
+                move_logs[game_id[:3]].remove((date, move_log_path))
+                with open(move_log_path, "r") as file:
+                    game_move_logs = json.load(file)
+                break
+
+        # the team's snakes are the ones the states were sent to, which is either of them on a turn,
+        # and the snakes of their squad, the move logs cannot tell, they name the snakes "Snake 1" and "Snake 2"
+        our_snakes = set(game_state["you"]["id"] for game_state in states if "id" in game_state.get("you", {}))
+        our_squads = set(game_state["you"].get("squad") for game_state in states if "id" in game_state.get("you", {}))
+        our_squads.discard(None)
+        our_squads.discard("")
+        colors, enemies = {}, {}
+        for game_state in states:
+            for snake_state in game_state["board"]["snakes"]:
+                colors[snake_state["id"]] = snake_state.get("customizations", {}).get("color")
+                enemies[snake_state["id"]] = snake_state["id"] not in our_snakes and snake_state.get("squad") not in our_squads
+
+        try:
+            turns, frames = encode_game_states(states)
+            write_replay(output_path, turns, frames, colors, enemies, game_move_logs, game_id)
+        except Exception as e:
+            print("[WARNING] Could not convert the game {}: {}".format(path, e))
+            continue
+        converted.append(output_path)
+    return converted
+
+
+# usage: python replayfile.py convert [directory of saved game states] [directory of move logs] [output directory]
+#        python replayfile.py list [directory of replay files]
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "convert":
+        directories = sys.argv[2:5] + ["./game_states", "./move_logs", "./replays"][len(sys.argv[2:5]):]
+        for path in convert_games(*directories):
+            print(path)
+    else:
+        for path in find_replays(sys.argv[2] if len(sys.argv) > 2 else "./replays"):
+            with ReplayFile(path) as replay_file:
+                print(path, replay_file.game_id, len(replay_file.get_turns()))
@@ -0,0 +1,14 @@
+import numpy as np
+
+
+# The weights final_move_scoring_function in SnakeDuo gives a move, also used by the search engines to score positions
+# food_distance_fraction is the distance to food divided by width + height, health goes from 0 to 100
+def get_move_weights(food_distance_fraction, increase_in_territory, distance_to_edge, health):
+    # health fraction
+    # 1 is about to die, 0 is full health
+    health_fraction = 1 - health / 100
+
+    edge_weight = -3 if distance_to_edge == 0 else 0
+    food_weight = np.exp(8*health_fraction - 4) * food_distance_fraction
+    territory_weight = max(-20, min(20, increase_in_territory)) / 10
+    return food_weight, territory_weight, edge_weight
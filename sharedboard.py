@@ -0,0 +1,89 @@
+import struct
+from collections import OrderedDict
+from multiprocessing import resource_tracker, shared_memory
+
+# every board in the segment starts with its length and a generation number,
+# so a worker can tell a board apart from an older one that was written at the same offset
+SLOT_HEADER = struct.Struct("<II")
+
+
+# A shared memory segment with the encoded boards of a game, read by the worker processes without copying
+# the board of a turn is written once, the tasks only carry the segment's name and the offset of the board
+# boards that change during a turn (after our first snake moved) are written after it, and writing starts over
+# at the beginning when the segment is full, which is safe because the worker pool is used synchronously
+class SharedBoardBuffer():
+    def __init__(self, size=1 << 16):
+        self.shared_memory = shared_memory.SharedMemory(create=True, size=size)
+        self.name = self.shared_memory.name
+        self.size = size
+        self.offset = 0
+        self.generation = 0
+        # the last board that was written, and where
+        self.last_data = None
+        self.last_offset = None
+
+    # writes an encoded board, unless it is the same as the last one, and returns its offset
+    def write(self, data):
+        if data == self.last_data:
+            return self.last_offset
+
+        needed = SLOT_HEADER.size + len(data)
+        if needed > self.size:
+            raise Exception("Encoded board of {} bytes does not fit in the shared buffer".format(len(data)))
+        if self.offset + needed > self.size:
+            self.offset = 0
+
+        offset = self.offset
+        self.generation += 1
+        buffer = self.shared_memory.buf
+        buffer[offset + SLOT_HEADER.size:offset + needed] = data
+        SLOT_HEADER.pack_into(buffer, offset, len(data), self.generation)
+
+        self.offset += needed
+        self.last_data = data
+        self.last_offset = offset
+        return offset
+
+    # starts over at the beginning of the segment with the board of a new turn
+    def rewrite(self, data):
+        self.offset = 0
+        self.last_data = None
+        return self.write(data)
+
+    def release(self):
+        if self.shared_memory is None:
+            return
+        self.shared_memory.close()
+        self.shared_memory.unlink()
+        self.shared_memory = None
+
+
+# starts the resource tracker, which has to happen before the worker pool is forked so the workers share it,
+# otherwise every worker starts its own tracker, which unlinks the segments it attached to a second time when it exits
+def start_resource_tracker():
+    resource_tracker.ensure_running()
+
+
+# the segments a worker process has attached to, the least recently used ones are closed
+attached_segments = OrderedDict()
+MAX_ATTACHED_SEGMENTS = 8
+
+def attach(name):
+    segment = attached_segments.get(name)
+    if segment is None:
+        # workers share the resource tracker of the process that started them,
+        # so attaching registers the segment a second time, which the tracker ignores, and the team still unlinks it
+        segment = shared_memory.SharedMemory(name=name)
+        attached_segments[name] = segment
+        if len(attached_segments) > MAX_ATTACHED_SEGMENTS:
+            _, oldest = attached_segments.popitem(last=False)
+            oldest.close()
+    attached_segments.move_to_end(name)
+    return segment
+
+# returns a key that changes whenever another board is written at the offset, and a view of the encoded board
+def read_board(name, offset):
+    buffer = attach(name).buf
+    length, generation = SLOT_HEADER.unpack_from(buffer, offset)
+    start = offset + SLOT_HEADER.size
+    return (name, offset, generation), buffer[start:start + length]
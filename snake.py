@@ -1,5 +1,14 @@
 import math
 import board
+from collections import deque
+import zobrist
+from timebudget import SearchTimeout, check_deadline
+
+# removes one segment on a cell from a snake's body_counts
+def remove_segment(body_counts, cell):
+    count = body_counts.pop(cell)
+    if count > 1:
+        body_counts[cell] = count - 1
 
 class SnakeNetworkManager():
     def __init__(self, snake):
@@ -19,12 +28,57 @@ class SnakeNetworkManager():
         self.snake.on_end(game_state)
         return "ok"
 
+# everything needed to revert a single in place snake move
+class MoveRecord():
+    def __init__(self, snake):
+        self.snake = snake
+        self.head = snake.head
+        self.tail = snake.tail
+        self.body = snake.body
+        self.body_counts = snake.body_counts
+        self.is_dead = snake.is_dead
+        self.length = snake.length
+        self.health = snake.health
+        self.zobrist_hash = snake.board.zobrist_hash
+
+        self.new_head = None
+        self.popped_tail = None
+        self.ate_food = False
+        self.killed = False
+        self.cell_states = []
+        self.uncovered_cells = []
+    
+    def save_cell(self, cell):
+        self.cell_states.append((cell, cell.get_snake_state()))
+    
+    def undo(self):
+        for cell, state in reversed(self.cell_states):
+            cell.restore_snake_state(state)
+        self.snake.board.uncovered_cells = self.uncovered_cells
+
+        if not self.is_dead:
+            if not self.killed:
+                remove_segment(self.body_counts, self.body.popleft())
+            if self.popped_tail is not None:
+                self.body.append(self.popped_tail)
+                self.body_counts[self.popped_tail] = self.body_counts.get(self.popped_tail, 0) + 1
+
+        snake = self.snake
+        snake.body = self.body
+        snake.body_counts = self.body_counts
+        snake.head = self.head
+        snake.tail = self.tail
+        snake.is_dead = self.is_dead
+        snake.length = self.length
+        snake.health = self.health
+        snake.board.zobrist_hash = self.zobrist_hash
+
 class Snake():
     def __init__(self, client_id):
         self.client_id = client_id 
         self.is_enemy = True 
         self.is_dead = False
-        self.body = []
+        self.set_body([])
         self.head = None
         self.tail = None
     
@@ -34,17 +88,29 @@ class Snake():
             self.board.add_snake(self)
 
 
+    # the body is a deque from head to tail, and body_counts has the number of segments on each of its cells,
+    # so moves only touch the ends of the body, and a tail stacked after eating is found without searching the body
+    def set_body(self, cells):
+        self.body_counts = {}
+        if cells is None:
+            self.body = None
+            return
+        self.body = deque(cells)
+        for cell in self.body:
+            self.body_counts[cell] = self.body_counts.get(cell, 0) + 1
+
     def update_state(self, snake_info):
         self.health = snake_info["health"]
         self.length = snake_info["length"]
 
-        self.body = [self.board.get_cell(cell["x"], cell["y"]) for cell in snake_info["body"]]
+        self.set_body(self.board.get_cell(cell["x"], cell["y"]) for cell in snake_info["body"])
         self.tail = self.body[-1]
         self.head = self.board.get_cell(snake_info["head"]["x"], snake_info["head"]["y"])
 
         self.color = snake_info["customizations"]["color"]
 
         self.board.place_snake(self)
+        self.board.rehash()
     
     def move(self, direction):
         if self.is_dead:
@@ -63,7 +129,13 @@ class Snake():
             return
         
         if not new_head.is_food():
+            self.board.zobrist_hash ^= zobrist.length_key(self.client_id, len(self.body)) ^ zobrist.length_key(self.client_id, len(self.body) - 1)
+            if len(self.body) > 1:
+                next_cell = self.body[-2]
+                self.board.zobrist_hash ^= zobrist.body_key(self.client_id, self.tail.x, self.tail.y, next_cell.x, next_cell.y)
             self.body.pop()
+            remove_segment(self.body_counts, self.tail)
+            # a tail that was stacked is cleared too, see apply_move
             self.tail.clear_snake_info()
             self.tail = self.body[-1]
 
@@ -72,12 +144,81 @@ class Snake():
         if new_head.is_occupied():
             self.kill()
             return
-        self.body.insert(0, new_head)
+        # the old head becomes the segment behind the new one, unless it was the tail that just left
+        if len(self.body) > 0:
+            self.board.zobrist_hash ^= zobrist.body_key(self.client_id, self.head.x, self.head.y, new_head.x, new_head.y)
+        self.board.zobrist_hash ^= (
+            zobrist.head_key(self.client_id, self.head.x, self.head.y) ^
+            zobrist.head_key(self.client_id, new_head.x, new_head.y) ^
+            zobrist.length_key(self.client_id, len(self.body)) ^
+            zobrist.length_key(self.client_id, len(self.body) + 1)
+        )
+        self.body.appendleft(new_head)
+        self.body_counts[new_head] = self.body_counts.get(new_head, 0) + 1
         self.head = new_head 
         new_head.set_snake(self, True)
+    
+    # makes the same move as move, but records it on the board's undo stack
+    # so that it can be reverted with undo_move instead of copying the board
+    def apply_move(self, direction):
+        record = MoveRecord(self)
+
+        record.uncovered_cells = self.board.uncovered_cells
+        self.board.uncovered_cells = []
+        for cell, snake in record.uncovered_cells:
+            if not snake.is_dead and cell.snake is None:
+                record.save_cell(cell)
+                cell.set_snake(snake, cell == snake.head)
+
+        if not self.is_dead:
+            coordinate_offset = {
+                "up": (0, 1),
+                "down": (0, -1),
+                "left": (-1, 0),
+                "right": (1, 0)
+            }[direction]
+            new_head = self.board.get_cell(self.head.x + coordinate_offset[0], self.head.y + coordinate_offset[1])
+
+            # only cells that the move can touch are saved,
+            # the whole body is only saved when the move might kill the snake
+            if new_head is None or new_head.is_occupied():
+                for cell in self.body:
+                    record.save_cell(cell)
+            else:
+                record.save_cell(self.head)
+                record.save_cell(self.tail)
+
+            if new_head is not None:
+                record.save_cell(new_head)
+                record.ate_food = new_head.is_food()
+                if not record.ate_food:
+                    record.popped_tail = self.tail
+
+            self.move(direction)
+
+            record.killed = self.is_dead
+            if not record.killed:
+                record.new_head = self.head
+                # a popped tail that was stacked on another segment clears a cell the snake still covers,
+                # the cell is given back before the next move, like copying the board would do
+                popped_tail = record.popped_tail
+                if popped_tail is not None and popped_tail in self.body_counts:
+                    self.board.uncovered_cells.append((popped_tail, self))
+
+        self.board.undo_stack.append(record)
+        return record
+    
+    # reverts the last move made with apply_move, which has to be a move of this snake
+    def undo_move(self):
+        record = self.board.undo_stack[-1]
+        if record.snake is not self:
+            raise Exception("Last move on the undo stack belongs to snake {}".format(record.snake.client_id))
+        return self.board.undo_move()
 
     
     def kill(self):
+        if not self.is_dead:
+            self.board.zobrist_hash ^= zobrist.snake_hash(self) ^ zobrist.dead_key(self.client_id)
         if self.body is not None:
             for cell in self.body:
                 cell.clear_snake_info()
@@ -85,7 +226,7 @@ class Snake():
         self.length = 0
         self.health = 0
         self.head = None
-        self.body = None
+        self.set_body(None)
         self.tail = None
     
     def get_distance_to(self, x, y):
@@ -94,11 +235,17 @@ class Snake():
     def get_head_cell(self, board):
         return board.get_cell(self.head["x"], self.head["y"])
     
-    def get_moves_without_future_death(self, prediction_depth=10):
+    def get_moves_without_future_death(self, prediction_depth=10, deadline=None):
+        table_key = ("moves without future death", self.board.get_state_key(), self.client_id, prediction_depth)
+        moves_without_death = zobrist.transposition_table.get(table_key)
+        if moves_without_death is not None:
+            return list(moves_without_death)
+
         moves_without_death = []
         for move in ["up", "down", "left", "right"]:
-            if len(self.alternative_futures(move, max_depth=prediction_depth)) >= prediction_depth:
+            if self.get_survival_depth(move, max_depth=prediction_depth, deadline=deadline) >= prediction_depth:
                 moves_without_death.append(move)
+        zobrist.transposition_table.put(table_key, tuple(moves_without_death))
         return moves_without_death
     
     def distance_to_edge(self):
@@ -139,22 +286,20 @@ class Snake():
     
 
     
-    def other_snake_will_die_because_of_move(self, move):
-        depth = 10
-        snakes_that_die_either_way = []
+    def other_snake_will_die_because_of_move(self, move, depth=10, deadline=None):
         other_snakes = self.get_other_snakes()
         if len(other_snakes) == 0:
             return []
-        for snake in other_snakes:
-            if len(snake.get_moves_without_future_death(prediction_depth=depth)) == 0:
-                snakes_that_die_either_way.append(snake.client_id)
+        snakes_that_die_either_way = self.board.get_doomed_snakes(depth, deadline=deadline)
 
         snakes_that_will_die_after_my_move = []
-        moved_snake = self.simulate_move(move)
-        for snake in other_snakes:
-            new_snake = moved_snake.board.get_snake(snake.client_id)
-            if len(new_snake.get_moves_without_future_death(prediction_depth=depth)) == 0:
-                snakes_that_will_die_after_my_move.append(snake.client_id)
+        self.apply_move(move)
+        try:
+            for snake in other_snakes:
+                if len(snake.get_moves_without_future_death(prediction_depth=depth, deadline=deadline)) == 0:
+                    snakes_that_will_die_after_my_move.append(snake.client_id)
+        finally:
+            self.undo_move()
         
         snakes_that_die_because_of_my_move = []
         for snake in snakes_that_will_die_after_my_move:
@@ -164,10 +309,135 @@ class Snake():
         return snakes_that_die_because_of_my_move
 
 
+    # the kill detection of other_snake_will_die_because_of_move, one depth deeper at a time until the deadline
+    # returns the result of the deepest depth that was searched completely, and that depth
+    def other_snake_will_die_because_of_move_until(self, move, deadline, max_depth=10):
+        snakes_that_die = self.other_snake_will_die_because_of_move(move, depth=1)
+        searched_depth = 1
+        for depth in range(2, max_depth + 1):
+            try:
+                snakes_that_die = self.other_snake_will_die_because_of_move(move, depth=depth, deadline=deadline)
+            except SearchTimeout:
+                break
+            searched_depth = depth
+        return snakes_that_die, searched_depth
+
     def get_death_timer(self, move, max_depth=10):
-        return len(self.alternative_futures(move, max_depth=max_depth))
+        return self.get_survival_depth(move, max_depth=max_depth)
+
+    # the death timer of the move, one depth deeper at a time until the deadline
+    # returns the survival depth and the depth it is known to, a snake that dies before the searched depth is known to any depth
+    # the depths up to min_depth are always searched, so even when the deadline has already passed, a move that is
+    # known to survive was searched deep enough to tell it apart from a move that only survives the next turn
+    def get_death_timer_until(self, move, deadline, max_depth=10, min_depth=1):
+        min_depth = max(1, min(min_depth, max_depth))
+        survival_depth = self.get_survival_depth(move, max_depth=min_depth)
+        searched_depth = min_depth
+        for depth in range(min_depth + 1, max_depth + 1):
+            if survival_depth < searched_depth:
+                break
+            try:
+                survival_depth = self.get_survival_depth(move, max_depth=depth, deadline=deadline)
+            except SearchTimeout:
+                break
+            searched_depth = depth
+        if survival_depth < searched_depth:
+            return survival_depth, max_depth
+        return survival_depth, searched_depth
+
+    # returns how many moves the snake can make before it dies, at most max_depth
+    # positions that were searched before are answered from the transposition table
+    # raises SearchTimeout when the deadline passes before the search is done
+    def get_survival_depth(self, direction, max_depth=10, deadline=None):
+        table_key = ("survival depth", self.board.get_state_key(), self.client_id, direction, max_depth)
+        survival_depth = zobrist.transposition_table.get(table_key)
+        if survival_depth is None:
+            survival_depth = self.find_survival_depth(direction, max_depth, deadline)
+            zobrist.transposition_table.put(table_key, survival_depth)
+        return survival_depth
+
+    # the search is only run when the survival bounds of the move do not agree
+    def find_survival_depth(self, direction, max_depth=10, deadline=None):
+        check_deadline(deadline)
+        _, lower_bound, upper_bound = self.get_survival_bounds(direction, max_depth)
+        if lower_bound == upper_bound:
+            return lower_bound
+        return self.search_survival_depth(direction, max_depth, deadline=deadline)
+
+    # returns the area the snake can reach within max_depth turns after the move,
+    # and a lower and upper bound on the depth search_survival_depth finds for the move
+    # the lower bound is a path through squares that are free now,
+    # the upper bound comes from the squares that are free by the time the head can get there:
+    # the first moves after the move can not visit a square twice, so the snake can not make more of them than there are squares
+    def get_survival_bounds(self, direction, max_depth=10):
+        if max_depth <= 0 or self.is_dead:
+            return 0, 0, 0
 
-    # returns how many moves the snake can make before it dies
+        coordinate_offset = {
+            "up": (0, 1),
+            "down": (0, -1),
+            "left": (-1, 0),
+            "right": (1, 0)
+        }[direction]
+        x, y = self.head.x + coordinate_offset[0], self.head.y + coordinate_offset[1]
+
+        reached_counts = self.board.tail_aware_flood_fill(self, x, y, max_depth)
+        if reached_counts[0] == 0:
+            return 0, 0, 0
+
+        upper_bound = max_depth
+        for turn, reached_count in enumerate(reached_counts[:len(self.body)], 1):
+            if reached_count < turn:
+                upper_bound = reached_count
+                break
+
+        lower_bound = 0
+        cell = self.board.get_cell(x, y)
+        if not cell.is_occupied():
+            lower_bound = 1 + self.board.free_path_length(x, y, max_depth - 1)
+        
+        return reached_counts[-1], lower_bound, upper_bound
+
+    # searches the same futures as alternative_futures, but moves the snake in place
+    # and undoes the moves afterwards, so no boards are copied
+    def search_survival_depth(self, direction, max_depth=10, depth=0, deadline=None):
+        if depth >= max_depth:
+            return depth
+        check_deadline(deadline)
+        self.apply_move(direction)
+        if self.is_dead:
+            self.undo_move()
+            return depth
+
+        try:
+            best_depth = depth + 1 + self.get_remaining_survival_depth(max_depth - depth - 1, deadline)
+        finally:
+            self.undo_move()
+        return best_depth
+
+    # how many more moves the snake can make from the current position, at most remaining_depth
+    # the positions inside the search are kept in the transposition table too, so a position that is reached
+    # by different orders of moves is only searched once per remaining depth
+    def get_remaining_survival_depth(self, remaining_depth, deadline=None):
+        if remaining_depth <= 0:
+            return 0
+        table_key = ("remaining survival depth", self.board.get_state_key(), self.client_id, remaining_depth)
+        survival_depth = zobrist.transposition_table.get(table_key)
+        if survival_depth is not None:
+            return survival_depth
+
+        survival_depth = 0
+        for move in self.get_free_moves():
+            future_depth = self.search_survival_depth(move, remaining_depth, 0, deadline)
+            if future_depth >= remaining_depth:
+                survival_depth = future_depth
+                break
+            survival_depth = max(survival_depth, future_depth)
+        zobrist.transposition_table.put(table_key, survival_depth)
+        return survival_depth
+
+    # returns the boards of the longest future the snake can survive
+    # every step is a copy of the board, use get_survival_depth when only the length is needed
     def alternative_futures(self, direction, move_history = None, max_depth=10):
         if move_history is None:
             move_history = []
@@ -223,7 +493,7 @@ class Snake():
         new_snake.health = self.health
         new_snake.length = self.length
         if not new_snake.is_dead:
-            new_snake.body = [board.get_cell(cell.x, cell.y) for cell in self.body]
+            new_snake.set_body(board.get_cell(cell.x, cell.y) for cell in self.body)
             new_snake.tail = board.get_cell(self.tail.x, self.tail.y)
             new_snake.head = board.get_cell(self.head.x, self.head.y)
         new_snake.color = self.color
@@ -276,11 +546,7 @@ class ControllableSnake():
         return {"move": move}
     
     def get_potential_territory_increase(self, move):
-        current_territory = self.team.board.b.get_territory_size([s.snake for s in self.team.snakes])
-        new_snake = self.snake.simulate_move(move)
-        new_board = new_snake.board
-        new_territory = new_board.get_territory_size([new_board.snake_map[s.client_id] for s in self.team.snakes])
-        return new_territory - current_territory
+        return self.team.board.b.get_territory_increases([s.snake for s in self.team.snakes], self.snake)[move]
     
     def get_safe_moves(self, board):
         if self.snake.is_dead:
@@ -318,17 +584,15 @@ class ControllableSnake():
     
     # finds the x,y-tuple where the closest food is located (manhattan distance)
     def get_closest_food_pos(self, board):
-        # go through every cell and find all food (perhaps this should be precalculated in board for faster )
+        # the board keeps the positions of the food, sorted they are in the same order as the cells
         closest_food = {"distance":math.inf, "cell":None}
         if self.snake.is_dead:
             return closest_food
-        for row in board.b.cells:
-            for cell in row:
-                if cell.is_food():
-                    cell_distance = abs(self.snake.head.x - cell.x) + abs(self.snake.head.y - cell.y)
-                    if(cell_distance < closest_food["distance"]):
-                        closest_food["cell"] = cell
-                        closest_food["distance"] = cell_distance
+        for x, y in sorted(board.food_positions):
+            cell_distance = abs(self.snake.head.x - x) + abs(self.snake.head.y - y)
+            if(cell_distance < closest_food["distance"]):
+                closest_food["cell"] = board.b.get_cell(x, y)
+                closest_food["distance"] = cell_distance
         return closest_food
     
     def get_direction_of_food(self, board):
@@ -4,19 +4,91 @@ import math
 from collections import defaultdict
 import random
 import json
-from tqdm import trange
 import os
 from datetime import datetime
 from copy import copy
 import numpy as np
 import time
-from multiprocessing import Pool
+import zobrist
+import encoding
+import sharedboard
+import computepool
+import journal
+import replay
+from history import BoardHistory
+import scoring
+from alphabeta import AlphaBetaEngine
+from mcts import MCTSEngine
+from timebudget import TurnBudget, SearchTimeout
+
+# the searches that the worker processes can run, by name
+WORKER_SEARCHES = {
+    "get_death_timer": Snake.get_death_timer,
+    "get_death_timer_until": Snake.get_death_timer_until,
+    "other_snake_will_die_because_of_move": Snake.other_snake_will_die_because_of_move,
+    "other_snake_will_die_because_of_move_until": Snake.other_snake_will_die_because_of_move_until,
+}
+
+# the board a worker process decoded last, the other tasks of the same turn use it again
+worker_board = None
+worker_board_key = None
+
+# board_ref is an encoded board, or the name of a shared memory segment and the offset of the board in it
+def get_worker_board(board_ref):
+    global worker_board, worker_board_key
+    if isinstance(board_ref, bytes):
+        if board_ref != worker_board_key:
+            worker_board = encoding.decode_board(board_ref)
+            worker_board_key = board_ref
+        return worker_board
+
+    key, view = sharedboard.read_board(*board_ref)
+    # the view has to be released even if the board can not be decoded, or the segment can not be closed
+    try:
+        if key != worker_board_key:
+            worker_board = encoding.decode_board(view)
+            worker_board_key = key
+    finally:
+        view.release()
+    return worker_board
+
+# runs a search in a worker process on the board rebuilt from its encoding,
+# and reports how much the worker's transposition table was used for it
+def run_search(task):
+    search_name, board_ref, client_id, move, kwargs = task
+    snake = get_worker_board(board_ref).snake_map[client_id]
+    table = zobrist.transposition_table
+    hits, misses = table.hits, table.misses
+    result = WORKER_SEARCHES[search_name](snake, move, **kwargs)
+    return result, table.hits - hits, table.misses - misses
 
 class SnakeDuo():
-    def __init__(self, name, color, snake1, snake2, save_replay=False):
+    def __init__(self, name, color, snake1, snake2, save_replay=False, board_class=GBoard, anytime=True, max_search_depth=20, min_search_depth=5, engine="heuristic", compute=None, replays=None):
         self.name = name
         self.color = color
         self.save_replay = save_replay
+        # the board engine used for the team's board, GeneralBoard or BitBoard
+        self.board_class = board_class
+        # in anytime mode the searches deepen until the turn's time budget runs out, up to max_search_depth,
+        # otherwise they search to depth 10
+        self.anytime = anytime
+        self.max_search_depth = max_search_depth
+        # the death timers are always searched to min_search_depth, even when the turn's time is up,
+        # so a move that survives one turn is not taken for a move without future death
+        self.min_search_depth = min_search_depth
+        self.turn_budget = TurnBudget()
+        self.search_phases_left = 0
+        self.timeout = 500
+        self.reported_latency = None
+        # the time in ms it took to decode the turn's request, set by the game worker, and to read it into the board
+        self.decode_time = 0
+        self.ingest_time = 0
+        # when the server received the turn's request, set by the game worker, the turn's time budget starts then
+        self.request_time = None
+        # "heuristic" picks every snake's move with the heuristic tree in calculate_move,
+        # "alphabeta" searches the joint moves of both snakes with AlphaBetaEngine,
+        # "mcts" runs MCTSEngine in the worker pool
+        self.engine = engine
 
         self.snake1 = snake1
         self.snake2 = snake2
@@ -31,7 +103,8 @@ class SnakeDuo():
 
         self.board = None
 
-        self.board_history = []
+        # the boards of the game's turns, only recorded for the replay, see history.BoardHistory
+        self.board_history = BoardHistory()
 
         self.snake1_has_ended = False
         self.snake2_has_ended = False
@@ -43,7 +116,26 @@ class SnakeDuo():
 
         self.move_logs = []
 
-        self.worker_pool = Pool(processes=4)
+        # the client of the server's compute pool that runs the team's searches, see computepool.ComputePool
+        # without one the team uses the pool of its process
+        self.compute = compute if compute is not None else computepool.get_local_client()
+        # the client of the server's replay renderer that saves the team's replays, see replay.ReplayRenderer
+        # without one the team uses the renderer of its process, which is only started by the first replay
+        self.replays = replays
+        # the shared memory segment the workers read the game's boards from, see initialize_team
+        self.shared_board = None
+        # the last board reference the workers got, and the key of the board it was made from, see get_board_ref
+        self.board_ref = None
+        self.board_ref_key = None
+
+        if engine == "heuristic":
+            self.search_engine = None
+        elif engine == "alphabeta":
+            self.search_engine = AlphaBetaEngine()
+        elif engine == "mcts":
+            self.search_engine = MCTSEngine(pool=self.compute, workers=self.compute.processes)
+        else:
+            raise Exception("Unknown engine: {}".format(engine))
 
     
     def snakes_initialized(self):
@@ -59,38 +151,111 @@ class SnakeDuo():
             game_state["board"]["width"], 
             game_state["board"]["height"],
             our_snakes=self.snakes,
-            all_snakes_json=game_state["board"]["snakes"]
+            all_snakes_json=game_state["board"]["snakes"],
+            board_class=self.board_class
         )
 
         self.board.save_replay = self.save_replay
+        self.board_history = BoardHistory()
+
+        self.release_shared_board()
+        try:
+            self.shared_board = sharedboard.SharedBoardBuffer()
+        except OSError as e:
+            print("[WARNING] No shared memory for the worker pool, boards are sent with every task: {}".format(e))
+            self.shared_board = None
 
         self.update_state(game_state, force=True)
 
     
     def update_state(self, game_state, force=False):
         if force or (game_state["turn"] > self.turn and self.snakes_initialized()):
+            self.timeout = game_state["game"].get("timeout", 500)
+            self.reported_latency = self.get_reported_latency(game_state)
+
             # print snake latency
             # print("Snake 1 latency: " + str(game_state["board"]["snakes"][0]["latency"]))
             # print("Snake 2 latency: " + str(game_state["board"]["snakes"][1]["latency"]))
-            game_id = game_state["game"]["id"]
-            path = "./game_states/"+datetime.now().strftime("%Y-%m-%d_%H")+" (" + game_id[:3] + ")"
-            os.makedirs(path, exist_ok=True)
-            json.dump(game_state, open(path + "/" + str(game_state["turn"])+".json", "w"))
+            # the state is written to the game's journal file by a background thread
+            journal.get_journal().record(game_state["game"]["id"], game_state)
 
             self.turn = game_state["turn"]
             #print("--------------Turn start" + str(self.turn) + "--------------")
 
+            # our snakes are snakes of the board, so updating the board updates them too
+            t1_ingest = time.time()
             self.board.update_state(game_state["board"])
+            self.ingest_time = self.decode_time + (time.time() - t1_ingest)*1000
 
             for snake in self.snakes:
                 for snake_info in game_state["board"]["snakes"]:
                     if snake_info["id"] == snake.client_id:
                         snake.made_move = False
-                        snake.snake.update_state(snake_info)
                         break
+
+            self.board_ref_key = None
+            if self.shared_board is not None:
+                self.board_ref = (self.shared_board.name, self.shared_board.rewrite(encoding.encode_board(self.board.b)))
+                self.board_ref_key = self.get_board_ref_key()
             
             
     
+    def release_shared_board(self):
+        if self.shared_board is not None:
+            self.shared_board.release()
+            self.shared_board = None
+        self.board_ref_key = None
+
+    # changes whenever the encoding of the board changes: the snakes, food and hazards are in the board's hash,
+    # and the cache of doomed snakes is only added to, until update_state replaces it
+    def get_board_ref_key(self):
+        board = self.board.b
+        return board.get_state_key(), id(board.doomed_snakes), len(board.doomed_snakes)
+
+    # the board as the workers get it, see get_worker_board, it is only encoded and written again
+    # when it changed since the last search, like after our first snake moved
+    def get_board_ref(self, ipc_stats):
+        key = self.get_board_ref_key()
+        if key != self.board_ref_key:
+            t1_encode = time.time()
+            board_ref = encoding.encode_board(self.board.b)
+            ipc_stats["encoded_bytes"] = len(board_ref)
+            if self.shared_board is not None:
+                board_ref = (self.shared_board.name, self.shared_board.write(board_ref))
+            self.board_ref = board_ref
+            self.board_ref_key = key
+            ipc_stats["encodes"] += 1
+            ipc_stats["encode"] += (time.time() - t1_encode)*1000
+        return self.board_ref
+
+    # the latency the game measured for our last moves, None before the first move
+    def get_reported_latency(self, game_state):
+        latencies = []
+        for snake_info in game_state["board"]["snakes"]:
+            if snake_info["id"] in [snake.client_id for snake in self.snakes]:
+                try:
+                    latencies.append(float(snake_info.get("latency", "")))
+                except ValueError:
+                    pass
+        latencies = [latency for latency in latencies if latency > 0]
+        if len(latencies) == 0:
+            return None
+        return max(latencies)
+
+    # the deadline of the next search, the time left in the turn is shared between the searches that are left
+    def get_search_deadline(self):
+        deadline = self.turn_budget.get_phase_deadline(self.search_phases_left)
+        self.search_phases_left = max(0, self.search_phases_left - 1)
+        return deadline
+
+    # fills the board's cache of snakes that die either way, one depth deeper at a time until the deadline
+    def prepare_doomed_snakes(self, deadline):
+        for depth in range(1, self.max_search_depth + 1):
+            try:
+                self.board.b.get_doomed_snakes(depth, deadline=deadline)
+            except SearchTimeout:
+                break
+    
     def set_snake_move(self, snake, move, reason=None):
         if move is not None:
             move_log = {
@@ -124,11 +289,37 @@ class SnakeDuo():
         elif snake == self.snake2:
             return self.snake1
     
+    # runs a search for every move in the compute pool, the search's deadline decides when it gets a worker
+    # and adds the transposition table hits and misses of the workers to table_stats
+    # the workers get the board as an encoding instead of a pickled snake, ipc_stats keeps its size and the time it took
+    # the encoding is written to the game's shared memory segment when there is one, and the tasks only carry its offset
+    def map_moves(self, search_name, snake, table_stats, ipc_stats, **kwargs):
+        board_ref = self.get_board_ref(ipc_stats)
+        tasks = [(search_name, board_ref, snake.client_id, move, kwargs) for move in ["up", "down", "left", "right"]]
+        ipc_stats["tasks"] += len(tasks)
+
+        try:
+            mapped = self.compute.map(run_search, tasks, deadline=kwargs.get("deadline"))
+        except SearchTimeout:
+            # the pool did not answer in time, like when one of its worker processes died, the searches run here instead,
+            # after their deadline they only search the depths they always search
+            print("[WARNING] The compute pool did not answer the {} searches in time".format(search_name))
+            return [WORKER_SEARCHES[search_name](snake, move, **kwargs) for move in ["up", "down", "left", "right"]]
+
+        results = []
+        for result, hits, misses in mapped:
+            results.append(result)
+            table_stats["hits"] += hits
+            table_stats["misses"] += misses
+        return results
+
     def calculate_move(self, snake):
         if snake.snake.is_dead:
             return None
 
         self.set_snake_move(snake, "up", reason="default")
+        table_stats = {"hits": 0, "misses": 0}
+        ipc_stats = {"tasks": 0, "encodes": 0, "encoded_bytes": 0, "encode": 0}
 
 
         other_snake = self.get_other_snake(snake)
@@ -136,7 +327,17 @@ class SnakeDuo():
         moves_that_kill_enemy = []
 
         t1_other_snake_die = time.time()
-        future_dead_snakes_per_move = self.worker_pool.map(snake.snake.other_snake_will_die_because_of_move, ["up", "down", "left", "right"])
+        # the snakes that die either way are found once here, the workers get them with the board
+        if self.anytime:
+            deadline = self.get_search_deadline()
+            self.prepare_doomed_snakes(time.time() + (deadline - time.time()) / 4)
+            results = self.map_moves("other_snake_will_die_because_of_move_until", snake.snake, table_stats, ipc_stats, deadline=deadline, max_depth=self.max_search_depth)
+            future_dead_snakes_per_move = [future_dead_snakes for future_dead_snakes, _ in results]
+            kill_search_depth = min(searched_depth for _, searched_depth in results)
+        else:
+            self.board.b.get_doomed_snakes()
+            future_dead_snakes_per_move = self.map_moves("other_snake_will_die_because_of_move", snake.snake, table_stats, ipc_stats)
+            kill_search_depth = 10
 
         for move, future_dead_snakes in zip(["up", "down", "left", "right"], future_dead_snakes_per_move):
             for dead_snake in future_dead_snakes:
@@ -173,19 +374,25 @@ class SnakeDuo():
         moves_without_certain_future_death = []
         moves_with_death_counter = []
         moves_with_death_counter_map = {}
-        death_timers = self.worker_pool.map(snake.snake.get_death_timer, ["up", "down", "left", "right"])
+        if self.anytime:
+            # every move is compared at the depth that all of them were searched to
+            results = self.map_moves("get_death_timer_until", snake.snake, table_stats, ipc_stats, deadline=self.get_search_deadline(), max_depth=self.max_search_depth, min_depth=self.min_search_depth)
+            death_timer_search_depth = min(searched_depth for _, searched_depth in results)
+            death_timers = [min(death_timer, death_timer_search_depth) for death_timer, _ in results]
+        else:
+            death_timers = self.map_moves("get_death_timer", snake.snake, table_stats, ipc_stats)
+            death_timer_search_depth = 10
         for move, death_timer in zip(["up", "down", "left", "right"], death_timers):
             moves_with_death_counter.append((move, death_timer))
             moves_with_death_counter_map[move] = death_timer
-            if death_timer == 10:
+            if death_timer == death_timer_search_depth:
                 moves_without_certain_future_death.append(move)
         t2_death_timer = time.time()
         
         t1_territory_increase = time.time()
         distance_to_closest_food_map = {}
-        territory_size_increases = {}
+        territory_size_increases = self.board.b.get_territory_increases([s.snake for s in self.snakes], snake.snake)
         for move in ["up", "down", "left", "right"]:
-            territory_size_increases[move] = snake.get_potential_territory_increase(move)
             distance_to_closest_food_map[move] = distance_to_closest_food + 1 * (
                 1 if move in moves_in_direction_of_food else -1
             )
@@ -218,7 +425,15 @@ class SnakeDuo():
             "moves_that_kill_teammate": moves_that_kill_teammate,
             "moves_that_kill_enemy": moves_that_kill_enemy,
             "state_information": state_information,
+            "transposition_table": table_stats,
+            "ipc": ipc_stats,
+            "search_depths": {
+                "other_snake_die": kill_search_depth,
+                "death_timer": death_timer_search_depth,
+            },
+            "turn_budget": self.turn_budget.get_stats(),
             "times": {
+                "ingest": self.ingest_time,
                 "other_snake_die": (t2_other_snake_die - t1_other_snake_die)*1000,
                 "move_food": (t2_move_food - t1_move_food)*1000,
                 "safe_move": (t2_safe_move - t1_safe_move)*1000,
@@ -366,15 +581,12 @@ class SnakeDuo():
                 # 1 is very close, 0 is very far
                 # something is weird
                 food_distance_fraction = state_information[move]["food_distance"] / (self.board.width + self.board.height)
-                # health fraction
-                # 1 is about to die, 0 is full health
-                health_fraction = 1 - snake.snake.health / 100
-                #print("move: " + move, "food_distance_fraction: " + str(food_distance_fraction), "health_fraction: " + str(health_fraction))
-
-
-                edge_weight = -3 if state_information[move]["distance_to_edge"] == 0 else 0
-                food_weight = np.exp(8*health_fraction - 4) * food_distance_fraction 
-                territory_weight = max(-20, min(20, state_information[move]["increase_in_territory"])) / 10
+                food_weight, territory_weight, edge_weight = scoring.get_move_weights(
+                    food_distance_fraction,
+                    state_information[move]["increase_in_territory"],
+                    state_information[move]["distance_to_edge"],
+                    snake.snake.health
+                )
 
                 move_scores[move] = food_weight + territory_weight + edge_weight
                 move_score_information[move]["food_weight"] = food_weight
@@ -598,11 +810,39 @@ class SnakeDuo():
         for snake in self.snakes:
             self.set_snake_move(snake, None)
 
-        for snake in self.snakes:
-            self.calculate_move(snake)
+        # the turn is recorded as its state arrived, before our snakes move, see replayfile
+        self.append_board_history()
 
+        self.turn_budget.start_turn(self.timeout, self.reported_latency, self.request_time)
+        self.compute.set_deadline(self.turn_budget.deadline)
+        if self.search_engine is not None:
+            self.calculate_moves_with_engine()
+        else:
+            self.search_phases_left = 2 * len([snake for snake in self.snakes if not snake.snake.is_dead])
+            for snake in self.snakes:
+                self.calculate_move(snake)
+        self.turn_budget.end_turn()
+    
+    # picks the moves of both snakes at once with the team's search engine
+    def calculate_moves_with_engine(self):
+        living_snakes = [snake for snake in self.snakes if not snake.snake.is_dead]
+        if len(living_snakes) == 0:
+            return
 
-        self.append_board_history()
+        t1_search = time.time()
+        moves, info = self.search_engine.search(self.board.b, [snake.snake.client_id for snake in living_snakes], self.turn_budget.deadline)
+        t2_search = time.time()
+        info["times"] = {"ingest": self.ingest_time, "search": (t2_search - t1_search)*1000}
+        info["turn_budget"] = self.turn_budget.get_stats()
+
+        for snake in living_snakes:
+            self.set_snake_move(snake, moves[snake.snake.client_id], reason={
+                "text": "{} search".format(self.engine),
+                "info": info
+            })
+        for snake in living_snakes:
+            snake.make_move()
+            snake.made_move = True
     
     # This is the command that is sent to the server
     def get_move(self, snake):
@@ -614,14 +854,13 @@ class SnakeDuo():
             return None
     
     def append_board_history(self):
-
-        board_copy = self.board.b.copy()
-        #for cell in self.board.b.all_cells:
-            #print(cell.future)
-        self.board_history.append(board_copy)
+        if not self.save_replay:
+            return
+        self.board_history.record(self.board.b, self.turn)
     
     def on_end(self, game_state):
         game_id = game_state["game"]["id"]
+        journal.get_journal().close_game(game_id)
         if self.save_replay:
 
             path = "./move_logs/"+datetime.now().strftime("%Y-%m-%d_%H-%M-%S")+" (" + game_id[:3] + ")"
@@ -629,18 +868,17 @@ class SnakeDuo():
             json.dump(self.move_logs, open(path + "/move_logs.json", "w"), indent=4)
 
 
-            # create folder for game
+            # the replay is rendered in the background, the renderer creates the folder of the game
             path = "./replays/"+datetime.now().strftime("%Y-%m-%d_%H-%M-%S")+" (" + game_id[:3] + ")"
-            os.makedirs(path, exist_ok=True)
-
-            for i in trange(len(self.board_history), desc="Saving replay"):
-                self.board_history[i].save_to_img(path, i, res="high")
-            
-
-            self.board_history[-1].create_gif(path)
+            if self.replays is None:
+                self.replays = replay.get_local_client()
+            # the renderer also saves the turns and move logs of the game in one file, for the analysis of many games,
+            # see replayfile.ReplayFile
+            self.replays.submit_history(path, self.board_history, self.move_logs, game_id, res="high")
 
 
         
+        self.release_shared_board()
         self.game_ended = True
         
     
@@ -0,0 +1,146 @@
+import numpy as np
+
+# distance of squares that no snake can reach, the same value GeneralBoard.get_closest_snake starts from
+UNREACHABLE = 999999999
+
+
+# manhattan distance from every head to every square, as an array indexed [snake, x, y]
+def manhattan_distances(width, height, heads):
+    heads = np.array(heads, dtype=np.int64).reshape(-1, 2)
+    xs = np.arange(width)[None, :, None]
+    ys = np.arange(height)[None, None, :]
+    return np.abs(xs - heads[:, 0, None, None]) + np.abs(ys - heads[:, 1, None, None])
+
+# returns every square next to a square in the given [snake, x, y] masks
+def grow(masks):
+    grown = masks.copy()
+    grown[:, 1:, :] |= masks[:, :-1, :]
+    grown[:, :-1, :] |= masks[:, 1:, :]
+    grown[:, :, 1:] |= masks[:, :, :-1]
+    grown[:, :, :-1] |= masks[:, :, 1:]
+    return grown
+
+# shortest path distance from every head to every square, where walls[x, y] can not be crossed
+# all snakes are expanded together, one step per iteration
+def bfs_distances(width, height, heads, walls):
+    distances = np.full((len(heads), width, height), UNREACHABLE, dtype=np.int64)
+    reached = np.zeros((len(heads), width, height), dtype=bool)
+    for i, (x, y) in enumerate(heads):
+        reached[i, x, y] = True
+    distances[reached] = 0
+
+    passable = ~walls[None, :, :]
+    frontier = reached
+    distance = 0
+    while frontier.any():
+        distance += 1
+        frontier = grow(frontier) & passable & ~reached
+        distances[frontier] = distance
+        reached |= frontier
+    return distances
+
+
+# The voronoi territory of a set of snake heads
+# closest[i, x, y] is true when snake i is (one of) the closest to square (x, y)
+class Territory():
+    def __init__(self, distances, width, height):
+        self.distances = distances
+        if len(distances) > 0:
+            self.closest_distance = distances.min(axis=0)
+        else:
+            self.closest_distance = np.full((width, height), UNREACHABLE, dtype=np.int64)
+        self.closest = (distances == self.closest_distance) & (self.closest_distance < UNREACHABLE)
+        self.counts = self.closest.sum(axis=(1, 2))
+        self.ties = self.closest.sum(axis=0) > 1
+
+    # number of squares where any of the given snakes is one of the closest
+    def get_territory_size(self, indices):
+        if len(indices) == 0:
+            return 0
+        return int(self.closest[list(indices)].any(axis=0).sum())
+
+    # the closest snakes of every square as a bitmask of snake indices
+    def get_closest_masks(self):
+        weights = (1 << np.arange(len(self.distances), dtype=np.int64))[:, None, None]
+        return (self.closest * weights).sum(axis=0)
+
+
+# heads is a list of (x, y) tuples
+# mode "manhattan" ignores snake bodies, mode "bfs" treats walls[x, y] as squares that can not be crossed
+def compute_distances(width, height, heads, mode="manhattan", walls=None):
+    if mode == "manhattan":
+        return manhattan_distances(width, height, heads)
+    elif mode == "bfs":
+        if walls is None:
+            walls = np.zeros((width, height), dtype=bool)
+        return bfs_distances(width, height, heads, walls)
+    raise Exception("Unknown territory mode: {}".format(mode))
+
+def compute_territory(width, height, heads, mode="manhattan", walls=None):
+    return Territory(compute_distances(width, height, heads, mode=mode, walls=walls), width, height)
+
+
+# The territory of a team, computed once, and how it changes when a single head moves
+# only the squares where the moved snake is one of the closest, before or after the move, are compared,
+# the owner of every other square does not depend on that snake
+class TerritoryDelta():
+    def __init__(self, width, height, heads, team_indices, mode="manhattan", walls=None):
+        self.width = width
+        self.height = height
+        self.heads = list(heads)
+        self.mode = mode
+        self.territory = compute_territory(width, height, heads, mode=mode, walls=walls)
+        self.is_team = np.zeros(len(heads), dtype=bool)
+        self.is_team[list(team_indices)] = True
+        self.owned = self.get_owned(self.territory.distances, self.is_team)
+        self.baseline = int(self.owned.sum())
+        self.other_distances = {}
+
+    # squares where one of the team's snakes is one of the closest
+    @staticmethod
+    def get_owned(distances, is_team):
+        unreachable = np.full(distances.shape[1:], UNREACHABLE)
+        team_distance = distances[is_team].min(axis=0) if is_team.any() else unreachable
+        enemy_distance = distances[~is_team].min(axis=0) if (~is_team).any() else unreachable
+        return (team_distance <= enemy_distance) & (team_distance < UNREACHABLE)
+
+    # the closest team and enemy distance to every square, without the given snake
+    def get_other_distances(self, index):
+        if index not in self.other_distances:
+            distances = self.territory.distances
+            others = np.arange(len(distances)) != index
+            team = others & self.is_team
+            enemies = others & ~self.is_team
+            team_distance = distances[team].min(axis=0) if team.any() else np.full((self.width, self.height), UNREACHABLE)
+            enemy_distance = distances[enemies].min(axis=0) if enemies.any() else np.full((self.width, self.height), UNREACHABLE)
+            self.other_distances[index] = (team_distance, enemy_distance, np.minimum(team_distance, enemy_distance))
+        return self.other_distances[index]
+
+    # the change in team territory when snake index moves its head to new_head, or dies if new_head is None
+    # in bfs mode the walls after the move are needed, and the territory is calculated again
+    def get_delta(self, index, new_head, walls=None):
+        if self.mode != "manhattan":
+            heads = [head for i, head in enumerate(self.heads) if i != index or new_head is not None]
+            if new_head is not None:
+                heads[index] = new_head
+            is_team = np.array([team for i, team in enumerate(self.is_team) if i != index or new_head is not None], dtype=bool)
+            moved = compute_territory(self.width, self.height, heads, mode=self.mode, walls=walls)
+            return int(self.get_owned(moved.distances, is_team).sum()) - self.baseline
+
+        if new_head is None:
+            new_distance = np.full((self.width, self.height), UNREACHABLE)
+        else:
+            new_distance = manhattan_distances(self.width, self.height, [new_head])[0]
+
+        team_distance, enemy_distance, other_distance = self.get_other_distances(index)
+        old_distance = self.territory.distances[index]
+        changed = np.minimum(old_distance, new_distance) <= other_distance
+
+        team_distance = team_distance[changed]
+        enemy_distance = enemy_distance[changed]
+        if self.is_team[index]:
+            team_distance = np.minimum(team_distance, new_distance[changed])
+        else:
+            enemy_distance = np.minimum(enemy_distance, new_distance[changed])
+        owned = (team_distance <= enemy_distance) & (team_distance < UNREACHABLE)
+        return int(owned.sum()) - int(self.owned[changed].sum())
@@ -0,0 +1,61 @@
+import time
+from collections import deque
+
+
+# raised by a search when its deadline has passed
+class SearchTimeout(Exception):
+    pass
+
+
+def check_deadline(deadline):
+    if deadline is not None and time.time() > deadline:
+        raise SearchTimeout()
+
+
+# The time a turn may spend searching, derived from the game's timeout
+# a network margin and the network latency seen in earlier turns are kept free, so the move is not late
+# the latency the game reports for a turn includes our own processing time, which is subtracted again
+class TurnBudget():
+    def __init__(self, network_margin=50, min_budget=10, latency_history=10):
+        self.network_margin = network_margin
+        self.min_budget = min_budget
+        self.timeout = 500
+        self.network_latencies = deque(maxlen=latency_history)
+        self.processing_time = None
+        self.start = None
+        self.deadline = None
+
+    # latency is the latency the game reported for our previous move, in ms
+    # start is when the turn's request was received, so the time it waited and was read in is part of the turn, now by default
+    def start_turn(self, timeout, latency=None, start=None):
+        self.start = start if start is not None else time.time()
+        self.timeout = timeout
+        if latency is not None and self.processing_time is not None:
+            self.network_latencies.append(max(0, latency - self.processing_time))
+        self.deadline = self.start + self.get_budget() / 1000
+
+    def end_turn(self):
+        self.processing_time = (time.time() - self.start) * 1000
+
+    def get_network_latency(self):
+        if len(self.network_latencies) == 0:
+            return 0
+        return max(self.network_latencies)
+
+    # the time in ms that a turn may take
+    def get_budget(self):
+        return max(self.min_budget, self.timeout - self.network_margin - self.get_network_latency())
+
+    def remaining(self):
+        return max(0, self.deadline - time.time())
+
+    # the deadline of the next of phases_left searches, when the remaining time is shared equally
+    def get_phase_deadline(self, phases_left):
+        return time.time() + self.remaining() / max(1, phases_left)
+
+    def get_stats(self):
+        return {
+            "budget": self.get_budget(),
+            "network_latency": self.get_network_latency(),
+            "remaining": self.remaining() * 1000,
+        }
@@ -0,0 +1,106 @@
+import hashlib
+from collections import OrderedDict
+
+# Zobrist hashing of board states
+# every feature of a board (food on a square, a snake's body segment on a square, ...) has a random 64 bit key,
+# and the hash of a board is the xor of the keys of all its features, so moves can update it incrementally
+
+# the keys are derived from a hash of the feature instead of a random generator,
+# so every process computes the same keys and hashes can be compared between processes
+_keys = {}
+
+def get_key(*feature):
+    key = _keys.get(feature)
+    if key is None:
+        digest = hashlib.blake2b(repr(feature).encode(), digest_size=8).digest()
+        key = int.from_bytes(digest, "little")
+        _keys[feature] = key
+    return key
+
+def food_key(x, y):
+    return get_key("food", x, y)
+
+def hazard_key(x, y):
+    return get_key("hazard", x, y)
+
+# a body segment is keyed by its square and the square of the segment in front of it, so the keys of a body
+# only add up to the same hash for the same order of its segments, and a move only changes the keys at its ends
+def body_key(client_id, x, y, next_x, next_y):
+    return get_key("body", client_id, x, y, next_x, next_y)
+
+def head_key(client_id, x, y):
+    return get_key("head", client_id, x, y)
+
+def length_key(client_id, length):
+    return get_key("length", client_id, length)
+
+def dead_key(client_id):
+    return get_key("dead", client_id)
+
+# the part of a board's hash that comes from a snake
+def snake_hash(snake):
+    if snake.is_dead:
+        return dead_key(snake.client_id)
+    if snake.head is None:
+        return 0
+    h = head_key(snake.client_id, snake.head.x, snake.head.y) ^ length_key(snake.client_id, len(snake.body))
+    next_cell = None
+    for cell in snake.body:
+        if next_cell is not None:
+            h ^= body_key(snake.client_id, cell.x, cell.y, next_cell.x, next_cell.y)
+        next_cell = cell
+    return h
+
+def board_hash(board):
+    h = 0
+    for cell in board.all_cells:
+        if cell.food:
+            h ^= food_key(cell.x, cell.y)
+        if cell.hazard:
+            h ^= hazard_key(cell.x, cell.y)
+    for snake in board.snakes:
+        h ^= snake_hash(snake)
+    return h
+
+
+# A size bounded cache of search results, keyed by tuples that start with a board hash
+# when it is full the least recently used entry is evicted
+class TranspositionTable():
+    def __init__(self, max_size=65536):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        if key not in self.entries:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return self.entries[key]
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def get_stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self.entries),
+        }
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+# the table used by the searches in snake.py, every worker process has its own
+transposition_table = TranspositionTable()